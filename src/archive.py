@@ -0,0 +1,248 @@
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from src.settings import settings
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+import httpx
+
+# response headers worth replaying, the body is stored decoded
+KEPT_HEADERS = ('content-type', 'etag', 'last-modified')
+# bodies being recorded are kept in memory up to this size, then on disk
+SPOOL_BYTES = 1024 * 1024
+
+
+class Archive:
+    """Content-addressed store of fetched response bodies.
+
+    Bodies are zlib-compressed under ``blobs/<sha256>``, so a page that did
+    not change between runs is stored once. Each run appends one JSON line
+    per response to ``runs/<run id>.jsonl`` mapping the request (method, URL
+    and payload hash) to its status, headers and blob. ``replay`` serves a
+    recorded run back without touching the network.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.run_id: Optional[str] = None
+        self.manifest = None
+        # request key -> manifest entry, set in offline mode
+        self.offline: Optional[Dict[str, Dict[str, Any]]] = None
+        self.recorded = 0
+
+    @staticmethod
+    def make_key(request: httpx.Request) -> str:
+        url = urlsplit(str(request.url))
+        # cache busters such as UCLA's "_" timestamp would never match offline
+        query = [(k, v) for k, v in parse_qsl(url.query, keep_blank_values=True)
+                 if k not in settings.archive_ignore_params]
+        try:
+            payload = hashlib.sha256(request.content).hexdigest() if request.content else ''
+        except httpx.RequestNotRead:
+            payload = ''
+        target = url._replace(query=urlencode(sorted(query)), fragment='').geturl()
+        return hashlib.sha256(f"{request.method} {target} {payload}".encode('utf-8')).hexdigest()
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def put_blob(self, body: bytes | Iterable[bytes]) -> str:
+        """Store a body, given whole or as chunks, and return its digest."""
+        chunks = [body] if isinstance(body, bytes) else body
+        directory = os.path.join(self.root, 'blobs')
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        compressor = zlib.compressobj()
+        # the name is only known at the end, written under a temporary one
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(compressor.compress(chunk))
+            f.write(compressor.flush())
+        path = self.blob_path(digest.hexdigest())
+        if os.path.exists(path):
+            os.remove(f.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(f.name, path)
+        return digest.hexdigest()
+
+    def get_blob(self, digest: str) -> bytes:
+        with open(self.blob_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def start_run(self, run_id: Optional[str] = None) -> str:
+        self.close()
+        self.run_id = run_id or datetime.now().strftime('%Y%m%dT%H%M%S')
+        os.makedirs(os.path.join(self.root, 'runs'), exist_ok=True)
+        self.manifest = open(os.path.join(self.root, 'runs', f"{self.run_id}.jsonl"), 'a')
+        return self.run_id
+
+    def close(self):
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+
+    def record(self, request: httpx.Request, status: int, headers: httpx.Headers, body: bytes | Iterable[bytes]):
+        if self.manifest is None:
+            self.start_run()
+        entry = {
+            'key': self.make_key(request),
+            'method': request.method,
+            'url': str(request.url),
+            'status': status,
+            'headers': {name: headers[name] for name in KEPT_HEADERS if name in headers},
+            'blob': self.put_blob(body),
+        }
+        self.manifest.write(json.dumps(entry) + '\n')
+        self.manifest.flush()
+        self.recorded += 1
+
+    def runs(self):
+        directory = os.path.join(self.root, 'runs')
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len('.jsonl')] for name in os.listdir(directory) if name.endswith('.jsonl'))
+
+    def go_offline(self, run_id: Optional[str] = None):
+        """Serve requests from a recorded run, the latest by default."""
+        runs = self.runs()
+        run_id = run_id or (runs[-1] if runs else None)
+        if run_id not in runs:
+            raise FileNotFoundError(f"No archived run {run_id} in {self.root}")
+        self.offline = {}
+        with open(os.path.join(self.root, 'runs', f"{run_id}.jsonl")) as f:
+            for line in f:
+                entry = json.loads(line)
+                # a retried request keeps its last response
+                self.offline[entry['key']] = entry
+
+    def replay(self, request: httpx.Request) -> httpx.Response:
+        entry = self.offline.get(self.make_key(request))
+        if entry is None:
+            raise httpx.ConnectError(f"{request.method} {request.url} is not in the archive", request=request)
+        return httpx.Response(entry['status'], headers=entry['headers'],
+                              content=self.get_blob(entry['blob']), request=request)
+
+
+class RecordingStream(httpx.AsyncByteStream):
+    """A response body passed on as it is read, archived once it is closed.
+
+    Received bytes are spooled rather than held in memory, and decoded into
+    the archive when the response is closed. A body that was not read to
+    the end is not recorded.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, request: httpx.Request, response: httpx.Response):
+        self.stream = stream
+        self.request = request
+        self.status = response.status_code
+        self.headers = response.headers
+        self.spool = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+        self.complete = False
+        self.closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            self.spool.write(chunk)
+            yield chunk
+        self.complete = True
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.closed:
+                self.closed = True
+                self.save()
+
+    def save(self):
+        try:
+            if self.complete:
+                self.spool.seek(0)
+                # decoded chunk by chunk the way httpx decodes the response itself
+                raw = httpx.Response(200, headers=self.headers, content=iter(lambda: self.spool.read(65536), b''))
+                archive.record(self.request, self.status, self.headers, raw.iter_bytes())
+        except httpx.DecodingError as e:
+            print(f"Not archiving {self.request.url}: {e}")
+        finally:
+            self.spool.close()
+
+
+class ArchiveTransport(httpx.AsyncBaseTransport):
+    """Records every response into the archive, or replays them offline."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host in settings.archive_skip_hosts:
+            return await self.transport.handle_async_request(request)
+        if archive.offline is not None:
+            return archive.replay(request)
+        response = await self.transport.handle_async_request(request)
+        # a 304 has no body, src.http_cache records the cached one instead
+        if response.status_code != 304:
+            response.stream = RecordingStream(response.stream, request, response)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+archive = Archive(settings.archive_path) if settings.archive_path else None
+
+
+if __name__ == '__main__':
+    import asyncio
+    import sys
+    from src.spiders import spiders
+    # the instance src.http_client replays from, not this __main__ copy's
+    from src.archive import archive
+
+    async def reparse(spider, run_id: Optional[str], dry_run: bool):
+        from src import execute, http_cache
+        from src.dataset import async_engine
+        from src.http_client import close_clients
+        from src.parse_service import close_pool
+        if not spider.replayable:
+            raise SystemExit(f"{spider.school_name} is not fetched through the shared HTTP clients, "
+                             f"its archive cannot be replayed")
+        if not dry_run and execute.appending():
+            raise SystemExit(f"Loading a reparse would append a second copy of {spider.school_name}, "
+                             f"use --dry-run, LOAD_SYNC=true or LOAD_STAGING=true")
+        archive.go_offline(run_id)
+        # parse everything again instead of reusing what the cache kept
+        http_cache.cache = None
+        try:
+            if dry_run:
+                rows = []
+                if execute.use_stages(spider):
+                    async def collect(row):
+                        rows.append(row)
+
+                    stages = execute.source_stages(spider) + [execute.Stage('collect', collect)]
+                    await execute.Pipeline(stages).run(spider.units())
+                else:
+                    rows = await spider.func()
+                print(f"Parsed {len(rows)} {spider.school_name} rows from the archive")
+            else:
+                await execute.process_school(spider)
+        finally:
+            await close_clients()
+            await async_engine.dispose()
+            close_pool()
+
+    # python -m src.archive reparse <school_name> [run_id] [--dry-run]
+    args = [arg for arg in sys.argv[1:] if arg != '--dry-run']
+    if archive is not None and len(args) in (2, 3) and args[0] == 'reparse':
+        spider = next(spider for spider in spiders if spider.school_name == args[1])
+        asyncio.run(reparse(spider, args[2] if len(args) == 3 else None, '--dry-run' in sys.argv))
+    elif archive is not None and args == ['runs']:
+        print('\n'.join(archive.runs()))
+    else:
+        print("usage: python -m src.archive runs | reparse <school_name> [run_id] [--dry-run]\n"
+              "(needs ARCHIVE_PATH)")
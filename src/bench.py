@@ -0,0 +1,269 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.parsers import parsers, row_values
+from src import soup
+from src.settings import settings
+from html.parser import HTMLParser
+from statistics import median
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+
+def fixture_dir(parser_id: str) -> str:
+    return os.path.join(settings.bench_path, 'fixtures', parser_id)
+
+
+def load_fixtures(parser_id: str) -> List[Tuple[bytes, str]]:
+    """(body, url) pairs recorded for a parser, in a stable order."""
+    directory = fixture_dir(parser_id)
+    if not os.path.isdir(directory):
+        return []
+    urls_path = os.path.join(directory, 'urls.json')
+    urls: Dict[str, str] = {}
+    if os.path.exists(urls_path):
+        with open(urls_path) as f:
+            urls = json.load(f)
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name == 'urls.json':
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            pages.append((f.read(), urls.get(name, '')))
+    return pages
+
+
+def open_run(run_id: Optional[str] = None):
+    """The archive, serving an archived run (the latest by default)."""
+    from src.archive import archive
+    if archive is None:
+        raise SystemExit("ARCHIVE_PATH is not set")
+    archive.go_offline(run_id)
+    return archive
+
+
+def archived_entries(archive, parser_id: str) -> List[Dict[str, Any]]:
+    """Manifest entries of the open run that ``parser_id`` reads."""
+    pattern = parsers[parser_id].pattern
+    if pattern is None:
+        return []
+    return [entry for entry in archive.offline.values() if entry['status'] == 200 and pattern.search(entry['url'])]
+
+
+def record(run_id: Optional[str] = None, limit: int = 20):
+    """Copy archived responses matching each parser's URL pattern into its fixtures."""
+    archive = open_run(run_id)
+    for parser in parsers.values():
+        entries = archived_entries(archive, parser.id)[:limit]
+        if not entries:
+            continue
+        directory = fixture_dir(parser.id)
+        os.makedirs(directory, exist_ok=True)
+        urls_path = os.path.join(directory, 'urls.json')
+        urls = {}
+        if os.path.exists(urls_path):
+            with open(urls_path) as f:
+                urls = json.load(f)
+        for entry in entries:
+            with open(os.path.join(directory, entry['blob']), 'wb') as f:
+                f.write(archive.get_blob(entry['blob']))
+            urls[entry['blob']] = entry['url']
+        with open(urls_path, 'w') as f:
+            json.dump(urls, f, indent=2, sort_keys=True)
+        print(f"{parser.id}: {len(entries)} fixtures")
+
+
+# pages of a fixture are parsed this many times in a row at least, so
+# fixtures of a page or two are not timed by the clock's resolution alone
+MIN_SAMPLE_SECONDS = 0.02
+# stdlib-parsed markup timed next to the fixtures
+CALIBRATION_PAGE = '<table>' + ''.join(
+    f'<tr class="row"><td>{i}</td><td><a href="/course/{i}">Course {i}</a></td><td>4.0</td></tr>'
+    for i in range(200)) + '</table>'
+
+
+def sample_times(works: List[Callable[[], Any]], repeat: int) -> List[List[float]]:
+    """``repeat`` samples of seconds per call for each of ``works``.
+
+    The works take turns in every round, so a machine that slows down for
+    a while slows the samples of one round alike.
+    """
+    numbers = []
+    for work in works:
+        work()
+        begin = time.perf_counter()
+        work()
+        numbers.append(max(1, int(MIN_SAMPLE_SECONDS / max(time.perf_counter() - begin, 1e-9))))
+    samples: List[List[float]] = [[] for _ in works]
+    for _ in range(repeat):
+        for work, number, times in zip(works, numbers, samples):
+            gc.collect()
+            begin = time.perf_counter()
+            for _ in range(number):
+                work()
+            times.append((time.perf_counter() - begin) / number)
+    return samples
+
+
+def calibration_parse():
+    """A fixed pure-Python parse, page timings are compared as multiples of
+    it so a baseline saved on one machine still holds on another."""
+    HTMLParser().feed(CALIBRATION_PAGE)
+
+
+def measure(parser_id: str, pages: List[Tuple[bytes, str]], repeat: int) -> Dict[str, float]:
+    parse = parsers[parser_id].parse
+    # warm up imports and caches before timing
+    rows = sum(len(parse(body, url)) for body, url in pages)
+
+    def parse_all():
+        for body, url in pages:
+            parse(body, url)
+    times, calibration = sample_times([parse_all, calibration_parse], repeat)
+    best = min(times)
+    gc.collect()
+    tracemalloc.start()
+    parse_all()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'pages': len(pages),
+        'rows': rows,
+        'rows_per_s': round(rows / best, 1) if best else 0.0,
+        'ms_per_page': round(best * 1000 / len(pages), 3),
+        # per page, in calibration parses of the same round
+        'relative_per_page': round(median(t / c for t, c in zip(times, calibration)) / len(pages), 4),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def regressions(parser_id: str, result: Dict[str, float], baseline: Dict[str, float]) -> List[str]:
+    found = []
+    limit = 1 + settings.bench_tolerance
+    if result['pages'] == baseline['pages'] and result['rows'] != baseline['rows']:
+        found.append(f"{parser_id}: {result['rows']} rows, baseline {baseline['rows']}")
+    # absolute ms/page depends on the machine, only the calibrated time is compared
+    for key in ('relative_per_page', 'peak_kib'):
+        if key in baseline and result[key] > baseline[key] * limit:
+            found.append(f"{parser_id}: {key} {result[key]} > {baseline[key]} * {limit:.2f}")
+    return found
+
+
+def run(parser_ids: List[str], save: bool, repeat: int) -> int:
+    baselines_path = os.path.join(settings.bench_path, 'baselines.json')
+    baselines: Dict[str, Dict[str, float]] = {}
+    if os.path.exists(baselines_path):
+        with open(baselines_path) as f:
+            baselines = json.load(f)
+    failed = []
+    for parser_id in parser_ids or parsers:
+        pages = load_fixtures(parser_id)
+        if not pages:
+            if parser_id in baselines and not save:
+                failed.append(f"{parser_id}: has a baseline but no fixtures in {fixture_dir(parser_id)}")
+            else:
+                print(f"{parser_id}: no fixtures in {fixture_dir(parser_id)}, skipped")
+            continue
+        result = measure(parser_id, pages, repeat)
+        print(f"{parser_id}: {result['pages']} pages, {result['rows']} rows, {result['rows_per_s']} rows/s, "
+              f"{result['ms_per_page']} ms/page ({result['relative_per_page']} calibrated), "
+              f"{result['peak_kib']} KiB peak")
+        if save:
+            baselines[parser_id] = result
+        elif parser_id in baselines:
+            failed += regressions(parser_id, result, baselines[parser_id])
+    if save:
+        os.makedirs(settings.bench_path, exist_ok=True)
+        with open(baselines_path, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved baselines to {baselines_path}")
+    for message in failed:
+        print(f"FAILED {message}")
+    return 1 if failed else 0
+
+
+def newlines(values: Tuple) -> Tuple:
+    # lxml reads CRLF and CR as LF, html.parser keeps them
+    return tuple(value.replace('\r\n', '\n').replace('\r', '\n') if isinstance(value, str) else value
+                 for value in values)
+
+
+def parity(parser_ids: List[str], archived: bool = False, run_id: Optional[str] = None) -> int:
+    """Parse every fixture with each installed HTML backend and diff the rows.
+
+    With lxml the ported extractors read lxml's tree instead of bs4's, so
+    this compares them with their bs4 version on html.parser. ``archived``
+    compares every page of an archived run (the latest unless ``run_id``)
+    instead of the fixtures. Also fails when fewer than two backends are
+    installed or there is nothing to compare, rather than passing without
+    having compared anything.
+    """
+    backends = [backend for backend in soup.BACKENDS if soup.available(backend)]
+    if len(backends) < 2:
+        print(f"FAILED only {backends} installed, parity needs lxml as well (poetry install)")
+        return 1
+    pages_of = load_fixtures
+    if archived:
+        archive = open_run(run_id)
+
+        def pages_of(parser_id: str) -> List[Tuple[bytes, str]]:
+            return [(archive.get_blob(entry['blob']), entry['url']) for entry in archived_entries(archive, parser_id)]
+    configured = soup.backend
+    failed = []
+    compared = 0
+    try:
+        for parser_id in parser_ids or parsers:
+            pages = pages_of(parser_id)
+            for body, url in pages:
+                results = {}
+                for backend in backends:
+                    soup.backend = backend
+                    results[backend] = [newlines(row_values(row)) for row in parsers[parser_id].parse(body, url)]
+                reference = results[backends[-1]]
+                for backend in backends[:-1]:
+                    if results[backend] != reference:
+                        failed.append(f"{parser_id}: {backend} and {backends[-1]} differ on {url or 'a fixture'}")
+            if pages:
+                compared += len(pages)
+                print(f"{parser_id}: {len(pages)} pages compared")
+    finally:
+        soup.backend = configured
+    for message in failed:
+        print(f"MISMATCH {message}")
+    if not compared:
+        print(f"FAILED no {'archived pages' if archived else 'fixtures'} to compare")
+        return 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # python -m src.bench [parser_id ...] [--save] [--repeat N]
+    # python -m src.bench record [run_id]
+    # python -m src.bench parity [--archive [run_id]] [parser_id ...]
+    args = sys.argv[1:]
+    if args[:1] == ['record']:
+        record(args[1] if len(args) > 1 else None)
+    elif args[:1] == ['parity']:
+        args = args[1:]
+        archived = '--archive' in args
+        run_id = None
+        if archived:
+            index = args.index('--archive')
+            if index + 1 < len(args) and args[index + 1] not in parsers:
+                run_id = args[index + 1]
+                del args[index + 1]
+            del args[index]
+        sys.exit(parity(args, archived, run_id))
+    else:
+        repeat = 15
+        if '--repeat' in args:
+            index = args.index('--repeat')
+            repeat = int(args[index + 1])
+            del args[index:index + 2]
+        save = '--save' in args
+        unknown = [arg for arg in args if arg != '--save' and arg not in parsers]
+        if unknown:
+            raise SystemExit(f"unknown parsers {unknown}, expected some of {list(parsers)}")
+        sys.exit(run([arg for arg in args if arg != '--save'], save, repeat))
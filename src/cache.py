@@ -0,0 +1,83 @@
+from typing import Dict, List, Optional
+from array import array
+import hashlib
+import os
+import sqlite3
+import time
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by (model, dimensions, text hash).
+
+    Entries are evicted least-recently-used first once the stored vectors
+    exceed ``max_bytes``.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key TEXT PRIMARY KEY, vector BLOB NOT NULL, '
+            'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)')
+        self.conn.commit()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, dimensions: Optional[int], text: str) -> str:
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"{model}:{dimensions or 0}:{digest}"
+
+    def get_many(self, model: str, dimensions: Optional[int], texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [self.make_key(model, dimensions, text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            for key, blob in rows:
+                found[key] = array('f', blob).tolist()
+        if found:
+            now = time.time()
+            self.conn.executemany(
+                'UPDATE embeddings SET accessed = ? WHERE key = ?', [(now, key) for key in found])
+            self.conn.commit()
+        vectors = [found.get(key) for key in keys]
+        self.hits += len(texts) - vectors.count(None)
+        self.misses += vectors.count(None)
+        return vectors
+
+    def put_many(self, model: str, dimensions: Optional[int], texts: List[str], vectors: List[List[float]]):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = array('f', vector).tobytes()
+            rows.append((self.make_key(model, dimensions, text), blob, len(blob), now))
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO embeddings (key, vector, size, accessed) VALUES (?, ?, ?, ?)', rows)
+        self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        total = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM embeddings').fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        stale = []
+        for key, size in self.conn.execute('SELECT key, size FROM embeddings ORDER BY accessed'):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.conn.executemany('DELETE FROM embeddings WHERE key = ?', stale)
+        self.conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
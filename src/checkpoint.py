@@ -0,0 +1,120 @@
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from contextvars import ContextVar
+from src.settings import settings
+import os
+import pickle
+import sqlite3
+import time
+
+T = TypeVar('T')
+
+
+class Checkpoint:
+    """Work units a spider has completed in the current run, with their output.
+
+    A unit is whatever a spider repeats per department, URL, CRN or class
+    number, keyed by the ``repr`` of its key. Each one is committed as soon
+    as it is saved, so a run that dies keeps everything done before it, and
+    a resumed run reads the output back instead of requesting it again.
+    ``first_id`` is kept from the run that created the checkpoint: the load
+    stage gives every row without an id a snowflake id, so every row that
+    run and its resumptions load has a later one.
+    """
+
+    def __init__(self, path: str, first_id: Optional[int] = None):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS units (key TEXT PRIMARY KEY, payload BLOB NOT NULL, saved REAL NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        if first_id is not None:
+            self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('first_id', ?)", (first_id,))
+        self.conn.commit()
+        self.resumed = 0
+
+    def load(self, key: Any) -> Optional[Any]:
+        row = self.conn.execute('SELECT payload FROM units WHERE key = ?', (repr(key),)).fetchone()
+        if row is None:
+            return None
+        self.resumed += 1
+        return pickle.loads(row[0])
+
+    def save(self, key: Any, value: Any):
+        self.conn.execute('INSERT OR REPLACE INTO units VALUES (?, ?, ?)',
+                          (repr(key), pickle.dumps(value), time.time()))
+        self.conn.commit()
+
+    def first_id(self) -> Optional[int]:
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'first_id'").fetchone()
+        return row[0] if row is not None else None
+
+    def count(self) -> int:
+        return self.conn.execute('SELECT count(*) FROM units').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+# the checkpoint of the spider whose work is running, set per process_school task
+current: ContextVar[Optional[Checkpoint]] = ContextVar('checkpoint', default=None)
+
+
+def checkpoint_path(school_name: str) -> str:
+    return os.path.join(settings.checkpoint_path, f"{school_name}.sqlite3")
+
+
+def open_checkpoint(school_name: str, resume: bool, first_id: Optional[int] = None) -> Optional[Checkpoint]:
+    """The school's checkpoint, emptied first unless resuming."""
+    if not settings.checkpoint_path:
+        return None
+    if not resume:
+        remove(school_name)
+    return Checkpoint(checkpoint_path(school_name), first_id)
+
+
+def first_id(school_name: str) -> Optional[int]:
+    """The first row id of the run a school's checkpoint was started by, if there is one."""
+    if not settings.checkpoint_path or not os.path.exists(checkpoint_path(school_name)):
+        return None
+    points = Checkpoint(checkpoint_path(school_name))
+    try:
+        return points.first_id()
+    finally:
+        points.close()
+
+
+def remove(school_name: str):
+    """Drop a school's checkpoint, e.g. once its run has been loaded."""
+    path = checkpoint_path(school_name)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def load(key: Any) -> Optional[Any]:
+    points = current.get()
+    return points.load(key) if points is not None else None
+
+
+def save(key: Any, value: Any, done: Callable[[Any], bool] = bool):
+    """Record a unit's output, unless ``done`` says it failed.
+
+    Spiders return an empty result when a unit fails after its retries,
+    so by default empty output is not recorded and is tried again.
+    """
+    points = current.get()
+    if points is not None and done(value):
+        points.save(key, value)
+
+
+async def unit(key: Any, work: Callable[[], Awaitable[T]], done: Callable[[T], bool] = bool) -> T:
+    """``await work()`` once per run, a resumed run gets the saved output."""
+    saved = load(key)
+    if saved is not None:
+        return saved
+    value = await work()
+    save(key, value, done)
+    return value
@@ -1,11 +1,46 @@
+from typing import Dict
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from sqlalchemy import create_engine
-import os
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from src.settings import settings
+from uuid import uuid4
+import time
+
+
+class TimedPool(AsyncAdaptedQueuePool):
+    """Queue pool recording how long checkouts wait for a connection."""
+    checkouts = 0
+    wait_total = 0.0
+    wait_max = 0.0
+
+    def _do_get(self):
+        begin = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.monotonic() - begin
+            TimedPool.checkouts += 1
+            TimedPool.wait_total += wait
+            TimedPool.wait_max = max(TimedPool.wait_max, wait)
+
+
+url = make_url(settings.dataset_url).set(drivername='postgresql+asyncpg').update_query_dict(
+    {'prepared_statement_cache_size': str(settings.db_statement_cache_size)})
+# asyncpg's own statement cache, prepared_statement_cache_size is SQLAlchemy's
+connect_args = {'statement_cache_size': settings.db_statement_cache_size}
+if not settings.db_statement_cache_size:
+    # behind pgbouncer in transaction mode, statement names must not repeat across server connections
+    connect_args['prepared_statement_name_func'] = lambda: f"__asyncpg_{uuid4()}__"
 async_engine = create_async_engine(
-    settings.dataset_url.replace('postgresql', 'postgresql+asyncpg'))
-engine = create_engine(settings.dataset_url
-                       )
+    url,
+    poolclass=TimedPool,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=True,
+    connect_args=connect_args,
+)
 AsyncSessionLocal = async_sessionmaker(
     autocommit=False,
     autoflush=False,
@@ -13,3 +48,15 @@ AsyncSessionLocal = async_sessionmaker(
     future=True,
     expire_on_commit=False
 )
+
+
+def pool_stats() -> Dict[str, float]:
+    pool = async_engine.pool
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'checkouts': TimedPool.checkouts,
+        'wait_avg': round(TimedPool.wait_total / TimedPool.checkouts, 4) if TimedPool.checkouts else 0.0,
+        'wait_max': round(TimedPool.wait_max, 4),
+    }
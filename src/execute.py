@@ -1,44 +1,377 @@
 from .spiders import spiders, Spider
-from src.process import post_process
-from .dataset import AsyncSessionLocal, async_engine, engine
-from sqlalchemy import insert
+from src.process import generator, post_process
+from src.pipeline import Pipeline, Stage
+from src.models import BaseDB
+from src.schema import build_indexes, drop_indexes, prepare_table
+from src.loader import Loader
+from src.sync import failed_units, sync_rows
+from src.staging import create_staging, finish_staging, swap_staging, staging_name
+from src.settings import settings
+from .dataset import AsyncSessionLocal, async_engine, pool_stats
+from .http_client import close_clients
+from .politeness import scheduler_stats
+from .parse_service import close_pool
+from . import parse_service
+from . import metrics
+from . import runs
+from . import checkpoint
+from . import http_cache
+from .archive import archive
+from sqlalchemy import delete, insert
 import asyncio
+from datetime import datetime
+import multiprocessing
+import queue
+import sys
+from typing import AsyncIterator, Awaitable, Dict, List, Optional
 from tqdm import tqdm
 import time
 import traceback
 
 
-async def process_school(spider: Spider) -> float:
+async def spider_rows(spider: Spider) -> AsyncIterator[BaseDB]:
+    """Rows of a spider without fetch/parse stages, from its func."""
+    # units the spider gives up on record themselves here, the sync keeps their rows
+    failed = []
+    failed_units.set(failed)
+    with metrics.timed('crawl', 'stage_seconds'):
+        datas = await spider.func()
+    metrics.inc('rows', 'crawl', len(datas))
+    if settings.load_sync and not settings.load_staging:
+        # only new rows are loaded, changed and vanished ones are updated in place
+        datas = await sync_rows(spider.scheme, datas, spider.embedding_text, spider.full_text, failed)
+    for data in datas:
+        yield data
+
+
+def appending() -> bool:
+    """Whether loads append a copy of the rows, rather than syncing or swapping in a staging table."""
+    return not settings.load_sync and not settings.load_staging
+
+
+def use_stages(spider: Spider) -> bool:
+    # natural-key sync needs every row at once, so it keeps using func
+    return spider.staged and not (settings.load_sync and not settings.load_staging)
+
+
+def source_stages(spider: Spider) -> List[Stage]:
+    """fetch -> parse -> map stages turning a spider's units into rows.
+
+    A unit parsed before an interrupted run is taken from the checkpoint,
+    neither fetched nor parsed again.
+    """
+    async def fetch(unit):
+        saved = checkpoint.load(('unit', unit))
+        if saved is not None:
+            return [(unit, None, saved)]
+        return [(unit, await spider.fetch(unit), None)]
+
+    async def parse(item):
+        unit, page, saved = item
+        if saved is not None:
+            return saved
+        items = await spider.parse(unit, page)
+        checkpoint.save(('unit', unit), items)
+        return items
+
+    async def to_row(item):
+        return [spider.to_row(item) if spider.to_row else item]
+    return [Stage('fetch', fetch, spider.concurrency['fetch']),
+            Stage('parse', parse, spider.concurrency['parse']),
+            Stage('map', to_row, spider.concurrency['map'])]
+
+
+def school_pipeline(spider: Spider, loader: Loader, pbar: tqdm, local: bool = True) -> Pipeline:
+    """fetch -> parse -> map -> embed -> load stages for one school.
+
+    Without ``local`` the rows come from a worker process that ran the
+    source stages, only embed and load run here.
+    """
+    stages = source_stages(spider) if local and use_stages(spider) else []
+    if spider.embedding_text is not None:
+        # spiders without embedding_text already ran post_process; the embed
+        # workers share the school's vectors, a text is requested once per run
+        vectors: Dict[str, asyncio.Future] = {}
+
+        async def embed(rows: List[BaseDB]):
+            return await post_process(rows, [spider.embedding_text(row) for row in rows],
+                                      [spider.full_text(row) for row in rows], showBar=False, shared=vectors)
+        stages.append(Stage('embed', embed, spider.concurrency['embed'], settings.pipeline_embed_rows))
+
+    async def load(rows: List[BaseDB]):
+        for row in rows:
+            # post_process only sets ids on embedded rows, the others would get
+            # sequence ids a resumed run could not tell from older runs' rows
+            if row.id is None:
+                row.id = next(generator)
+        await loader.add(rows)
+        metrics.inc('rows', 'load', len(rows))
+        pbar.update(len(rows))
+    # a single loader connection, the queue in front of it is the back-pressure
+    stages.append(Stage('load', load, 1, 100))
+    return Pipeline(stages, settings.pipeline_queue_size)
+
+
+def interrupted_run(spider: Spider, resume: bool) -> Optional[int]:
+    """First row id of the interrupted appending run being resumed, if any.
+
+    Its saved units are emitted again, so the rows it loaded (all given
+    later ids than this one by the load stage) are taken out first.
+    """
+    return checkpoint.first_id(spider.school_name) if resume and appending() else None
+
+
+async def process_school(spider: Spider, source: Optional[AsyncIterator[BaseDB]] = None,
+                         resume: bool = False, interrupted: Optional[int] = None) -> float:
     print(f"Processing: {spider.school_name}")
+    # metrics recorded by this task and the ones it starts belong to the school
+    metrics.school.set(spider.school_name)
     begin_time = time.time()
-    datas = await spider.func()
+    if source is None:
+        interrupted = interrupted_run(spider, resume)
+    # rows from a worker process were crawled against its own checkpoint
+    points = checkpoint.open_checkpoint(spider.school_name, resume, next(generator)) if source is None else None
+    checkpoint.current.set(points)
 
     from sqlalchemy import inspect
     # inspector = inspect(engine)
     # if inspector.has_table(spider.scheme.__tablename__):
     #     spider.scheme.metadata.drop_all(engine)
-    spider.scheme.metadata.create_all(engine)
-    chunk_size = 100
-    pbar = tqdm(total=len(datas) // chunk_size,
-                desc=f"Uploading {spider.school_name}")
-    for i in range(0, len(datas), chunk_size):
-        async with AsyncSessionLocal() as session:
-            async with session.begin():
-                session.add_all(datas[i:i + chunk_size])
-                await session.commit()
-                pbar.update(1)
-    with open('res.txt', 'a') as f:
-        f.write(f"Insert {len(datas)} data to {spider.school_name} database\n")
-    print(f"Insert {len(datas)} data to {spider.school_name} database")
+    # DDL runs on the shared async pool instead of blocking the event loop
+    async with async_engine.begin() as conn:
+        await conn.run_sync(prepare_table, spider.scheme)
+    table_name = None
+    if settings.load_staging:
+        # readers keep the live table until the swap
+        async with async_engine.begin() as conn:
+            await conn.run_sync(create_staging, spider.scheme)
+        table_name = staging_name(spider.scheme)
+    if interrupted is not None:
+        async with async_engine.begin() as conn:
+            result = await conn.execute(delete(spider.scheme).where(spider.scheme.id >= interrupted))
+        print(f"Deleted {result.rowcount} {spider.school_name} rows loaded by the interrupted run")
+    if appending():
+        # the copy goes into an unindexed table and the indexes are built once
+        # after it, a failed load leaves them to the next run's build
+        async with async_engine.begin() as conn:
+            await conn.run_sync(drop_indexes, spider.scheme)
+    pbar = tqdm(desc=f"Uploading {spider.school_name}", unit='row')
+    # pages are parsed, embedded and uploaded while the crawl is still running
+    try:
+        async with Loader(spider.scheme, table_name) as loader:
+            pipeline = school_pipeline(spider, loader, pbar, local=source is None)
+            if source is not None:
+                await pipeline.run(source)
+            elif use_stages(spider):
+                await pipeline.run(spider.units())
+            else:
+                await pipeline.run(spider_rows(spider))
+    finally:
+        if points is not None:
+            if points.resumed:
+                print(f"{spider.school_name} resumed {points.resumed} units from {points.path}")
+            points.close()
+    print(f"{spider.school_name} pipeline: {pipeline.stats()}")
+    count = loader.count
+    if settings.load_staging:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(finish_staging, spider.scheme)
+        async with async_engine.begin() as conn:
+            await conn.run_sync(swap_staging, spider.scheme)
+    else:
+        # indexes are built once the bulk load is done
+        async with async_engine.begin() as conn:
+            await conn.run_sync(build_indexes, spider.scheme)
+    print(f"Insert {count} data to {spider.school_name} database")
     pbar.close()
+    if settings.checkpoint_path:
+        # loaded, the next interrupted run starts from a fresh checkpoint
+        checkpoint.remove(spider.school_name)
     return time.time() - begin_time
 
 
-async def execute():
+def transport_columns(spider: Spider) -> List[str]:
+    # every mapped column, rows from func may already carry ids and vectors
+    return [attr.key for attr in spider.scheme.__mapper__.column_attrs]
+
+
+async def produce(spider: Spider, rows_queue, resume: bool = False) -> None:
+    """Worker side: run a spider's source stages and send its rows to the parent."""
+    loop = asyncio.get_running_loop()
+    columns = transport_columns(spider)
+    metrics.school.set(spider.school_name)
+    points = checkpoint.open_checkpoint(spider.school_name, resume, next(generator))
+    checkpoint.current.set(points)
+
+    async def send(rows: List[BaseDB]):
+        # a full queue blocks this worker, not the parent's loader
+        await loop.run_in_executor(None, rows_queue.put, ('rows', parse_service.compact(rows, columns)))
+    stages = source_stages(spider) if use_stages(spider) else []
+    stages.append(Stage('send', send, 1, settings.pipeline_embed_rows))
+    pipeline = Pipeline(stages, settings.pipeline_queue_size)
+    try:
+        await pipeline.run(spider.units() if use_stages(spider) else spider_rows(spider))
+        print(f"{spider.school_name} worker pipeline: {pipeline.stats()}, hosts: {scheduler_stats()}")
+        result = ('done', None)
+    except Exception:
+        result = ('error', traceback.format_exc())
+    finally:
+        if points is not None:
+            if points.resumed:
+                print(f"{spider.school_name} resumed {points.resumed} units from {points.path}")
+            points.close()
+        if archive is not None:
+            archive.close()
+        await async_engine.dispose()
+        await close_clients()
+        close_pool()
+    # the parent merges what this process measured into its registry
+    rows_queue.put(('metrics', metrics.registry.snapshot()))
+    rows_queue.put(result)
+
+
+def split_budgets(workers: int):
+    """Give this worker process its share of the run's OpenAI and parse budgets.
+
+    A spawned worker has its own token buckets, api.openai.com scheduler and
+    parse pool. LLM extraction (UCR, USF) runs in the worker, so without the
+    split every worker would spend the full chat tokens-per-minute budget.
+    """
+    settings.openai_tpm = {model: max(1, tpm // workers) for model, tpm in settings.openai_tpm.items()}
+    settings.openai_tpm_default = max(1, settings.openai_tpm_default // workers)
+    openai = settings.http_hosts.get('api.openai.com')
+    if openai is not None:
+        settings.http_hosts['api.openai.com'] = {
+            name: max(1, value // workers) if name in ('concurrency', 'concurrency_max')
+            else value / workers if name in ('rps', 'rps_max') else value
+            for name, value in openai.items()}
+    # a worker is already a process of its own, below one pool process each it parses inline
+    settings.parse_workers //= workers
+
+
+def spider_process(school_name: str, rows_queue, run_id: Optional[str], resume: bool = False,
+                   workers: int = 1):
+    """Entry point of a spider's worker process, with its own event loop."""
+    split_budgets(workers)
+    spider = next(spider for spider in spiders if spider.school_name == school_name)
+    if archive is not None and run_id is not None:
+        # append to the parent's run instead of starting another one
+        archive.start_run(run_id)
+    asyncio.run(produce(spider, rows_queue, resume))
+
+
+async def receive(spider: Spider, process, rows_queue) -> AsyncIterator[BaseDB]:
+    """Rows sent by a spider's worker process, raising if it failed or died."""
+    loop = asyncio.get_running_loop()
+    columns = transport_columns(spider)
+    while True:
+        try:
+            kind, payload = await loop.run_in_executor(None, rows_queue.get, True, 1.0)
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"{spider.school_name} worker exited with code {process.exitcode}")
+            continue
+        if kind == 'metrics':
+            metrics.registry.merge(payload)
+            continue
+        if kind == 'error':
+            raise RuntimeError(f"{spider.school_name} worker failed:\n{payload}")
+        if kind == 'done':
+            return
+        for row in parse_service.expand(*payload, columns):
+            yield row
+
+
+async def process_school_isolated(spider: Spider, context, run_id: Optional[str], resume: bool = False,
+                                  workers: int = 1) -> float:
+    """process_school with the crawl in a worker process.
+
+    A synchronous spider (UCSD's Selenium) or a crash only takes down its
+    own process. Embedding and loading stay in this one, so the embeddings
+    budget and the database pool are still shared by every school. The
+    chat budget of LLM extraction and the parse pool are split between the
+    ``workers`` processes instead.
+    """
+    # read before the worker reopens the checkpoint, which starts a new one when there is none
+    interrupted = interrupted_run(spider, resume)
+    rows_queue = context.Queue(settings.pipeline_queue_size)
+    process = context.Process(target=spider_process, args=(spider.school_name, rows_queue, run_id, resume, workers),
+                              name=f"spider-{spider.school_name}")
+    process.start()
+    try:
+        return await process_school(spider, receive(spider, process, rows_queue), resume, interrupted)
+    finally:
+        if process.is_alive():
+            process.terminate()
+        await asyncio.get_running_loop().run_in_executor(None, process.join)
+
+
+async def recorded(spider: Spider, run_id: str, school: Awaitable[float]) -> float:
+    """Await a school and record it in spider_runs, whether it finished or failed."""
+    started = datetime.now()
+    failure = None
+    try:
+        return await school
+    except Exception as e:
+        failure = repr(e)
+        raise
+    finally:
+        await runs.record(runs.make_run(run_id, spider.school_name, started, datetime.now(), failure))
+
+
+async def execute(isolated: Optional[bool] = None, resume: Optional[bool] = None):
+    if isolated is None:
+        isolated = settings.execute_isolated
+    if resume is None:
+        resume = settings.resume
+    started = datetime.now()
+    run_id = started.strftime('%Y%m%dT%H%M%S')
+    # main.py runs every night in one process, each run is measured from zero
+    # (Prometheus reads the drop as a counter reset)
+    metrics.registry.reset()
+    if archive is not None:
+        archive.start_run(run_id)
+        print(f"Archiving pages as run {run_id}")
+    server = None
+    if settings.metrics_port:
+        try:
+            server = metrics.serve(settings.metrics_host, settings.metrics_port)
+            print(f"Metrics on http://{settings.metrics_host}:{settings.metrics_port}/metrics")
+        except OSError as e:
+            print(f"Metrics endpoint not started: {e}")
+    # spawned, a forked child would share the parent's loop, sockets and sqlite handles
+    context = multiprocessing.get_context('spawn')
     tasks = []
     for spider in spiders:
-        tasks.append(process_school(spider))
-    spend_time = await asyncio.gather(*tasks, return_exceptions=True)
+        if isolated:
+            tasks.append(recorded(spider, run_id, process_school_isolated(spider, context, run_id, resume,
+                                                                          len(spiders))))
+        else:
+            tasks.append(recorded(spider, run_id, process_school(spider, resume=resume)))
+    try:
+        spend_time = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        print(f"Connection pool: {pool_stats()}")
+        print(f"Hosts: {scheduler_stats()}")
+        if http_cache.cache is not None:
+            print(f"Pages: {http_cache.cache.stats()}")
+        if archive is not None:
+            print(f"Archived {archive.recorded} responses")
+            archive.close()
+        # idle connections are not held open until the next cron run
+        await async_engine.dispose()
+        await close_clients()
+        close_pool()
+        if server is not None:
+            server.shutdown()
+    if settings.metrics_path:
+        schools = {spider.school_name: {'seconds': None, 'error': repr(result)} if isinstance(result, Exception)
+                   else {'seconds': round(result, 2), 'error': None}
+                   for spider, result in zip(spiders, spend_time)}
+        path = metrics.write_summary(settings.metrics_path, run_id,
+                                     started=started.isoformat(), finished=datetime.now().isoformat(),
+                                     isolated=isolated, resume=resume, results=schools)
+        print(f"Run summary written to {path}")
     for (spider, time) in zip(spiders, spend_time):
         if isinstance(time, Exception):
             print(f"Error processing {spider.school_name}: {
@@ -46,4 +379,6 @@ async def execute():
         else:
             print(f"{spider.school_name} spend {time} seconds")
 if __name__ == '__main__':
-    asyncio.run(execute())
+    # python -m src.execute [--isolated] [--resume]
+    asyncio.run(execute(True if '--isolated' in sys.argv[1:] else None,
+                        True if '--resume' in sys.argv[1:] else None))
@@ -0,0 +1,152 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from src.settings import settings
+from src.http_client import get_client
+from src.archive import archive
+from src import parse_service
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+
+
+class Page:
+    """A fetched page, ``unchanged`` when it matches the previous run's copy."""
+
+    def __init__(self, url: str, key: str, status: int, body: bytes, encoding: str, unchanged: bool):
+        self.url = url
+        self.key = key
+        self.status = status
+        self.body = body
+        self.encoding = encoding
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.unchanged = unchanged
+
+    @property
+    def text(self) -> str:
+        return self.body.decode(self.encoding, errors='replace')
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class HttpCache:
+    """On-disk conditional-GET cache.
+
+    Stores each response's ETag, Last-Modified, body hash and compressed body
+    under its request key, revalidates with If-None-Match/If-Modified-Since,
+    and keeps what the spider parsed from a body so an unchanged page does
+    not have to be parsed again. Parse results are stored as plain values
+    next to the body hash and the parser's version, see parse_once.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, url TEXT NOT NULL, etag TEXT, last_modified TEXT, '
+            'hash TEXT NOT NULL, encoding TEXT NOT NULL, body BLOB NOT NULL, fetched REAL NOT NULL)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS parsed ('
+            'key TEXT PRIMARY KEY, hash TEXT NOT NULL, payload BLOB NOT NULL)')
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(method: str, url: str, params: Any = None, data: Any = None) -> str:
+        request = json.dumps([method, url, params, data], sort_keys=True, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(
+            'SELECT etag, last_modified, hash, encoding, body FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, digest, encoding, body = row
+        return {'etag': etag, 'last_modified': last_modified, 'hash': digest,
+                'encoding': encoding, 'body': zlib.decompress(body)}
+
+    def put(self, key: str, url: str, etag: Optional[str], last_modified: Optional[str], page: Page):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, url, etag, last_modified, page.digest, page.encoding, zlib.compress(page.body), time.time()))
+        self.conn.commit()
+
+    def load_parsed(self, page: Page, version: str) -> Optional[Any]:
+        """What this parser version parsed from this exact body last time, if anything."""
+        row = self.conn.execute('SELECT hash, payload FROM parsed WHERE key = ?', (page.key,)).fetchone()
+        if row is None or row[0] != f"{page.digest}:{version}":
+            return None
+        try:
+            return parse_service.expand(*pickle.loads(row[1]))
+        except Exception:
+            # written by an older version of this cache
+            return None
+
+    def save_parsed(self, page: Page, version: str, value: List[Any]):
+        self.conn.execute('INSERT OR REPLACE INTO parsed VALUES (?, ?, ?)',
+                          (page.key, f"{page.digest}:{version}", pickle.dumps(parse_service.compact(value))))
+        self.conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {'unchanged': self.hits, 'changed': self.misses}
+
+
+cache = HttpCache(settings.http_cache_path) if settings.http_cache_path else None
+
+
+async def fetch(url: str, method: str = 'GET', params: Any = None, data: Any = None,
+                headers: Optional[Dict[str, str]] = None, **kwargs) -> Page:
+    """Request ``url`` through the shared client, revalidating a cached copy.
+
+    A 304, or a 200 whose body hashes the same as the cached one, gives a
+    Page with ``unchanged`` set. Other statuses are returned uncached.
+    """
+    key = HttpCache.make_key(method, url, params, data)
+    cached = cache.get(key) if cache is not None else None
+    headers = dict(headers or {})
+    if cached is not None:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    response = await get_client(url).request(method, url, params=params, data=data, headers=headers, **kwargs)
+    if response.status_code == 304 and cached is not None:
+        cache.hits += 1
+        if archive is not None and archive.offline is None:
+            archive.record(response.request, 200, response.headers, cached['body'])
+        return Page(url, key, 200, cached['body'], cached['encoding'], True)
+    page = Page(url, key, response.status_code, response.content, response.encoding or 'utf-8', False)
+    if cache is None or response.status_code != 200:
+        return page
+    page.unchanged = cached is not None and cached['hash'] == page.digest
+    if page.unchanged:
+        cache.hits += 1
+    else:
+        cache.misses += 1
+    cache.put(key, url, response.headers.get('etag'), response.headers.get('last-modified'), page)
+    return page
+
+
+async def parse_once(page: Page, parse: Callable[[], Awaitable[Optional[List[Any]]]],
+                     version: str) -> Optional[List[Any]]:
+    """``await parse()``, or last run's rows when the page is unchanged.
+
+    ``version`` identifies the parsing code, usually
+    ``parsers.parser_version(module, ...)``: after a parser fix unchanged
+    pages are parsed again rather than served the old result.
+    """
+    if cache is not None and page.unchanged:
+        parsed = cache.load_parsed(page, version)
+        if parsed is not None:
+            return parsed
+    parsed = await parse()
+    if cache is not None and parsed is not None:
+        cache.save_parsed(page, version, parsed)
+    return parsed
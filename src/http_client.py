@@ -0,0 +1,186 @@
+from typing import AsyncIterator, Dict, List, Tuple
+from urllib.parse import urlsplit
+from src.settings import settings
+from src.politeness import get_scheduler
+from src.archive import ArchiveTransport, archive
+from src import metrics
+import asyncio
+import importlib.util
+import json
+import socket
+import time
+import httpcore
+import httpx
+
+# httpx negotiates HTTP/2 through ALPN when h2 is installed, else HTTP/1.1
+HTTP2 = importlib.util.find_spec('h2') is not None
+
+
+class CachingBackend(httpcore.AsyncNetworkBackend):
+    """Network backend resolving each host once per ``ttl`` seconds.
+
+    Only the TCP connect target is replaced by the cached address, TLS still
+    uses the request's host name for SNI and certificate checks.
+    """
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.addresses: Dict[Tuple[str, int], Tuple[str, float]] = {}
+
+    async def resolve(self, host: str, port: int) -> str:
+        cached = self.addresses.get((host, port))
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError:
+            # let the backend raise its usual connect error
+            return host
+        address = infos[0][4][0]
+        self.addresses[(host, port)] = (address, time.monotonic() + self.ttl)
+        return address
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        address = await self.resolve(host, port)
+        return await self.backend.connect_tcp(address, port, timeout, local_address, socket_options)
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float):
+        await self.backend.sleep(seconds)
+
+
+class PoliteTransport(httpx.AsyncBaseTransport):
+    """Sends every request through its host's politeness scheduler."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await get_scheduler(request.url.host).send(
+            lambda: self.transport.handle_async_request(request))
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class CountingStream(httpx.AsyncByteStream):
+    """A response body passed on as it is read, counted once it is closed.
+
+    Bytes are counted as received, before content decoding. OpenAI bodies
+    are kept to read their token usage, pages are not.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, response: httpx.Response, stage: str):
+        self.stream = stream
+        self.headers = response.headers
+        self.usage = stage != 'fetch' and response.status_code < 400
+        self.stage = stage
+        self.school = metrics.school.get()
+        self.size = 0
+        self.chunks: List[bytes] = []
+        self.closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            self.size += len(chunk)
+            if self.usage:
+                self.chunks.append(chunk)
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.closed:
+                self.closed = True
+                self.count()
+
+    def count(self):
+        metrics.registry.inc('bytes', self.stage, self.size, self.school)
+        if not self.usage:
+            return
+        try:
+            # decoded the way httpx decodes the response itself
+            body = httpx.Response(200, headers=self.headers, content=b''.join(self.chunks)).read()
+            usage = json.loads(body).get('usage') or {}
+        except (httpx.DecodingError, ValueError, AttributeError):
+            usage = {}
+        metrics.registry.inc('tokens', self.stage, usage.get('total_tokens', 0), self.school)
+
+
+class MetricsTransport(httpx.AsyncBaseTransport):
+    """Counts requests, latency, bytes and failures per school and stage.
+
+    Latency runs until the response headers arrive, the body is counted by
+    a CountingStream as the caller reads it, so streamed responses stay streamed.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    @staticmethod
+    def stage(request: httpx.Request) -> str:
+        if request.url.host == 'api.openai.com':
+            return 'embed' if request.url.path.endswith('/embeddings') else 'llm_extract'
+        return 'fetch'
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stage = self.stage(request)
+        with metrics.timed(stage):
+            response = await self.transport.handle_async_request(request)
+        if response.status_code >= 400:
+            metrics.inc('errors', stage)
+        response.stream = CountingStream(response.stream, response, stage)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def make_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=settings.http_max_connections,
+                          max_keepalive_connections=settings.http_max_connections,
+                          keepalive_expiry=settings.http_keepalive_expiry)
+    transport = httpx.AsyncHTTPTransport(http2=HTTP2, limits=limits, retries=1)
+    if settings.http_dns_ttl > 0:
+        # httpx has no public hook for the network backend of its pool, httpcore
+        # is pinned in pyproject and tests/test_http_client.py checks this takes effect
+        pool = transport._pool
+        pool._network_backend = CachingBackend(pool._network_backend, settings.http_dns_ttl)
+    # timed inside the scheduler, waiting for a slot is not latency
+    polite = PoliteTransport(MetricsTransport(transport))
+    return httpx.AsyncClient(transport=ArchiveTransport(polite) if archive is not None else polite,
+                             follow_redirects=True,
+                             timeout=httpx.Timeout(settings.http_timeout, connect=settings.http_connect_timeout))
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """The shared client for ``url``'s host, created on first use.
+
+    Each host gets its own keep-alive pool and connection limit, so one slow
+    catalog cannot starve the connections of another, and its requests are
+    paced by src.politeness. Callers must not close it.
+    """
+    key = origin(url)
+    client = clients.get(key)
+    if client is None or client.is_closed:
+        client = clients[key] = make_client()
+    return client
+
+
+async def close_clients():
+    """Close every pooled client, e.g. at the end of a run."""
+    pending = list(clients.values())
+    clients.clear()
+    await asyncio.gather(*(client.aclose() for client in pending), return_exceptions=True)
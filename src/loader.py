@@ -0,0 +1,209 @@
+from typing import Any, List, Type
+from datetime import datetime
+from sqlalchemy import Column, MetaData, String, insert
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.sql import ClauseElement, func
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.functions import FunctionElement
+from pgvector.asyncpg import register_vector
+from src.models import BaseDB
+from src.settings import settings
+from src.dataset import AsyncSessionLocal, async_engine
+import asyncpg
+import time
+
+
+def tsvector_text(value: Any) -> Any:
+    """The text of a post_process ``func.to_tsvector(text)``, other values as they are."""
+    if isinstance(value, FunctionElement) and value.name == 'to_tsvector':
+        clauses = list(value.clauses)
+        if len(clauses) == 1 and isinstance(clauses[0], BindParameter):
+            return clauses[0].value
+    return value
+
+
+class Loader:
+    """Bulk loads rows into one school table.
+
+    Rows are buffered and written with binary COPY in chunks whose size
+    adapts to keep each COPY near ``settings.load_target_seconds``. The
+    ``func.to_tsvector(text)`` post_process sets on search_vector is copied
+    as text into a temporary table and computed by the INSERT out of it.
+    Chunks COPY cannot encode (other SQL expressions) or that fail to copy
+    go through the ORM instead, as does ``mode='orm'``.
+    ``table_name`` redirects the load to a table shaped like the scheme's,
+    such as its staging table.
+    """
+
+    def __init__(self, scheme: Type[BaseDB], table_name: str | None = None, mode: str | None = None):
+        self.scheme = scheme
+        self.table_name = table_name or scheme.__tablename__
+        self.mode = mode or settings.load_mode
+        self.chunk_size = settings.load_chunk_rows
+        self.count = 0
+        self.buffer: List[BaseDB] = []
+        self.conn: asyncpg.Connection | None = None
+        self.now: datetime | None = None
+        self.copy_table: str | None = None
+        self.pooled: AsyncConnection | None = None
+        # generated columns are filled by Postgres
+        self.columns = [(column, scheme.__mapper__.get_property_by_column(column).key)
+                        for column in scheme.__table__.columns if column.computed is None]
+
+    async def __aenter__(self):
+        return self
+
+    async def connect(self):
+        # checked out of the engine pool on the first chunk, so it does not
+        # idle through the crawl and counts against the pool's limits
+        self.pooled = await async_engine.connect()
+        self.conn = (await self.pooled.get_raw_connection()).driver_connection
+        await register_vector(self.conn)
+        # the value func.now() column defaults get through the ORM
+        self.now = await self.conn.fetchval('SELECT now()::timestamp')
+
+    async def release(self):
+        """Drop the COPY table and the vector codecs, which would break ORM
+        binds, before the connection goes back to the pool."""
+        try:
+            if self.copy_table is not None:
+                await self.conn.execute(f'DROP TABLE IF EXISTS "{self.copy_table}"')
+            for typename in ('vector', 'halfvec', 'sparsevec'):
+                try:
+                    await self.conn.reset_type_codec(typename)
+                except ValueError:
+                    # halfvec and sparsevec only exist from pgvector 0.7
+                    pass
+        except BaseException:
+            await self.pooled.invalidate()
+            raise
+        finally:
+            await self.pooled.close()
+            self.conn = None
+
+    async def __aexit__(self, *exc):
+        try:
+            if exc[0] is None:
+                await self.flush()
+        finally:
+            if self.conn is not None:
+                await self.release()
+
+    async def add(self, rows: List[BaseDB]):
+        self.buffer.extend(rows)
+        while len(self.buffer) >= self.chunk_size:
+            chunk = self.buffer[:self.chunk_size]
+            del self.buffer[:self.chunk_size]
+            await self.load(chunk)
+
+    async def flush(self):
+        if self.buffer:
+            chunk, self.buffer = self.buffer, []
+            await self.load(chunk)
+
+    async def load(self, rows: List[BaseDB]):
+        if self.mode == 'copy' and self.conn is None:
+            await self.connect()
+        if self.conn is not None:
+            begin = time.monotonic()
+            try:
+                if await self.copy(rows):
+                    self.count += len(rows)
+                    self.adapt(time.monotonic() - begin)
+                    return
+            except (asyncpg.PostgresError, ValueError, TypeError) as e:
+                print(f"COPY into {self.table_name} failed, using the ORM: {e}")
+        await self.orm(rows)
+        self.count += len(rows)
+
+    def adapt(self, elapsed: float):
+        target = settings.load_target_seconds
+        if elapsed < target / 2:
+            self.chunk_size = min(self.chunk_size * 2, settings.load_chunk_rows_max)
+        elif elapsed > target * 2:
+            self.chunk_size = max(self.chunk_size // 2, settings.load_chunk_rows_min)
+
+    def value(self, row: BaseDB, column: Column, key: str) -> Any:
+        value = getattr(row, key)
+        if value is None and column.default is not None:
+            if column.default.is_scalar:
+                return column.default.arg
+            return self.now if self.now is not None else func.now()
+        if value is not None and isinstance(column.type, String) and not isinstance(value, str):
+            return str(value)
+        return value
+
+    async def create_copy_table(self) -> str:
+        """A temporary table shaped like the target, with text in place of tsvector.
+
+        Without the target's NOT NULL constraints, columns left to their
+        defaults are only filled by the INSERT out of it.
+        """
+        name = f"{self.table_name}__copy"
+        await self.conn.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS "{name}" ON COMMIT DELETE ROWS '
+                                f'AS SELECT * FROM "{self.table_name}" WITH NO DATA')
+        for column, _ in self.columns:
+            if isinstance(column.type, TSVECTOR):
+                await self.conn.execute(f'ALTER TABLE "{name}" ALTER COLUMN "{column.name}" TYPE text')
+        return name
+
+    async def copy(self, rows: List[BaseDB]) -> bool:
+        """COPY rows in, returns False when they need the ORM."""
+        records = [[self.value(row, column, key) for column, key in self.columns]
+                   for row in rows]
+        keep = []
+        tsvectors = set()
+        for i, (column, _) in enumerate(self.columns):
+            values = [record[i] for record in records]
+            if any(isinstance(value, ClauseElement) for value in values):
+                if not isinstance(column.type, TSVECTOR):
+                    return False
+                values = [tsvector_text(value) for value in values]
+                if any(isinstance(value, ClauseElement) for value in values):
+                    return False
+                for record, value in zip(records, values):
+                    record[i] = value
+                tsvectors.add(i)
+            # all-NULL columns are left out so database defaults such as
+            # the id sequence still apply
+            if all(value is None for value in values):
+                continue
+            if column.primary_key and None in values:
+                return False
+            keep.append(i)
+        names = [self.columns[i][0].name for i in keep]
+        records = [tuple(record[i] for i in keep) for record in records]
+        if not tsvectors:
+            await self.conn.copy_records_to_table(self.table_name, records=records, columns=names)
+            return True
+        if self.copy_table is None:
+            self.copy_table = await self.create_copy_table()
+        selected = [f'to_tsvector("{self.columns[i][0].name}")' if i in tsvectors
+                    else f'"{self.columns[i][0].name}"' for i in keep]
+        quoted = ', '.join(f'"{name}"' for name in names)
+        async with self.conn.transaction():
+            await self.conn.copy_records_to_table(self.copy_table, records=records, columns=names)
+            await self.conn.execute(f'INSERT INTO "{self.table_name}" ({quoted}) '
+                                    f'SELECT {", ".join(selected)} FROM "{self.copy_table}"')
+        return True
+
+    async def orm(self, rows: List[BaseDB]):
+        if self.table_name != self.scheme.__tablename__:
+            # the mapper only knows the live table, insert into the other one with Core
+            table = self.scheme.__table__.to_metadata(MetaData(), name=self.table_name)
+            for i in range(0, len(rows), 100):
+                records = [{column.name: self.value(row, column, key) for column, key in self.columns}
+                           for row in rows[i:i + 100]]
+                # leave all-NULL columns to the database defaults, as COPY does
+                names = [column.name for column, _ in self.columns
+                         if any(record[column.name] is not None for record in records)]
+                async with AsyncSessionLocal() as session:
+                    async with session.begin():
+                        await session.execute(insert(table).values(
+                            [{name: record[name] for name in names} for record in records]))
+            return
+        for i in range(0, len(rows), 100):
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    session.add_all(rows[i:i + 100])
@@ -0,0 +1,209 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import json
+import os
+import threading
+import time
+
+# upper bounds in seconds, from a cached page to a slow LLM extraction
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+COUNTERS = {
+    'requests': 'Requests sent to a host, OpenAI or the parse pool',
+    'errors': 'Failed requests and stage calls',
+    'retries': 'Attempts repeated after a failure',
+    'bytes': 'Response bytes received, or page bytes parsed',
+    'rows': 'Rows produced',
+    'tokens': 'OpenAI tokens used',
+}
+HISTOGRAMS = {
+    'request_seconds': 'Latency of one request',
+    'stage_seconds': 'Time spent in one call of a pipeline stage',
+}
+
+# the school whose work is running, set per process_school task
+school: ContextVar[str] = ContextVar('school', default='')
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def data(self) -> Dict[str, Any]:
+        return {'counts': list(self.counts), 'sum': self.sum, 'count': self.count, 'max': self.max}
+
+    def merge(self, other: Dict[str, Any]):
+        self.counts = [a + b for a, b in zip(self.counts, other['counts'])]
+        self.sum += other['sum']
+        self.count += other['count']
+        self.max = max(self.max, other['max'])
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation, at most the max."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {'count': self.count, 'sum': round(self.sum, 4), 'max': round(self.max, 4),
+                'p50': p50 if p50 is None else round(p50, 4), 'p95': p95 if p95 is None else round(p95, 4)}
+
+
+class Registry:
+    """Counters and latency histograms keyed by (name, school, stage).
+
+    Updated from the event loop and read by the exposition thread, hence
+    the lock. A snapshot is plain data, so worker processes can send theirs
+    to the parent to be merged.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, str, str], float] = {}
+        self.histograms: Dict[Tuple[str, str, str], Histogram] = {}
+
+    def inc(self, name: str, stage: str, value: float = 1, school_name: Optional[str] = None):
+        key = (name, school_name or school.get(), stage)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, stage: str, seconds: float, school_name: Optional[str] = None):
+        key = (name, school_name or school.get(), stage)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self) -> Dict[str, List]:
+        with self.lock:
+            return {'counters': [[*key, value] for key, value in self.counters.items()],
+                    'histograms': [[*key, h.data()] for key, h in self.histograms.items()]}
+
+    def merge(self, snapshot: Dict[str, List]):
+        with self.lock:
+            for name, school_name, stage, value in snapshot['counters']:
+                key = (name, school_name, stage)
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, school_name, stage, data in snapshot['histograms']:
+                self.histograms.setdefault((name, school_name, stage), Histogram()).merge(data)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, help_text in COUNTERS.items():
+                metric = f"spider_{name}_total"
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+                for (key_name, school_name, stage), value in sorted(self.counters.items()):
+                    if key_name == name:
+                        lines.append(f'{metric}{{school="{school_name}",stage="{stage}"}} {value:g}')
+            for name, help_text in HISTOGRAMS.items():
+                metric = f"spider_{name}"
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+                for (key_name, school_name, stage), h in sorted(self.histograms.items()):
+                    if key_name != name:
+                        continue
+                    labels = f'school="{school_name}",stage="{stage}"'
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + (float('inf'),), h.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                        lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {cumulative}')
+                    lines.append(f"{metric}_sum{{{labels}}} {h.sum:.6f}")
+                    lines.append(f"{metric}_count{{{labels}}} {h.count}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """school -> stage -> counters and histogram summaries."""
+        schools: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        with self.lock:
+            for (name, school_name, stage), value in self.counters.items():
+                schools.setdefault(school_name, {}).setdefault(stage, {})[name] = value
+            for (name, school_name, stage), h in self.histograms.items():
+                schools.setdefault(school_name, {}).setdefault(stage, {})[name] = h.summary()
+        return schools
+
+
+registry = Registry()
+
+
+def inc(name: str, stage: str, value: float = 1):
+    registry.inc(name, stage, value)
+
+
+def observe(name: str, stage: str, seconds: float):
+    registry.observe(name, stage, seconds)
+
+
+@contextmanager
+def timed(stage: str, histogram: str = 'request_seconds') -> Iterator[None]:
+    """Time a block as one request (or stage call), counting it as an error if it raises."""
+    begin = time.monotonic()
+    try:
+        yield
+    except Exception:
+        inc('errors', stage)
+        raise
+    finally:
+        observe(histogram, stage, time.monotonic() - begin)
+        if histogram == 'request_seconds':
+            inc('requests', stage)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve ``/metrics`` from a daemon thread until ``shutdown()``."""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+def write_summary(directory: str, run_id: str, **extra) -> str:
+    """Write the run's metrics as ``<directory>/<run_id>.json``."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{run_id}.json")
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'run_id': run_id, **extra, 'schools': registry.summary()}, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+    return path
@@ -1,17 +1,50 @@
 from sqlalchemy.orm import DeclarativeBase, mapped_column, Mapped
-from sqlalchemy import Integer, String, DateTime, func, SmallInteger, BigInteger, Float, Text, ARRAY
-from pgvector.sqlalchemy import Vector
-from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy import Integer, String, DateTime, func, SmallInteger, BigInteger, Float, Text, ARRAY, Computed
+from pgvector.sqlalchemy import Vector, HALFVEC
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import DeferredReflection
-from typing import Optional, List
+from typing import Optional, List, Type
+from src.settings import settings
 
 
 class Base(DeclarativeBase):
     pass
 
 
+def vector_type(dimensions: Optional[int], halfvec: bool):
+    """Column type of name_vector, halfvec stores 2-byte floats."""
+    return HALFVEC(dimensions) if halfvec else Vector(dimensions)
+
+
+class IndexSpec:
+    """Index built by src.schema.build_indexes after a load rather than by
+    create_all, ``params`` go to its WITH clause (m, ef_construction, lists)."""
+
+    def __init__(self, column: str, method: str, distance: str = 'cosine', **params):
+        self.column = column
+        self.method = method
+        self.distance = distance
+        self.params = params
+
+
+def search_vector_column(*columns: str):
+    """search_vector of a table, generated by Postgres from ``columns`` when
+    SEARCH_VECTOR_GENERATED is on so inserts only carry plain values."""
+    if not settings.search_vector_generated:
+        return mapped_column(TSVECTOR, nullable=True)
+    text = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+    return mapped_column(TSVECTOR, Computed(
+        f"to_tsvector('{settings.search_config}', {text})", persisted=True), nullable=True)
+
+
 class BaseDB(Base):
     __abstract__ = True
+    # columns identifying a row across runs, used by the sync load
+    __natural_key__: tuple = ()
+    __indexes__: tuple = (
+        IndexSpec('name_vector', 'hnsw', m=16, ef_construction=64),
+        IndexSpec('search_vector', 'gin'),
+    )
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     source_url: Mapped[str] = mapped_column(String, nullable=True)
     remark: Mapped[str] = mapped_column(String, nullable=True)
@@ -25,14 +58,71 @@ class BaseDB(Base):
         SmallInteger, nullable=False, default=0)
     tenant_id: Mapped[int] = mapped_column(
         BigInteger, nullable=False, default=0)
-    name_vector: Mapped[Vector] = mapped_column(Vector, nullable=True)
+    name_vector: Mapped[Vector] = mapped_column(vector_type(
+        settings.embedding_dimensions, settings.embedding_halfvec), nullable=True)
     search_vector: Mapped[TSVECTOR] = mapped_column(TSVECTOR, nullable=True)
     instructor_name: Mapped[str] = mapped_column(String, nullable=True)
+    content_hash: Mapped[Optional[str]] = mapped_column(
+        String(64), nullable=True, doc="Hash of the scraped columns")
+    embedding_hash: Mapped[Optional[str]] = mapped_column(
+        String(64), nullable=True, doc="Hash of the text name_vector embeds")
+    full_text_hash: Mapped[Optional[str]] = mapped_column(
+        String(64), nullable=True, doc="Hash of the text search_vector is built from")
+
+
+# columns maintained by the loader rather than scraped
+bookkeeping_columns = {'id', 'creator', 'create_time', 'updater', 'update_time', 'deleted',
+                       'tenant_id', 'name_vector', 'search_vector', 'content_hash',
+                       'embedding_hash', 'full_text_hash'}
+
+
+def data_columns(scheme: Type[BaseDB]) -> List[str]:
+    return [column.name for column in scheme.__table__.columns if column.name not in bookkeeping_columns]
+
+
+def configure_vector(scheme: Type[BaseDB], dimensions: Optional[int] = None, halfvec: Optional[bool] = None):
+    """Override the name_vector type of one table, unset values keep the global setting."""
+    column = scheme.__table__.c.name_vector
+    if dimensions is None:
+        dimensions = column.type.dim
+    if halfvec is None:
+        halfvec = isinstance(column.type, HALFVEC)
+    column.type = vector_type(dimensions, halfvec)
+
+
+def vector_dimensions(scheme: Type[BaseDB]) -> Optional[int]:
+    return scheme.__table__.c.name_vector.type.dim
+
+
+def search_vector_generated(scheme: Type[BaseDB]) -> bool:
+    return scheme.__table__.c.search_vector.computed is not None
+
+
+class SpiderRun(Base):
+    """One school's share of a run, written by src.runs when process_school ends."""
+    __tablename__ = 'spider_runs'
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    run_id: Mapped[str] = mapped_column(String(32), nullable=False, index=True)
+    school_name: Mapped[str] = mapped_column(String, nullable=False, index=True)
+    started_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    finished_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    seconds: Mapped[float] = mapped_column(Float, nullable=False)
+    # stage -> seconds spent in it, summed over its workers
+    stage_seconds: Mapped[dict] = mapped_column(JSONB, nullable=False, default=dict)
+    rows_fetched: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    rows_embedded: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    rows_inserted: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    bytes_downloaded: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    openai_tokens: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    errors: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # why the school failed, None when it finished
+    failure: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
 
 class UCRCourseDB(BaseDB):
     __abstract__ = False
     __tablename__ = 'rumi_ucr_class_schedule_2025_spring'
+    __natural_key__ = ('source_url', 'section')
     section: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     units: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     offering_title: Mapped[Optional[str]
@@ -43,10 +133,13 @@ class UCRCourseDB(BaseDB):
     grade_scheme: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     registered: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     total_seats: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    search_vector: Mapped[TSVECTOR] = search_vector_column('offering_title')
 
 
 class USFCourseDB(BaseDB):
     __tablename__ = 'rumi_usf_class_schedule_2025_spring'
+    # one row per meeting of a section, source_url carries the CRN
+    __natural_key__ = ('source_url', 'course_type', 'date_range', 'days', 'time')
     term: Mapped[Optional[str]] = mapped_column(
         String, nullable=True, doc="The term of the course")
     time: Mapped[Optional[str]] = mapped_column(String, nullable=True)
@@ -87,10 +180,12 @@ class USFCourseDB(BaseDB):
         String, nullable=True, doc="The prerequisite course code")
     minimum_grade: Mapped[Optional[str]] = mapped_column(
         String, nullable=True, doc="The minimum grade required")
+    search_vector: Mapped[TSVECTOR] = search_vector_column('title')
 
 
 class UCICourseDB(BaseDB):
     __tablename__ = 'rumi_uci_class_schedule_2025_spring'
+    __natural_key__ = ('code',)
 
     code: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     type: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
@@ -114,6 +209,7 @@ class UCICourseDB(BaseDB):
 
 class UCSDCourseDB(BaseDB):
     __tablename__ = 'rumi_ucsd_class_schedule_2025_spring'
+    __natural_key__ = ('section_id',)
 
     course_number: Mapped[Optional[str]] = mapped_column(
         String(50), nullable=True)
@@ -139,6 +235,8 @@ class UCSDCourseDB(BaseDB):
 
 class UCSCCourseDB(BaseDB):
     __tablename__ = 'rumi_ucsc_class_schedule_2025_spring'
+    __natural_key__ = ('class_number',)
+    class_number: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     subject: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     number: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     display_name: Mapped[Optional[str]] = mapped_column(String, nullable=True)
@@ -161,10 +259,13 @@ class UCSCCourseDB(BaseDB):
     start_time: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     end_time: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     units: Mapped[Optional[int]] = mapped_column(String, nullable=True)
+    search_vector: Mapped[TSVECTOR] = search_vector_column('course_name')
 
 
 class UCLACourseDB(BaseDB):
     __tablename__ = 'rumi_ucla_class_schedule_2025_spring'
+    # ClassNumber is '%' for some courses, so the course is part of the key
+    __natural_key__ = ('subject_area_code', 'catalog_number', 'class_number', 'section')
     section: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     status: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     waitlist: Mapped[Optional[str]] = mapped_column(String, nullable=True)
@@ -186,6 +287,7 @@ class UCLACourseDB(BaseDB):
 
 class UCSFCourseDB(BaseDB):
     __tablename__ = 'rumi_ucsf_class_schedule_2025_spring'
+    __natural_key__ = ('subject', 'prefix', 'number')
     subject: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     prefix: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     number: Mapped[Optional[str]] = mapped_column(String, nullable=True)
@@ -193,3 +295,4 @@ class UCSFCourseDB(BaseDB):
     units: Mapped[Optional[int]] = mapped_column(String, nullable=True)
     activity: Mapped[Optional[int]] = mapped_column(String, nullable=True)
     term: Mapped[Optional[int]] = mapped_column(String, nullable=True)
+    search_vector: Mapped[TSVECTOR] = search_vector_column('course_name')
@@ -0,0 +1,71 @@
+from typing import Any, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from src.parsers import parsers, row_columns
+from src.settings import settings
+from src import metrics
+import asyncio
+import multiprocessing
+
+pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global pool
+    if pool is None:
+        # spawned rather than forked, the parent holds an event loop, sockets and sqlite handles
+        pool = ProcessPoolExecutor(max_workers=settings.parse_workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+    return pool
+
+
+def compact(rows: List[Any], columns: Optional[List[str]] = None) -> Tuple[Optional[type], List[Any]]:
+    """Rows of one model type as (type, value tuples), anything else as is.
+
+    The tuples pickle to a fraction of the size of ORM instances, which also
+    carry their SQLAlchemy state. ``columns`` defaults to the scraped ones.
+    """
+    kinds = {type(row) for row in rows}
+    if len(kinds) != 1:
+        return None, rows
+    columns = columns or row_columns(next(iter(kinds)))
+    if columns is None:
+        return None, rows
+    # str() drops bs4 strings' links back into the tree they were cut from
+    return kinds.pop(), [tuple(str(value) if isinstance(value, str) else value
+                               for value in (getattr(row, column) for column in columns))
+                         for row in rows]
+
+
+def expand(kind: Optional[type], values: List[Any], columns: Optional[List[str]] = None) -> List[Any]:
+    if kind is None:
+        return values
+    columns = columns or row_columns(kind)
+    # unset columns keep their defaults, as if the parser had left them alone
+    return [kind(**{column: value for column, value in zip(columns, row) if value is not None})
+            for row in values]
+
+
+def parse_compact(parser_id: str, body: bytes, url: str, context: dict) -> Tuple[Optional[type], List[Any]]:
+    return compact(parsers[parser_id].parse(body, url, **context))
+
+
+async def parse(parser_id: str, body: bytes, url: str = '', **context) -> List[Any]:
+    """Run a registered parser on ``body`` in the worker pool.
+
+    Pages are parsed in parallel across cores while the event loop keeps
+    fetching; with ``parse_workers`` at 0 the parser runs inline.
+    """
+    metrics.inc('bytes', 'parse', len(body))
+    with metrics.timed('parse'):
+        if settings.parse_workers <= 0:
+            return parsers[parser_id].parse(body, url, **context)
+        loop = asyncio.get_running_loop()
+        kind, values = await loop.run_in_executor(get_pool(), parse_compact, parser_id, body, url, context)
+        return expand(kind, values)
+
+
+def close_pool():
+    global pool
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+        pool = None
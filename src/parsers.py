@@ -0,0 +1,123 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from functools import lru_cache
+from urllib.parse import urlsplit
+import hashlib
+import importlib.util
+import json
+import re
+
+
+class Parser:
+    """A network-free spider parser, ``parse(body, url, **context)`` returns its rows.
+
+    ``context`` carries what the spider knows besides the page, such as the
+    response encoding or the form payload that produced it; every key is
+    optional so fixtures parse without it.
+    ``pattern`` matches the URLs whose responses the parser reads, so
+    fixtures can be picked out of an archived run. Parsers of pages that
+    are not fetched over HTTP (UCSD's Selenium pages) have none.
+    """
+
+    def __init__(self, parser_id: str, parse: Callable[..., List[Any]], pattern: Optional[str] = None):
+        self.id = parser_id
+        self.parse = parse
+        self.pattern = re.compile(pattern) if pattern else None
+
+
+def text(body: bytes, encoding: Optional[str] = None) -> str:
+    return body.decode(encoding or 'utf-8', errors='replace')
+
+
+# the spider modules are imported on first use, ucsd pulls in Selenium
+def ucla_course_details(body: bytes, url: str, encoding: Optional[str] = None):
+    from src.schools.ucla.server import get_course_details
+    return get_course_details(text(body, encoding))
+
+
+def ucla_course_titles(body: bytes, url: str, encoding: Optional[str] = None):
+    from src.schools.ucla.server import extract_course_data
+    return extract_course_data(json.loads(body))
+
+
+def ucsd_page(body: bytes, url: str, encoding: Optional[str] = None):
+    from src.schools.ucsd.server import extract_page_content
+    return extract_page_content(text(body, encoding))
+
+
+def uci_websoc(body: bytes, url: str, encoding: Optional[str] = None,
+               payload: Optional[dict] = None, department: str = ''):
+    from src.schools.uci.server import courses_from_html
+    return courses_from_html(text(body, encoding), url, payload or {}, department)
+
+
+def ucsf_courseblock(body: bytes, url: str, encoding: Optional[str] = None, subject: Optional[str] = None):
+    from src.schools.ucsf.server import courses_from_html, subjects
+    if subject is None:
+        subject = subjects.get(urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1])
+    return courses_from_html(url, subject, text(body, encoding))
+
+
+def usf_sections(body: bytes, url: str, encoding: Optional[str] = None):
+    from src.schools.usf.server import sections_from_html
+    return sections_from_html(text(body, encoding))
+
+
+def ucd_course(body: bytes, url: str, encoding: Optional[str] = None):
+    from src.schools.ucd.server import course_from_html
+    return [course_from_html(text(body, encoding))]
+
+
+def ucsc_course(body: bytes, url: str, encoding: Optional[str] = None):
+    from src.schools.ucsc.server import course_from_json
+    return [course_from_json(json.loads(body))]
+
+
+parsers: Dict[str, Parser] = {parser.id: parser for parser in [
+    Parser('ucla.course_details', ucla_course_details, r'sa\.ucla\.edu/ro/public/soc/Results/GetCourseSummary'),
+    Parser('ucla.course_titles', ucla_course_titles, r'sa\.ucla\.edu/ro/public/soc/Results/GetCourseTitlesPage'),
+    Parser('ucsd.page', ucsd_page),
+    Parser('uci.websoc', uci_websoc, r'www\.reg\.uci\.edu/perl/WebSoc'),
+    Parser('ucsf.courseblock', ucsf_courseblock, r'catalog\.ucsf\.edu/course-catalog/'),
+    Parser('usf.sections', usf_sections, r'ssb-prod\.ec\.usfca\.edu/PROD/bwckschd\.p_get_crse_unsec'),
+    Parser('ucd.course', ucd_course, r'registrar-apps\.ucdavis\.edu/courses/search/course\.cfm'),
+    Parser('ucsc.course', ucsc_course, r'my\.ucsc\.edu/PSIGW/RESTListeningConnector/PSFT_CSPRD/SCX_CLASS_DETAIL'),
+]}
+
+
+@lru_cache(maxsize=None)
+def parser_version(*modules: str) -> str:
+    """Hash of the source of the modules that parse a page, of src.models and
+    of the HTML backend, so stored parse results go stale with any of them."""
+    from src import soup
+    digest = hashlib.sha256(soup.backend.encode('utf-8'))
+    for name in (*modules, 'src.models'):
+        with open(importlib.util.find_spec(name).origin, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def parse(parser_id: str, body: bytes, url: str = '', **context) -> List[Any]:
+    return parsers[parser_id].parse(body, url, **context)
+
+
+def row_columns(kind: type) -> Optional[List[str]]:
+    """The scraped fields of a row type, None for rows that are not models."""
+    from pydantic import BaseModel
+    from src.models import BaseDB, data_columns
+    if issubclass(kind, BaseDB):
+        return data_columns(kind)
+    if issubclass(kind, BaseModel):
+        return list(kind.model_fields)
+    return None
+
+
+def row_values(row: Any) -> Tuple:
+    """A parsed row's scraped values as a plain tuple, for comparing rows."""
+    columns = row_columns(type(row))
+    if columns is not None:
+        return tuple(getattr(row, column) for column in columns)
+    if isinstance(row, dict):
+        return tuple(sorted(row.items()))
+    if hasattr(row, '__dict__'):
+        return tuple(sorted(vars(row).items()))
+    return tuple(row)
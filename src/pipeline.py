@@ -0,0 +1,108 @@
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List
+from src import metrics
+import asyncio
+import time
+
+# marks the end of a queue, each stage forwards it once all its workers are done
+END = object()
+
+
+class Stage:
+    """One step of a Pipeline.
+
+    ``func`` is awaited once per item, or once per list of up to ``batch``
+    items when batching, and returns the items for the next stage (a list,
+    or None for nothing). ``concurrency`` workers share the stage's queue.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Awaitable[Iterable[Any] | None]],
+                 concurrency: int = 1, batch: int | None = None):
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+        self.batch = batch
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {'in': self.items_in, 'out': self.items_out, 'busy': round(self.busy, 2)}
+
+
+class Pipeline:
+    """Stages connected by bounded queues.
+
+    A stage that falls behind fills its input queue, which blocks the stage
+    before it, and so on up to the source, so a fast crawler cannot run
+    ahead of a slow database by more than ``maxsize`` items per queue.
+    """
+
+    def __init__(self, stages: List[Stage], maxsize: int = 64):
+        self.stages = stages
+        self.maxsize = maxsize
+
+    async def run(self, source: AsyncIterable[Any] | Iterable[Any]):
+        queues = [asyncio.Queue(self.maxsize) for _ in self.stages]
+        # the last stage's output is dropped
+        queues.append(None)
+        tasks = [asyncio.ensure_future(self.feed(source, queues[0]))]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.concurrency]
+            for _ in range(stage.concurrency):
+                tasks.append(asyncio.ensure_future(
+                    self.work(stage, queues[i], queues[i + 1], remaining)))
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            # a failed stage stops consuming, the others would block forever
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def feed(self, source, queue: asyncio.Queue):
+        if hasattr(source, '__aiter__'):
+            async for item in source:
+                await queue.put(item)
+        else:
+            for item in source:
+                await queue.put(item)
+        await queue.put(END)
+
+    async def work(self, stage: Stage, queue: asyncio.Queue, out: asyncio.Queue | None, remaining: List[int]):
+        batch = []
+        while True:
+            item = await queue.get()
+            if item is END:
+                # let the sibling workers see it too
+                await queue.put(END)
+                break
+            stage.items_in += 1
+            if stage.batch is None:
+                await self.call(stage, item, out)
+                continue
+            batch.append(item)
+            if len(batch) >= stage.batch:
+                await self.call(stage, batch, out)
+                batch = []
+        if batch:
+            await self.call(stage, batch, out)
+        remaining[0] -= 1
+        if remaining[0] == 0 and out is not None:
+            await out.put(END)
+
+    async def call(self, stage: Stage, item, out: asyncio.Queue | None):
+        begin = time.monotonic()
+        with metrics.timed(stage.name, 'stage_seconds'):
+            results = await stage.func(item)
+        stage.busy += time.monotonic() - begin
+        if results:
+            metrics.inc('rows', stage.name, len(results))
+        for result in results or ():
+            stage.items_out += 1
+            if out is not None:
+                await out.put(result)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {stage.name: stage.stats() for stage in self.stages}
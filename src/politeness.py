@@ -0,0 +1,108 @@
+from typing import Awaitable, Callable, Dict, Optional
+from src.ratelimit import AdaptiveLimiter, Overloaded, TokenBucket
+from src.settings import settings
+import time
+import httpx
+
+# responses meaning the host wants fewer requests
+OVERLOAD_STATUSES = {429, 502, 503, 504}
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get('retry-after', ''))
+    except ValueError:
+        return None
+
+
+class HostScheduler:
+    """Politeness for one host: requests per second and requests in flight.
+
+    Requests take a token from a bucket refilled at ``rps`` and a slot of an
+    AdaptiveLimiter. Both grow while responses come back under
+    ``latency_target`` and are halved, at most once per ``latency_target``,
+    on timeouts and 429/5xx overload responses, staying within their bounds.
+    A Retry-After header pauses the host until it expires.
+    """
+
+    def __init__(self, host: str, rps: float, rps_min: float, rps_max: float, concurrency: int,
+                 concurrency_min: int, concurrency_max: int, latency_target: float):
+        self.host = host
+        self.rps = rps
+        self.rps_min = rps_min
+        self.rps_max = rps_max
+        self.latency_target = latency_target
+        self.bucket = TokenBucket(rps * 60, capacity=max(1.0, rps))
+        self.limiter = AdaptiveLimiter(concurrency, concurrency_min, concurrency_max, latency_target)
+        self.requests = 0
+        self.overloads = 0
+        self._last_decrease = 0.0
+
+    async def send(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        await self.bucket.acquire(1)
+        self.requests += 1
+        response = None
+        try:
+            async with self.limiter.slot():
+                begin = time.monotonic()
+                try:
+                    response = await send()
+                except httpx.TimeoutException as e:
+                    raise Overloaded(e) from e
+                if response.status_code in OVERLOAD_STATUSES:
+                    raise Overloaded(httpx.HTTPStatusError(
+                        f"{response.status_code} from {self.host}", request=response.request,
+                        response=response), retry_after(response))
+                latency = time.monotonic() - begin
+        except Overloaded as e:
+            self.overloads += 1
+            self._slow_down()
+            if response is None:
+                raise e.cause
+            # the spider still sees the response and handles it as before
+            return response
+        if latency > self.latency_target:
+            self._slow_down()
+        else:
+            self._set_rps(self.rps + 1 / self.rps)
+        return response
+
+    def _slow_down(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self._set_rps(self.rps / 2)
+
+    def _set_rps(self, rps: float):
+        self.rps = min(self.rps_max, max(self.rps_min, rps))
+        self.bucket.set_rate(self.rps * 60, capacity=max(1.0, self.rps))
+
+    def stats(self) -> Dict[str, float]:
+        return {'rps': round(self.rps, 2), 'requests': self.requests,
+                'overloads': self.overloads, **self.limiter.stats()}
+
+
+schedulers: Dict[str, HostScheduler] = {}
+
+
+def get_scheduler(host: str) -> HostScheduler:
+    """The scheduler for ``host``, from the http_* settings and any http_hosts override."""
+    scheduler = schedulers.get(host)
+    if scheduler is None:
+        config = {
+            'rps': settings.http_rps,
+            'rps_min': settings.http_rps_min,
+            'rps_max': settings.http_rps_max,
+            'concurrency': settings.http_concurrency,
+            'concurrency_min': settings.http_concurrency_min,
+            'concurrency_max': settings.http_concurrency_max,
+            'latency_target': settings.http_latency_target,
+            **settings.http_hosts.get(host, {}),
+        }
+        scheduler = schedulers[host] = HostScheduler(host, **config)
+    return scheduler
+
+
+def scheduler_stats() -> Dict[str, Dict[str, float]]:
+    return {host: scheduler.stats() for host, scheduler in schedulers.items()}
@@ -1,46 +1,208 @@
-from typing import List
-from src.models import BaseDB
-from openai import AsyncClient
-from openai.types import CreateEmbeddingResponse
+from typing import AsyncIterator, Dict, List, Tuple
+from src.models import BaseDB, vector_dimensions, search_vector_generated
+from src.settings import settings
+from src.cache import EmbeddingCache
+from src.ratelimit import AdaptiveLimiter, Overloaded, acquire_tokens, count_tokens, truncate_tokens
+from src import metrics
+from openai import AsyncClient, NOT_GIVEN, APIConnectionError, APITimeoutError, BadRequestError, InternalServerError, \
+    RateLimitError
 from sqlalchemy.sql import func
 import asyncio
+import random
 from snowflake import SnowflakeGenerator
 from tqdm.asyncio import tqdm
 generator = SnowflakeGenerator(1)
-client = AsyncClient()
-
-sem = asyncio.Semaphore(50)
-
-
-async def embedd_text(text: str | None):
-    async with sem:
-        if text is None:
-            return None
-        for _ in range(3):
-            try:
-                resp = await client.embeddings.create(
-                    input=text, model='text-embedding-3-large')
-                return resp.data[0].embedding
-            except Exception as e:
-                print(f"Error: {e}, retrying...")
-                await asyncio.sleep(1)
+# retries are handled below so that 429s reach the limiter
+client = AsyncClient(max_retries=0)
+cache = EmbeddingCache(settings.embedding_cache_path, settings.embedding_cache_max_mb * 1024 * 1024) \
+    if settings.embedding_cache_path else None
+
+limiter = AdaptiveLimiter(settings.embedding_concurrency, settings.embedding_concurrency_min,
+                          settings.embedding_concurrency_max, settings.embedding_latency_target)
+
+
+def make_batches(texts: List[str], max_inputs: int, max_tokens: int) -> List[Tuple[List[int], int]]:
+    """Group text indices into batches bounded by input count and token total."""
+    batches: List[Tuple[List[int], int]] = []
+    batch: List[int] = []
+    tokens = 0
+    for i, text in enumerate(texts):
+        n = count_tokens(settings.embedding_model, text)
+        if batch and (len(batch) >= max_inputs or tokens + n > max_tokens):
+            batches.append((batch, tokens))
+            batch, tokens = [], 0
+        batch.append(i)
+        tokens += n
+    if batch:
+        batches.append((batch, tokens))
+    return batches
+
+
+def retry_after(e: Exception) -> float | None:
+    response = getattr(e, 'response', None)
+    if response is None:
         return None
+    try:
+        if 'retry-after-ms' in response.headers:
+            return float(response.headers['retry-after-ms']) / 1000
+        return float(response.headers['retry-after'])
+    except (KeyError, ValueError):
+        return None
+
+
+async def embedd_batch(texts: List[str], tokens: int, dimensions: int | None = None, max_retries=5) -> List[List[float] | None]:
+    for attempt in range(max_retries):
+        if attempt:
+            metrics.inc('retries', 'embed')
+        try:
+            await acquire_tokens(settings.embedding_model, tokens)
+            async with limiter.slot():
+                try:
+                    # the OpenAI client has its own transport, so it is timed here
+                    with metrics.timed('embed'):
+                        resp = await client.embeddings.create(
+                            input=texts, model=settings.embedding_model, dimensions=dimensions or NOT_GIVEN)
+                except (RateLimitError, APITimeoutError, InternalServerError) as e:
+                    raise Overloaded(e, retry_after(e))
+            usage = getattr(resp, 'usage', None)
+            metrics.inc('tokens', 'embed', usage.total_tokens if usage else tokens)
+            embeddings: List[List[float] | None] = [None] * len(texts)
+            for item in resp.data:
+                embeddings[item.index] = item.embedding
+            return embeddings
+        except BadRequestError as e:
+            if len(texts) == 1:
+                # not retried, the row is loaded without a vector as before batching
+                print(f"Error: {e}, not embedding {texts[0][:80]!r}")
+                return [None]
+            # one bad input fails the whole request, the others are sent on their own
+            singles = await asyncio.gather(*(embedd_batch([text], count_tokens(settings.embedding_model, text),
+                                                          dimensions, max_retries) for text in texts))
+            return [vectors[0] for vectors in singles]
+        # transport failures and overload are retried, a bad key fails at once
+        except (Overloaded, APIConnectionError) as e:
+            print(f"Error: {e}, retrying...")
+            # Retry-After is enforced by the limiter, this only adds jitter
+            await asyncio.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1))
+    return [None] * len(texts)
+
 
+async def embedd_stream(texts: List[str | None], showBar=True, dimensions: int | None = None,
+                        shared: Dict[str, asyncio.Future] | None = None) -> AsyncIterator[List[Tuple[int, List[float] | None]]]:
+    """Yield (position, embedding) pairs as soon as their embeddings are known.
 
-async def post_process(datas: List[BaseDB], embedding_texts: List[str], full_texts: List[str], showBar=True):
-    # get embeddings of texts
-    # TODO: cache
-    tasks = [embedd_text(text) for text in embedding_texts]
-    embeddings: List[CreateEmbeddingResponse]
+    Empty, cached and already embedded texts come first, then one list per
+    finished request. Identical texts are embedded once and every position
+    using them shares the same vector object. ``shared`` maps texts to
+    their embedding futures across calls, so concurrent calls of one run
+    (the embed workers of a school, all of one ``dimensions``) request a
+    text once between them instead of once per batch. A text that could
+    not be embedded is dropped from it and requested again by a later call.
+    """
+    if shared is None:
+        shared = {}
+    loop = asyncio.get_running_loop()
+    # the API rejects empty inputs, so they keep a None embedding
+    positions: Dict[str, List[int]] = {}
+    ready: List[Tuple[int, List[float] | None]] = []
+    for i, text in enumerate(texts):
+        if text:
+            positions.setdefault(text, []).append(i)
+        else:
+            ready.append((i, None))
+    # texts another call is embedding or has embedded, the others are this call's to resolve
+    joined: Dict[str, asyncio.Future] = {}
+    owned: Dict[str, asyncio.Future] = {}
+    for text in positions:
+        if text in shared:
+            joined[text] = shared[text]
+        else:
+            owned[text] = shared[text] = loop.create_future()
+
+    def resolve(text: str, vector: List[float] | None):
+        owned[text].set_result(vector)
+        if vector is None:
+            del shared[text]
+    for text, future in list(joined.items()):
+        if future.done():
+            ready.extend((i, future.result()) for i in positions[text])
+            del joined[text]
+    unique = list(owned)
+    cached: List[List[float] | None] = [None] * len(unique)
+    if cache is not None:
+        cached = cache.get_many(settings.embedding_model, dimensions, unique)
+    for text, vector in zip(unique, cached):
+        if vector is not None:
+            resolve(text, vector)
+            ready.extend((i, vector) for i in positions[text])
+    missing = [text for text, vector in zip(unique, cached) if vector is None]
+    del cached
+    if ready:
+        yield ready
+    del ready
+
+    # the API rejects inputs over the model's limit, they are cached under the whole text
+    sent = [truncate_tokens(settings.embedding_model, text, settings.embedding_input_tokens) for text in missing]
+
+    async def run(batch: List[int], tokens: int):
+        batch_texts = [missing[j] for j in batch]
+        batch_vectors = await embedd_batch([sent[j] for j in batch], tokens, dimensions)
+        if cache is not None:
+            done = [(text, vector) for text, vector in zip(batch_texts, batch_vectors) if vector is not None]
+            cache.put_many(settings.embedding_model, dimensions,
+                           [text for text, _ in done], [vector for _, vector in done])
+        for text, vector in zip(batch_texts, batch_vectors):
+            resolve(text, vector)
+        return batch_texts, batch_vectors
+
+    async def wait(text: str, future: asyncio.Future):
+        # shielded, this call stopping early does not cancel the other call's embedding
+        return [text], [await asyncio.shield(future)]
+    tasks = [asyncio.ensure_future(run(batch, tokens)) for batch, tokens in make_batches(
+        sent, settings.embedding_batch_size, settings.embedding_batch_tokens)]
+    tasks += [asyncio.ensure_future(wait(text, future)) for text, future in joined.items()]
+    try:
+        for future in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Post Process", disable=not showBar):
+            batch_texts, batch_vectors = await future
+            yield [(i, vector) for text, vector in zip(batch_texts, batch_vectors)
+                   for i in positions[text]]
+    finally:
+        # the consumer may stop early
+        for task in tasks:
+            task.cancel()
+        # other calls waiting on a text this one did not get to are not left hanging
+        for text, future in owned.items():
+            if not future.done():
+                resolve(text, None)
     if showBar:
-        embeddings = await tqdm.gather(*[task for task in tasks if task is not None], desc="Post Process")
-    else:
-        embeddings = await asyncio.gather(*[task for task in tasks if task is not None])
+        if cache is not None:
+            print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses")
+        print(f"Embedding limiter: {limiter.stats()}")
+
+
+async def embedd_texts(texts: List[str | None], showBar=True, dimensions: int | None = None,
+                       shared: Dict[str, asyncio.Future] | None = None) -> List[List[float] | None]:
+    """Embed texts with multi-input requests, keeping the input order."""
+    embeddings: List[List[float] | None] = [None] * len(texts)
+    async for pairs in embedd_stream(texts, showBar, dimensions, shared):
+        for i, vector in pairs:
+            embeddings[i] = vector
+    return embeddings
+
+
+async def post_process(datas: List[BaseDB], embedding_texts: List[str], full_texts: List[str], showBar=True,
+                       shared: Dict[str, asyncio.Future] | None = None):
+    # get embeddings of texts, only cache misses are sent to OpenAI, once per ``shared``
+    # the requested size follows the table's name_vector column
+    dimensions = vector_dimensions(type(datas[0])) if datas else None
+    generated = search_vector_generated(type(datas[0])) if datas else False
+    embeddings = await embedd_texts(embedding_texts, showBar, dimensions, shared)
     # update datas
     for (data, embedding) in zip(datas, embeddings):
         data.name_vector = embedding
         data.id = next(generator)
-    # create tsvector for full_texts
-    for (data, full_text) in zip(datas, full_texts):
-        data.search_vector = func.to_tsvector(full_text)
+    # create tsvector for full_texts, unless Postgres generates it
+    if not generated:
+        for (data, full_text) in zip(datas, full_texts):
+            data.search_vector = func.to_tsvector(full_text)
     return datas
@@ -0,0 +1,180 @@
+from typing import Deque, Dict, Optional
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from src.settings import settings
+import asyncio
+import time
+import tiktoken
+
+
+class Overloaded(Exception):
+    """Raised inside a limiter slot when the upstream signals overload."""
+
+    def __init__(self, cause: BaseException, retry_after: Optional[float] = None):
+        super().__init__(str(cause))
+        self.cause = cause
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter.
+
+    The limit grows by ``increase`` per window of successful requests whose
+    latency stays under ``latency_target`` and is multiplied by ``decrease``
+    when a request is overloaded (429, timeout) or too slow. A Retry-After
+    hint pauses every new request until it expires.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_target: float,
+                 increase: float = 1.0, decrease: float = 0.5, window: float = 60.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.errors = 0
+        self._done: Deque[float] = deque()
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        try:
+            delay = self.blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            begin = time.monotonic()
+            try:
+                yield
+            except Overloaded as e:
+                self._on_overload(e.retry_after)
+                raise
+            except BaseException:
+                self.errors += 1
+                raise
+            else:
+                self._on_success(time.monotonic() - begin)
+        finally:
+            async with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def _on_success(self, latency: float):
+        now = time.monotonic()
+        self._done.append(now)
+        if latency > self.latency_target:
+            self._cut(now)
+        else:
+            self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def _on_overload(self, retry_after: Optional[float]):
+        now = time.monotonic()
+        self.errors += 1
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        self._cut(now)
+
+    def _cut(self, now: float):
+        # one cut per latency window, in-flight requests fail together
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+
+    def throughput(self) -> float:
+        """Completed requests per second over the trailing window."""
+        now = time.monotonic()
+        while self._done and now - self._done[0] > self.window:
+            self._done.popleft()
+        return len(self._done) / self.window
+
+    def stats(self) -> Dict[str, float]:
+        return {'limit': int(self.limit), 'in_flight': self.in_flight,
+                'throughput': round(self.throughput(), 2), 'errors': self.errors}
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``per_minute`` tokens a minute.
+
+    Waiters are served in arrival order, so one busy caller cannot starve
+    the others sharing the bucket. ``capacity`` caps the burst, a full
+    minute of tokens by default.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.capacity = capacity or per_minute
+        self.rate = per_minute / 60
+        self.tokens = float(self.capacity)
+        self.consumed = 0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, per_minute: float, capacity: Optional[float] = None):
+        self._refill()
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.tokens = min(self.tokens, self.capacity)
+
+    async def acquire(self, tokens: int):
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+            self.consumed += tokens
+
+
+buckets: Dict[str, TokenBucket] = {}
+
+
+@lru_cache
+def get_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+def count_tokens(model: str, text: str) -> int:
+    return len(get_encoding(model).encode(text))
+
+
+def truncate_tokens(model: str, text: str, limit: int) -> str:
+    """``text`` cut to its first ``limit`` tokens."""
+    # a token is at least one byte, shorter texts need no encoding
+    if len(text.encode('utf-8')) <= limit:
+        return text
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text)
+    return text if len(tokens) <= limit else encoding.decode(tokens[:limit])
+
+
+async def acquire_tokens(model: str, tokens: int):
+    """Wait until the process-wide tokens-per-minute budget of ``model`` allows ``tokens``."""
+    if model not in buckets:
+        buckets[model] = TokenBucket(
+            settings.openai_tpm.get(model, settings.openai_tpm_default))
+    await buckets[model].acquire(tokens)
+
+
+async def acquire_prompt_tokens(model: str, prompt: str, completion_tokens: int | None = None):
+    """Reserve the estimated prompt and completion tokens of a chat request."""
+    if completion_tokens is None:
+        completion_tokens = settings.openai_completion_tokens
+    await acquire_tokens(model, count_tokens(model, prompt) + completion_tokens)
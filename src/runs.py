@@ -0,0 +1,135 @@
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from statistics import median
+from sqlalchemy import select
+from src.models import SpiderRun
+from src.settings import settings
+from src.dataset import AsyncSessionLocal, async_engine
+from src import metrics
+
+# columns compared with the trailing median, and whether a rise is the bad direction
+COMPARED = {
+    'seconds': True,
+    'rows_inserted': False,
+    'bytes_downloaded': True,
+    'openai_tokens': True,
+    'errors': True,
+}
+
+table_ready = False
+
+
+def stage_total(stages: Dict[str, Dict[str, Any]], name: str, *only: str) -> int:
+    return int(sum(values.get(name, 0) for stage, values in stages.items() if not only or stage in only))
+
+
+def make_run(run_id: str, school_name: str, started: datetime, finished: datetime,
+             failure: Optional[str] = None) -> SpiderRun:
+    """A school's spider_runs row from what src.metrics recorded for it in this run."""
+    stages = metrics.registry.summary().get(school_name, {})
+    stage_seconds = {}
+    for stage, values in stages.items():
+        # pipeline stages have their own timing, llm_extract only its requests'
+        timing = values.get('stage_seconds') or values.get('request_seconds')
+        if timing:
+            stage_seconds[stage] = timing['sum']
+    return SpiderRun(
+        run_id=run_id,
+        school_name=school_name,
+        started_at=started,
+        finished_at=finished,
+        seconds=(finished - started).total_seconds(),
+        stage_seconds=stage_seconds,
+        # func spiders count their rows as crawl, staged ones out of map
+        rows_fetched=stage_total(stages, 'rows', 'crawl', 'map'),
+        rows_embedded=stage_total(stages, 'rows', 'embed'),
+        rows_inserted=stage_total(stages, 'rows', 'load'),
+        bytes_downloaded=stage_total(stages, 'bytes', 'fetch'),
+        openai_tokens=stage_total(stages, 'tokens'),
+        # a failure is usually already counted by the stage it came from
+        errors=stage_total(stages, 'errors') or int(failure is not None),
+        failure=failure,
+    )
+
+
+async def record(run: SpiderRun):
+    """Insert a run row, never failing the school over it."""
+    global table_ready
+    try:
+        if not table_ready:
+            async with async_engine.begin() as conn:
+                await conn.run_sync(SpiderRun.__table__.create, checkfirst=True)
+            table_ready = True
+        async with AsyncSessionLocal() as session:
+            session.add(run)
+            await session.commit()
+    except Exception as e:
+        print(f"Could not record the {run.school_name} run: {e}")
+
+
+async def history(window: int) -> Dict[str, List[SpiderRun]]:
+    """school -> its latest ``window`` + 1 runs, newest first."""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(SpiderRun.__table__.create, checkfirst=True)
+    async with AsyncSessionLocal() as session:
+        runs = (await session.scalars(select(SpiderRun).order_by(SpiderRun.started_at.desc()))).all()
+    schools: Dict[str, List[SpiderRun]] = {}
+    for run in runs:
+        kept = schools.setdefault(run.school_name, [])
+        if len(kept) <= window:
+            kept.append(run)
+    return schools
+
+
+def compare(latest: SpiderRun, previous: List[SpiderRun], tolerance: float) -> List[str]:
+    """Lines describing how ``latest`` differs from the median of ``previous``."""
+    found = []
+    # failed runs would drag the medians down
+    previous = [run for run in previous if run.failure is None]
+    if latest.failure is not None:
+        found.append(f"failed: {latest.failure}")
+    if not previous:
+        return found
+    for column, rise_is_bad in COMPARED.items():
+        value = getattr(latest, column)
+        base = median(getattr(run, column) for run in previous)
+        if rise_is_bad and value > base * (1 + tolerance) and value - base >= 1:
+            found.append(f"{column} {value:g} > median {base:g}")
+        elif not rise_is_bad and value < base * (1 - tolerance):
+            found.append(f"{column} {value:g} < median {base:g}")
+    for stage, seconds in latest.stage_seconds.items():
+        base = median(run.stage_seconds.get(stage, 0) for run in previous)
+        if base and seconds > base * (1 + tolerance):
+            found.append(f"{stage} stage {seconds:.1f}s > median {base:.1f}s")
+    return found
+
+
+async def report(window: int, tolerance: float) -> int:
+    schools = await history(window)
+    await async_engine.dispose()
+    if not schools:
+        print("No runs recorded in spider_runs yet")
+        return 0
+    regressed = False
+    for school_name, runs in sorted(schools.items()):
+        latest, previous = runs[0], runs[1:]
+        print(f"{school_name}: run {latest.run_id}, {latest.seconds:.0f}s, {latest.rows_inserted} rows, "
+              f"{latest.bytes_downloaded} bytes, {latest.openai_tokens} tokens, {latest.errors} errors "
+              f"(median of {len(previous)} before)")
+        for line in compare(latest, previous, tolerance):
+            regressed = True
+            print(f"  REGRESSION {line}")
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    # python -m src.runs [--window N] [--tolerance X]
+    import asyncio
+    import sys
+    args = sys.argv[1:]
+    window, tolerance = settings.runs_window, settings.runs_tolerance
+    if '--window' in args:
+        window = int(args[args.index('--window') + 1])
+    if '--tolerance' in args:
+        tolerance = float(args[args.index('--tolerance') + 1])
+    sys.exit(asyncio.run(report(window, tolerance)))
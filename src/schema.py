@@ -0,0 +1,208 @@
+from typing import Type
+from sqlalchemy import Connection, text
+from pgvector.sqlalchemy import HALFVEC
+from src.models import BaseDB, IndexSpec, search_vector_generated
+from src.settings import settings
+
+
+def migrate_columns(conn: Connection, scheme: Type[BaseDB]):
+    """Add model columns missing from an existing table."""
+    table = scheme.__tablename__
+    existing = set(conn.execute(text(
+        "SELECT attname FROM pg_attribute "
+        "WHERE attrelid = to_regclass(:table) AND attnum > 0 AND NOT attisdropped"), {'table': table}).scalars())
+    if not existing:
+        return
+    for column in scheme.__table__.columns:
+        if column.name not in existing and column.computed is None:
+            print(f"Adding column {table}.{column.name}")
+            conn.execute(text(
+                f"ALTER TABLE {table} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}"))
+
+
+def name_vector_types(conn: Connection, scheme: Type[BaseDB]) -> tuple[str | None, str]:
+    """Current and configured type of name_vector, the current one is None before the table exists."""
+    current = conn.execute(text(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = to_regclass(:table) AND attname = 'name_vector'"), {'table': scheme.__tablename__}).scalar()
+    return current, scheme.__table__.c.name_vector.type.get_col_spec().lower()
+
+
+def check_name_vector(conn: Connection, scheme: Type[BaseDB]):
+    """Raise unless the existing name_vector column takes the configured vectors.
+
+    An unsized ``vector`` column, as tables created before EMBEDDING_DIMENSIONS
+    have it, takes vectors of any size and is left alone.
+    """
+    current, target = name_vector_types(conn, scheme)
+    if current is None or current == target or (current == 'vector' and target.startswith('vector(')):
+        return
+    raise ValueError(f"{scheme.__tablename__}.name_vector is {current}, configured as {target}; "
+                     f"run python -m src.schema --migrate to convert it, or configure {current}")
+
+
+def migrate_name_vector(conn: Connection, scheme: Type[BaseDB]):
+    """Convert an existing name_vector column to the configured type.
+
+    Shrinking keeps the leading dimensions and re-normalizes them, which is
+    what text-embedding-3 returns for a reduced ``dimensions``. Rows whose
+    vector is shorter than the target are cleared and need re-embedding.
+    Requires pgvector >= 0.7 for subvector/l2_normalize.
+    """
+    table = scheme.__tablename__
+    current, target = name_vector_types(conn, scheme)
+    if current is None or current == target:
+        return
+    dim = scheme.__table__.c.name_vector.type.dim
+    if dim is None:
+        using = f"name_vector::{target}"
+    else:
+        using = (f"CASE WHEN vector_dims(name_vector::vector) >= {dim} "
+                 f"THEN l2_normalize(subvector(name_vector::vector, 1, {dim}))::{target} END")
+    # an index of the old type cannot be rebuilt for the new one, build_indexes recreates it;
+    # the definition is matched since a cast index has no column in indkey
+    indexes = conn.execute(text(
+        "SELECT i.relname FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+        "WHERE x.indrelid = to_regclass(:table) AND pg_get_indexdef(x.indexrelid) LIKE '%name_vector%'"),
+        {'table': table}).scalars().all()
+    for name in indexes:
+        print(f"Dropping index {name}")
+        conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+    print(f"Migrating {table}.name_vector from {current} to {target}")
+    conn.execute(text(
+        f"ALTER TABLE {table} ALTER COLUMN name_vector TYPE {target} USING {using}"))
+
+
+def migrate_search_vector(conn: Connection, scheme: Type[BaseDB]):
+    """Switch an existing search_vector between a plain and a generated column."""
+    table = scheme.__tablename__
+    computed = scheme.__table__.c.search_vector.computed
+    generated = conn.execute(text(
+        "SELECT attgenerated FROM pg_attribute "
+        "WHERE attrelid = to_regclass(:table) AND attname = 'search_vector'"), {'table': table}).scalar()
+    if generated is None:
+        return
+    if computed is not None and generated != 's':
+        # a plain column cannot be altered into a generated one
+        print(f"Regenerating {table}.search_vector as a generated column")
+        conn.execute(text(
+            f"ALTER TABLE {table} DROP COLUMN search_vector, ADD COLUMN search_vector tsvector "
+            f"GENERATED ALWAYS AS ({computed.sqltext}) STORED"))
+    elif computed is None and generated == 's':
+        print(f"Turning {table}.search_vector back into a plain column")
+        conn.execute(text(
+            f"ALTER TABLE {table} ALTER COLUMN search_vector DROP EXPRESSION"))
+
+
+def index_name(scheme: Type[BaseDB], spec: IndexSpec) -> str:
+    return f"{scheme.__tablename__}_{spec.column}_{spec.method}"
+
+
+def raise_maintenance_limits(conn: Connection):
+    # set_config(..., true) is SET LOCAL with the value bound instead of spliced in
+    conn.execute(text("SELECT set_config('maintenance_work_mem', :value, true)"),
+                 {'value': settings.index_maintenance_work_mem})
+    conn.execute(text(
+        f"SET LOCAL max_parallel_maintenance_workers = {settings.index_parallel_workers}"))
+
+
+def index_key(scheme: Type[BaseDB], spec: IndexSpec) -> str:
+    """Indexed column and operator class, raises when pgvector cannot build the index on the column.
+
+    A vector over the 2000 dimensions HNSW takes is indexed through a cast to
+    halfvec, queries use the index by ordering on ``name_vector::halfvec(N)``.
+    """
+    if spec.method not in ('hnsw', 'ivfflat'):
+        return spec.column
+    column_type = scheme.__table__.c[spec.column].type
+    halfvec = isinstance(column_type, HALFVEC)
+    if column_type.dim is None or column_type.dim > 4000:
+        raise ValueError(f"{index_name(scheme, spec)}: {spec.method} needs a {spec.column} of at most 4000 "
+                         f"dimensions, got {column_type.get_col_spec()}; set EMBEDDING_DIMENSIONS")
+    if halfvec:
+        return f"{spec.column} halfvec_{spec.distance}_ops"
+    if column_type.dim > 2000:
+        return f"({spec.column}::halfvec({column_type.dim})) halfvec_{spec.distance}_ops"
+    return f"{spec.column} vector_{spec.distance}_ops"
+
+
+def drop_indexes(conn: Connection, scheme: Type[BaseDB]):
+    """Drop the scheme's declared indexes, so a bulk load does not maintain them row by row."""
+    for spec in scheme.__indexes__:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index_name(scheme, spec)}"))
+
+
+def build_indexes(conn: Connection, scheme: Type[BaseDB], table: str | None = None, suffix: str = ''):
+    """Build the scheme's declared indexes on ``table`` that are missing or outdated.
+
+    Each index is commented with its spec, an index whose comment matches
+    is left alone so a sync load that changed little costs no rebuild.
+    Appending loads drop the indexes first, so they are built after each.
+    """
+    table = table or scheme.__tablename__
+    existing = dict(conn.execute(text(
+        "SELECT i.relname, obj_description(i.oid, 'pg_class') FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid WHERE x.indrelid = to_regclass(:table)"), {'table': table}).all())
+    raised = False
+    for spec in scheme.__indexes__:
+        name = index_name(scheme, spec) + suffix
+        indexed = index_key(scheme, spec)
+        params = ', '.join(f"{key} = {value}" for key, value in sorted(spec.params.items()))
+        signature = f"{spec.method}({indexed}) {params}".strip()
+        if existing.get(name) == signature:
+            continue
+        if not raised:
+            raise_maintenance_limits(conn)
+            raised = True
+        print(f"Building index {name}")
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        conn.execute(text(
+            f"CREATE INDEX {name} ON {table} USING {spec.method} ({indexed})"
+            + (f" WITH ({params})" if params else '')))
+        conn.execute(text(f"COMMENT ON INDEX {name} IS '{signature}'"))
+
+
+def check_search_config(conn: Connection):
+    """Raise unless SEARCH_CONFIG names a text search configuration of the database."""
+    found = conn.execute(text(
+        "SELECT cfgname FROM pg_ts_config WHERE oid = to_regconfig(:name)"), {'name': settings.search_config}).scalar()
+    if found is None:
+        raise ValueError(f"SEARCH_CONFIG {settings.search_config!r} is not in pg_ts_config")
+
+
+def prepare_table(conn: Connection, scheme: Type[BaseDB], migrate: bool = False):
+    """Create the school table if needed and bring its columns up to date.
+
+    Changing the type of an existing name_vector rewrites the table, so it
+    only happens with ``migrate`` (python -m src.schema --migrate); a crawl
+    whose name_vector does not match the configuration fails here instead.
+    """
+    # an index that cannot be built fails the run here, not after the crawl and load
+    for spec in scheme.__indexes__:
+        index_key(scheme, spec)
+    if search_vector_generated(scheme):
+        check_search_config(conn)
+    # only this table, concurrent create_all calls race on the shared metadata
+    scheme.__table__.create(conn, checkfirst=True)
+    migrate_columns(conn, scheme)
+    if migrate:
+        migrate_name_vector(conn, scheme)
+    else:
+        check_name_vector(conn, scheme)
+    migrate_search_vector(conn, scheme)
+
+
+if __name__ == '__main__':
+    import asyncio
+    import sys
+    from src.spiders import spiders
+    from src.dataset import async_engine
+
+    async def main(migrate: bool):
+        for spider in spiders:
+            async with async_engine.begin() as conn:
+                await conn.run_sync(prepare_table, spider.scheme, migrate)
+            async with async_engine.begin() as conn:
+                await conn.run_sync(build_indexes, spider.scheme)
+        await async_engine.dispose()
+    asyncio.run(main('--migrate' in sys.argv[1:]))
@@ -4,8 +4,11 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent.parent.parent))
 
 import httpx
+from src.http_client import get_client
+from src import checkpoint, parse_service
+from functools import partial
 import asyncio
-from bs4 import BeautifulSoup
+from src.soup import make_soup
 from pydantic import BaseModel, Field
 from typing import Optional, List, Set
 # from src.models import BaseDB, UCDCourseDB
@@ -132,7 +135,7 @@ async def fetch_crns(client: httpx.AsyncClient, term_code="202501", subject="-")
     try:
         response = await client.post(url, data=payload)
         if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = make_soup(response.text)
             crns = set()
             for td in soup.find_all('td', {'class': 'cs-view-course'}):
                 onclick_content = td.get('onclick', '')
@@ -154,146 +157,154 @@ async def fetch_crns(client: httpx.AsyncClient, term_code="202501", subject="-")
         print(f"Exception: {str(e)}")
         return set()
 
-async def extract_course_data(client: httpx.AsyncClient, crn: str, term_code="202501") -> Course:
+def course_from_html(html_content: str) -> Course:
     """
     Extract course information by processing all <td> elements.
     """
-    payload = {
-        "termCode": term_code,
-        "crn": crn
-    }
-    url = "https://registrar-apps.ucdavis.edu/courses/search/course.cfm"
+    soup = make_soup(html_content)
 
-    try:
-        response = await client.post(url, data=payload)
-        if response.status_code != 200:
-            print(f"Request failed for CRN {crn}")
-            print(f"Status code: {response.status_code}")
-            print(f"URL: {url}")
-            print(f"Payload: {payload}")
-            print(f"Response text: {response.text[:500]}...")  # Print first 500 chars of response
-            return Course()
+    course_data = {}
+
+    # Get all <td> elements
+    all_td = soup.find_all('td')
 
-        html_content = response.text
-        soup = BeautifulSoup(html_content, 'html.parser')
+    # Extract title
+    title_element = soup.find('h1', {'style': 'color:#BF9900!important;'})
+    course_data['title'] = title_element.text.strip() if title_element else None
 
-        course_data = {}
+    # Iterate over all <td> elements to extract fields
+    for td in all_td:
+        text = td.get_text(strip=True)
 
-        # Get all <td> elements
-        all_td = soup.find_all('td')
+        if text.startswith("Subject Area:"):
+            course_data['subject_area'] = text.replace("Subject Area:", "").strip()
 
-        # Extract title
-        title_element = soup.find('h1', {'style': 'color:#BF9900!important;'})
-        course_data['title'] = title_element.text.strip() if title_element else None
+        elif text.startswith("Term:"):
+            course_data['term'] = text.replace("Term:", "").strip()
 
-        # Iterate over all <td> elements to extract fields
-        for td in all_td:
-            text = td.get_text(strip=True)
+        elif text.startswith("CRN:"):
+            course_data['crn'] = text.replace("CRN:", "").strip()
 
-            if text.startswith("Subject Area:"):
-                course_data['subject_area'] = text.replace("Subject Area:", "").strip()
+        elif text.startswith("Instructor:"):
+            course_data['instructor'] = text.replace("Instructor:", "").strip()
 
-            elif text.startswith("Term:"):
-                course_data['term'] = text.replace("Term:", "").strip()
+        elif text.startswith("Units:"):
+            course_data['units'] = text.replace("Units:", "").strip()
 
-            elif text.startswith("CRN:"):
-                course_data['crn'] = text.replace("CRN:", "").strip()
+        elif text.startswith("GE Credit:"):
+            ge_credit_html = td.decode_contents()
+            course_data['ge_credits'] = [
+                line.strip() for line in ge_credit_html.split('<BR />') if line.strip() and "GE Credit:" not in line
+            ]
 
-            elif text.startswith("Instructor:"):
-                course_data['instructor'] = text.replace("Instructor:", "").strip()
+        elif text.startswith("Open Seats:"):
+            course_data['open_seats'] = text.replace("Open Seats:", "").strip()
 
-            elif text.startswith("Units:"):
-                course_data['units'] = text.replace("Units:", "").strip()
+        elif text.startswith("Reserved Seats:"):
+            course_data['reserved_seats'] = text.replace("Reserved Seats:", "").strip()
 
-            elif text.startswith("GE Credit:"):
-                ge_credit_html = td.decode_contents()
-                course_data['ge_credits'] = [
-                    line.strip() for line in ge_credit_html.split('<BR />') if line.strip() and "GE Credit:" not in line
-                ]
+        elif text.startswith("Waitlist:"):
+            course_data['waitlist'] = text.replace("Waitlist:", "").strip()
 
-            elif text.startswith("Open Seats:"):
-                course_data['open_seats'] = text.replace("Open Seats:", "").strip()
+        elif text.startswith("Maximum Enrollment:"):
+            course_data['max_enrollment'] = text.replace("Maximum Enrollment:", "").strip()
 
-            elif text.startswith("Reserved Seats:"):
-                course_data['reserved_seats'] = text.replace("Reserved Seats:", "").strip()
+        elif text.startswith("Final Exam:"):
+            course_data['final_exam'] = text.replace("Final Exam:", "").strip()
 
-            elif text.startswith("Waitlist:"):
-                course_data['waitlist'] = text.replace("Waitlist:", "").strip()
+        elif text.startswith("Course Drop:"):
+            course_data['course_drop'] = text.replace("Course Drop:", "").strip()
 
-            elif text.startswith("Maximum Enrollment:"):
-                course_data['max_enrollment'] = text.replace("Maximum Enrollment:", "").strip()
+        elif "UC Davis Bookstore" in text:
+            course_materials_link = td.find('a', string="UC Davis Bookstore")
+            course_data['course_materials'] = course_materials_link['href'] if course_materials_link else None
 
-            elif text.startswith("Final Exam:"):
-                course_data['final_exam'] = text.replace("Final Exam:", "").strip()
+        elif text.startswith("Description:"):
+            description_element = td.find('strong', string="Description:")
+            if description_element:
+                description = description_element.find_next_sibling(string=True)
+                course_data['description'] = description.strip() if description else None
 
-            elif text.startswith("Course Drop:"):
-                course_data['course_drop'] = text.replace("Course Drop:", "").strip()
 
-            elif "UC Davis Bookstore" in text:
-                course_materials_link = td.find('a', string="UC Davis Bookstore")
-                course_data['course_materials'] = course_materials_link['href'] if course_materials_link else None
+        elif text.startswith("Prerequisite:"):
+            prerequisite_link = td.find_next('a')
+            course_data['prerequisites'] = prerequisite_link['href'] if prerequisite_link else None
 
-            elif text.startswith("Description:"):
-                description_element = td.find('strong', string="Description:")
-                if description_element:
-                    description = description_element.find_next_sibling(string=True)
-                    course_data['description'] = description.strip() if description else None
+        elif text.startswith("Course Cross Listing:"):
+            cross_listing_link = td.find_next('a')
+            course_data['course_cross_listing'] = cross_listing_link['href'] if cross_listing_link else None
 
+    # Extract meeting times and locations
+    course_data['meeting_times'] = []
+    meeting_table = soup.find('table', {'width': '300'})
+    if meeting_table:
+        for row in meeting_table.find_all('tr')[1:]:
+            columns = row.find_all('td')
+            if len(columns) == 3:
+                day = columns[0].text.strip()
+                time = columns[1].text.strip()
+                location = columns[2].text.strip()
+                course_data['meeting_times'].append({'day': day, 'time': time, 'location': location})
 
-            elif text.startswith("Prerequisite:"):
-                prerequisite_link = td.find_next('a')
-                course_data['prerequisites'] = prerequisite_link['href'] if prerequisite_link else None
+    # Extract Canvas link
+    canvas_link = soup.find('a', href="https://canvas.ucdavis.edu/")
+    course_data['canvas_link'] = canvas_link['href'] if canvas_link else None
 
-            elif text.startswith("Course Cross Listing:"):
-                cross_listing_link = td.find_next('a')
-                course_data['course_cross_listing'] = cross_listing_link['href'] if cross_listing_link else None
+    # Convert dictionary to Course object
+    return Course(**course_data)
 
-        # Extract meeting times and locations
-        course_data['meeting_times'] = []
-        meeting_table = soup.find('table', {'width': '300'})
-        if meeting_table:
-            for row in meeting_table.find_all('tr')[1:]:
-                columns = row.find_all('td')
-                if len(columns) == 3:
-                    day = columns[0].text.strip()
-                    time = columns[1].text.strip()
-                    location = columns[2].text.strip()
-                    course_data['meeting_times'].append({'day': day, 'time': time, 'location': location})
 
-        # Extract Canvas link
-        canvas_link = soup.find('a', href="https://canvas.ucdavis.edu/")
-        course_data['canvas_link'] = canvas_link['href'] if canvas_link else None
+async def extract_course_data(client: httpx.AsyncClient, crn: str, term_code="202501") -> Course:
+    """
+    Extract course information by processing all <td> elements.
+    """
+    payload = {
+        "termCode": term_code,
+        "crn": crn
+    }
+    url = "https://registrar-apps.ucdavis.edu/courses/search/course.cfm"
+
+    try:
+        response = await client.post(url, data=payload)
+        if response.status_code != 200:
+            print(f"Request failed for CRN {crn}")
+            print(f"Status code: {response.status_code}")
+            print(f"URL: {url}")
+            print(f"Payload: {payload}")
+            print(f"Response text: {response.text[:500]}...")  # Print first 500 chars of response
+            return Course()
 
-        # Convert dictionary to Course object
-        return Course(**course_data)
+        courses = await parse_service.parse('ucd.course', response.content, url, encoding=response.encoding)
+        return courses[0]
     except Exception as e:
         print(f"Error extracting data for CRN {crn}:")
         print(f"URL: {url}")
         return Course()
 
-async def process_subject(client: httpx.AsyncClient, subject: str, semaphore: asyncio.Semaphore) -> List[Course]:
-    async with semaphore:
-        crns = await fetch_crns(client, term_code="202501", subject=subject)
-        tasks = []
-        for crn in crns:
-            tasks.append(extract_course_data(client, crn, term_code="202501"))
-        return await asyncio.gather(*tasks)
+async def process_subject(client: httpx.AsyncClient, subject: str) -> List[Course]:
+    crns = await fetch_crns(client, term_code="202501", subject=subject)
+    tasks = []
+    for crn in crns:
+        # a failed CRN comes back as an empty Course and is fetched again on resume
+        tasks.append(checkpoint.unit(('crn', crn), partial(extract_course_data, client, crn, term_code="202501"),
+                                     done=lambda course: course != Course()))
+    return await asyncio.gather(*tasks)
 
 async def main() :
     """
     Main function to extract all courses with concurrent processing.
     """
     all_courses = []
-    semaphore = asyncio.Semaphore(1)  # Limit concurrent requests
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        tasks = []
-        for subject in subjects:
-            tasks.append(process_subject(client, subject, semaphore))
+    # requests are paced per host by src.politeness
+    client = get_client("https://registrar-apps.ucdavis.edu")
+    tasks = []
+    for subject in subjects:
+        tasks.append(process_subject(client, subject))
 
-        results = await asyncio.gather(*tasks)
-        for courses in results:
-            all_courses.extend(courses)
+    results = await asyncio.gather(*tasks)
+    for courses in results:
+        all_courses.extend(courses)
 
     print(f"Found {len(all_courses)} courses for UC Davis")
 
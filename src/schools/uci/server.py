@@ -1,8 +1,13 @@
 from src.models import BaseDB, UCICourseDB
 from typing import Optional, List, Set
-from bs4 import BeautifulSoup
+from src import soup
+from src.soup import make_soup
 import asyncio
 import httpx
+from src.http_client import get_client
+from src import checkpoint, metrics, parse_service
+from src.sync import unit_failed
+from functools import partial
 import sys
 from pathlib import Path
 # Add project root to Python path
@@ -13,6 +18,91 @@ departments = ["AC ENG", "AFAM", "ANATOMY", "ANESTH", "ANTHRO", "ARABIC", "ARMN"
                "INTL ST", "IRAN", "ITALIAN", "JAPANSE", "KOREAN", "LATIN", "LAW", "LINGUIS", "LIT JRN", "LPS", "LSCI", "M&MG", "MATH", "MED", "MED ED", "MED HUM", "MGMT", "MGMT EP", "MGMT FE", "MGMT HC", "MGMTMBA", "MGMTPHD", "MIC BIO", "MOL BIO", "MPAC", "MSE", "MUSIC", "NET SYS", "NEURBIO", "NEUROL", "NUR SCI", "OB/GYN", "OPHTHAL", "PATH", "PED GEN", "PEDS", "PERSIAN", "PHARM", "PHILOS", "PHMD", "PHRMSCI", "PHY SCI", "PHYSICS", "PHYSIO", "PLASTIC", "PM&R", "POL SCI", "PORTUG", "PSCI", "PSY BEH", "PSYCH", "PUB POL", "PUBHLTH", "RADIO", "REL STD", "ROTC", "RUSSIAN", "SOC SCI", "SOCECOL", "SOCIOL", "SPANISH", "SPPS", "STATS", "SURGERY", "SWE", "TAGALOG", "TOX", "UCDC", "UNI AFF", "UNI STU", "UPPP", "VIETMSE", "VIS STD", "WRITING"]
 
 
+COLUMNS = ['code', 'type', 'section', 'units', 'instructor_name', 'modality', 'time', 'place', 'final',
+           'max_capacity', 'enrolled', 'waitlist', 'requests', 'restrictions', 'textbooks', 'web', 'status']
+
+
+def courses_from_tree(html: str, url: str, payload: dict, department: str) -> List[UCICourseDB]:
+    """courses_from_html on lxml's tree, rows of nested tables are read once per enclosing table alike."""
+    tables = soup.make_tree(html).xpath('//table')
+    if not tables:
+        print(f"Warning: No tables found for department {department}")
+        print(f"Response content preview: {html[:200]}...")
+    courses = []
+    for table in tables:
+        for row in table.xpath('.//tr[@bgcolor]'):
+            cols = [soup.text(col).strip() for col in row.xpath('.//td')]
+            if len(cols) < 17:
+                continue
+            try:
+                values = dict(zip(COLUMNS, cols))
+                values['code'] = int(cols[0]) if cols[0] else None
+                courses.append(UCICourseDB(**values, source_url=url, payload=str(payload)))
+            except Exception as parse_error:
+                print(f"Error parsing course in {department}: {str(parse_error)}")
+    return courses
+
+
+def courses_from_html(html: str, url: str, payload: dict, department: str) -> List[UCICourseDB]:
+    """Walk the WebSoc result tables, one course per row with 17+ cells."""
+    if soup.native():
+        return courses_from_tree(html, url, payload, department)
+    tree = make_soup(html)
+
+    # Find all tables that contain course data
+    tables = tree.find_all('table')
+    courses = []
+
+    # Debug information
+    if not tables:
+        print(f"Warning: No tables found for department {
+              department}")
+        print(f"Response content preview: {
+              html[:200]}...")
+
+    for table in tables:
+        # Look for rows that contain course data
+        rows = table.find_all('tr', attrs={'bgcolor': True})
+
+        # Debug information
+        if not rows:
+            continue
+
+        for row in rows:
+            cols = row.find_all('td')
+            if len(cols) >= 17:
+                try:
+                    course = UCICourseDB(
+                        code=int(cols[0].text.strip(
+                        )) if cols[0].text.strip() else None,
+                        type=cols[1].text.strip(),
+                        section=cols[2].text.strip(),
+                        units=cols[3].text.strip(),
+                        instructor_name=cols[4].text.strip(),
+                        modality=cols[5].text.strip(),
+                        time=cols[6].text.strip(),
+                        place=cols[7].text.strip(),
+                        final=cols[8].text.strip(),
+                        max_capacity=cols[9].text.strip(),
+                        enrolled=cols[10].text.strip(),
+                        waitlist=cols[11].text.strip(),
+                        requests=cols[12].text.strip(),
+                        restrictions=cols[13].text.strip(),
+                        textbooks=cols[14].text.strip(),
+                        web=cols[15].text.strip(),
+                        status=cols[16].text.strip(),
+                        source_url=url,
+                        payload=str(payload)
+                    )
+                    courses.append(course)
+                except Exception as parse_error:
+                    print(f"Error parsing course in {
+                          department}: {str(parse_error)}")
+                    continue
+
+    return courses
+
+
 async def get_courses_by_department(department: str, YearTerm="2025-03", max_retries=3) -> List[UCICourseDB]:
     """Get all courses for a given department and term."""
     url = "https://www.reg.uci.edu/perl/WebSoc"
@@ -42,81 +132,31 @@ async def get_courses_by_department(department: str, YearTerm="2025-03", max_ret
     }
 
     for attempt in range(max_retries):
+        if attempt:
+            metrics.inc('retries', 'fetch')
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, data=payload)
-                response.raise_for_status()
-
-                if not response.text:
-                    raise ValueError("Empty response received")
-
-                soup = BeautifulSoup(response.text, 'html.parser')
-
-                # Find all tables that contain course data
-                tables = soup.find_all('table')
-                courses = []
-
-                # Debug information
-                if not tables:
-                    print(f"Warning: No tables found for department {
-                          department}")
-                    print(f"Response content preview: {
-                          response.text[:200]}...")
-
-                for table in tables:
-                    # Look for rows that contain course data
-                    rows = table.find_all('tr', attrs={'bgcolor': True})
-
-                    # Debug information
-                    if not rows:
-                        continue
-
-                    for row in rows:
-                        cols = row.find_all('td')
-                        if len(cols) >= 17:
-                            try:
-                                course = UCICourseDB(
-                                    code=int(cols[0].text.strip(
-                                    )) if cols[0].text.strip() else None,
-                                    type=cols[1].text.strip(),
-                                    section=cols[2].text.strip(),
-                                    units=cols[3].text.strip(),
-                                    instructor_name=cols[4].text.strip(),
-                                    modality=cols[5].text.strip(),
-                                    time=cols[6].text.strip(),
-                                    place=cols[7].text.strip(),
-                                    final=cols[8].text.strip(),
-                                    max_capacity=cols[9].text.strip(),
-                                    enrolled=cols[10].text.strip(),
-                                    waitlist=cols[11].text.strip(),
-                                    requests=cols[12].text.strip(),
-                                    restrictions=cols[13].text.strip(),
-                                    textbooks=cols[14].text.strip(),
-                                    web=cols[15].text.strip(),
-                                    status=cols[16].text.strip(),
-                                    source_url=url,
-                                    payload=str(payload)
-                                )
-                                courses.append(course)
-                            except Exception as parse_error:
-                                print(f"Error parsing course in {
-                                      department}: {str(parse_error)}")
-                                continue
-
-                return courses
+            client = get_client(url)
+            response = await client.post(url, data=payload)
+            response.raise_for_status()
+
+            if not response.text:
+                raise ValueError("Empty response received")
+
+            return await parse_service.parse('uci.websoc', response.content, url, encoding=response.encoding,
+                                             payload=payload, department=department)
 
         except httpx.TimeoutException as e:
             print(f"Timeout for department {department} (attempt {
                   attempt + 1}/{max_retries}): {str(e)}")
             if attempt == max_retries - 1:
-                return []
+                break
             await asyncio.sleep(1 * (attempt + 1))
 
         except httpx.HTTPError as e:
             print(f"HTTP error for department {
                   department} (attempt {attempt + 1}/{max_retries}): {str(e)}")
             if attempt == max_retries - 1:
-                return []
+                break
             await asyncio.sleep(1 * (attempt + 1))
 
         except Exception as e:
@@ -125,8 +165,10 @@ async def get_courses_by_department(department: str, YearTerm="2025-03", max_ret
             print(f"Exception type: {type(e).__name__}")
             print(f"Exception details: {str(e)}")
             if attempt == max_retries - 1:
-                return []
+                break
             await asyncio.sleep(1 * (attempt + 1))
+    # every department's rows share the WebSoc url, the payload tells them apart
+    unit_failed(source_url=url, payload=str(payload))
     return []
 
 
@@ -135,28 +177,14 @@ async def get_all_courses() -> List[UCICourseDB]:
     print(f"Getting courses for UCI")
     all_courses = []
 
-    # 减少并发请求数量，增加间隔时间
-    semaphore = asyncio.Semaphore(2)  # 降到2个并发
-
-    async def fetch_department(dept):
-        async with semaphore:
-            courses = await get_courses_by_department(dept)
-            # print(f"Retrieved {len(courses)} courses from {dept}")
-            return courses
-
-    # 分批处理departments，减小批次大小
-    batch_size = 5  # 减小到5个
-    for i in range(0, len(departments), batch_size):
-        batch = departments[i:i+batch_size]
-        tasks = [fetch_department(dept) for dept in batch]
-        results = await asyncio.gather(*tasks)
-
-        for courses in results:
-            all_courses.extend(courses)
+    # 请求速率和并发由 src.politeness 按主机控制 (settings.http_hosts)
+    # departments finished before an interrupted run are read from its checkpoint
+    tasks = [checkpoint.unit(('department', dept), partial(get_courses_by_department, dept))
+             for dept in departments]
+    results = await asyncio.gather(*tasks)
 
-        # 增加批次间隔时间
-        if i + batch_size < len(departments):
-            await asyncio.sleep(3)  # 增加到3秒
+    for courses in results:
+        all_courses.extend(courses)
 
     print(f"Total courses found: {len(all_courses)}")
     return all_courses
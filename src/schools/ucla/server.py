@@ -2,9 +2,16 @@ from typing import Dict
 from typing import List
 from src.models import BaseDB, UCSDCourseDB
 from typing import List
-from bs4 import BeautifulSoup
+from src import soup
+from src.soup import make_soup
 import asyncio
 import httpx
+from src.http_client import get_client
+from src.http_cache import fetch, parse_once
+from src.parsers import parser_version
+from src import checkpoint, parse_service
+from src.sync import unit_failed
+from functools import partial
 import sys
 from pathlib import Path
 from urllib.parse import urlencode
@@ -211,12 +218,57 @@ departments = [
 ]
 
 
+def course_details_from_tree(content: str) -> List[UCLACourseDB]:
+    """get_course_details on lxml's tree."""
+    def first(row, name: str):
+        found = row.xpath(f".//div[{soup.has_class(name)}]")
+        return found[0] if found else None
+    sections = []
+    for row in soup.make_tree(content).xpath(
+            "//div[contains(@class, 'row-fluid') and contains(@class, 'data_row')]"):
+        section = {}
+        section_elem = first(row, 'cls-section')
+        if section_elem is not None:
+            section['section'] = soup.text(section_elem.xpath('.//a')[0]).strip()
+        status_elem = first(row, 'statusColumn')
+        if status_elem is not None:
+            enrollment_info = soup.text(status_elem).strip().split('\n')
+            section['status'] = enrollment_info[0].strip()
+            if len(enrollment_info) > 1:
+                enrolled, total = map(int, enrollment_info[1].split('of')[0:2])
+                section['enrolled'] = enrolled
+                section['capacity'] = total
+        waitlist_elem = first(row, 'waitlistColumn')
+        if waitlist_elem is not None:
+            section['waitlist'] = soup.text(waitlist_elem).strip()
+        time_elem = first(row, 'timeColumn')
+        if time_elem is not None:
+            days_elem = first(time_elem, 'dayColumn')
+            if days_elem is None:
+                days_elem = next((div for div in time_elem.xpath('.//div[@id]')
+                                  if div.get('id').endswith('-days_data')), None)
+            if days_elem is not None:
+                section['days'] = soup.text(days_elem).strip()
+            time_text = time_elem.xpath('.//p')
+            if time_text:
+                section['time'] = soup.text(time_text[0]).strip()
+        for column, name in (('location', 'locationColumn'), ('units', 'unitsColumn'),
+                             ('instructor_name', 'instructorColumn')):
+            elem = first(row, name)
+            if elem is not None:
+                section[column] = soup.text(elem).strip()
+        sections.append(UCLACourseDB(**section))
+    return sections
+
+
 def get_course_details(content: str) -> List[UCLACourseDB]:
-    soup = BeautifulSoup(content, 'html.parser')
+    if soup.native():
+        return course_details_from_tree(content)
+    tree = make_soup(content)
     sections = []
 
     # 修改选择器以更灵活地匹配行
-    rows = soup.select('div[class*="row-fluid"][class*="data_row"]')
+    rows = tree.select('div[class*="row-fluid"][class*="data_row"]')
 
     # Find all section rows
     for row in rows:
@@ -315,41 +367,42 @@ async def get_course_summary(course_data: dict, YearTerm="25W") -> List[UCLACour
         "_": str(int(time.time() * 1000))
     }
 
-    async with httpx.AsyncClient(follow_redirects=True, timeout=30.0) as client:
-
-        try:
-            response = await client.get(
-                base_url,
-                params=params
-            )
-            if response.status_code == 200:
-                data = response.text
-                courses = get_course_details(data)
-                for course in courses:
-                    course.term = model["Term"]
-                    course.subject_area_code = model["SubjectAreaCode"]
-                    course.catalog_number = model["CatalogNumber"]
-                    course.class_number = model["ClassNumber"]
-                    course.sequence_number = model["SequenceNumber"]
-                    course.path = model["Path"]
-                    course.token = model["Token"]
-                return courses
-            else:
-                print(f"HTTP Error {response.status_code}: {response.text}")
-                return []
-
-        except Exception as e:
-            print(f"Request error: {e}")
-            return []
-
-
-async def extract_course_data(response_json: dict) -> List[UCLACourseDB]:
+    client = get_client(base_url)
+
+    try:
+        response = await client.get(
+            base_url,
+            params=params
+        )
+        if response.status_code == 200:
+            courses = await parse_service.parse('ucla.course_details', response.content, base_url,
+                                                encoding=response.encoding)
+            for course in courses:
+                course.term = model["Term"]
+                course.subject_area_code = model["SubjectAreaCode"]
+                course.catalog_number = model["CatalogNumber"]
+                course.class_number = model["ClassNumber"]
+                course.sequence_number = model["SequenceNumber"]
+                course.path = model["Path"]
+                course.token = model["Token"]
+            return courses
+        else:
+            print(f"HTTP Error {response.status_code}: {response.text}")
+
+    except Exception as e:
+        print(f"Request error: {e}")
+    unit_failed(subject_area_code=model["SubjectAreaCode"], catalog_number=model["CatalogNumber"],
+                class_number=model["ClassNumber"])
+    return []
+
+
+def extract_course_data(response_json: dict) -> List[UCLACourseDB]:
     """Extract course data from the ClassPartialViewData HTML content."""
     courses = []
 
     # Get HTML content from ClassPartialViewData
     html_content = response_json.get("ClassPartialViewData", "")
-    soup = BeautifulSoup(html_content, 'html.parser')
+    soup = make_soup(html_content)
 
     # Find all script tags containing course data
     scripts = soup.find_all('script')
@@ -402,50 +455,47 @@ async def get_courses_list(department: Dict[str, str], YearTerm="25W") -> List[U
     }
 
     # Perform HTTP request with proper headers
-    async with httpx.AsyncClient(follow_redirects=True, timeout=30.0) as client:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "application/json, text/javascript, */*; q=0.01",
-            "Accept-Language": "en-US,en;q=0.9",
-            "X-Requested-With": "XMLHttpRequest",
-            "Referer": "https://sa.ucla.edu/ro/public/soc",
-            "Connection": "keep-alive",
-        }
-
-        try:
-            response = await client.get(base_url, params=params, headers=headers)
-
-            if response.status_code == 200:
-                response_json = response.json()
-                courses = await extract_course_data(response_json)
-
-                # Get detailed summary for each course
-                detailed_courses = []
-                for course in courses:
-                    summary = await get_course_summary(course, YearTerm)
-                    if summary:
-                        detailed_courses.extend(summary)
-
-                return detailed_courses
-            else:
-                print(f"Error Status: {response.status_code}")
-                return []
-
-        except Exception as e:
-            print(f"Request Error: {e}")
-            return []
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept": "application/json, text/javascript, */*; q=0.01",
+        "Accept-Language": "en-US,en;q=0.9",
+        "X-Requested-With": "XMLHttpRequest",
+        "Referer": "https://sa.ucla.edu/ro/public/soc",
+    }
+
+    try:
+        page = await fetch(base_url, params=params, headers=headers)
+
+        if page.status == 200:
+            # the title list rarely changes, the summaries below are still fetched
+            async def titles():
+                return extract_course_data(page.json())
+            courses = await parse_once(page, titles, parser_version('src.schools.ucla.server'))
+
+            # Get detailed summary for each course
+            detailed_courses = []
+            for course in courses:
+                key = ('class', course["SubjectAreaCode"], course["CatalogNumber"], course["ClassNumber"])
+                summary = await checkpoint.unit(key, partial(get_course_summary, course, YearTerm))
+                if summary:
+                    detailed_courses.extend(summary)
+
+            return detailed_courses
+        else:
+            print(f"Error Status: {page.status}")
+
+    except Exception as e:
+        print(f"Request Error: {e}")
+    unit_failed(subject_area_code=department["value"])
+    return []
 
 
 async def get_all_courses() -> List[UCLACourseDB]:
     """Get all courses for all departments."""
     all_courses = []
-    semaphore = asyncio.Semaphore(15)
-
-    async def get_courses_with_semaphore(department):
-        async with semaphore:
-            return await get_courses_list(department)
-
-    tasks = [get_courses_with_semaphore(department)
+    # sa.ucla.edu is paced by src.politeness
+    # a resumed run skips finished departments, and finished classes of the others
+    tasks = [checkpoint.unit(('department', department["value"]), partial(get_courses_list, department))
              for department in departments]
     for future in tqdm.tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Fetching Courses"):
         all_courses.extend(await future)
@@ -1 +1 @@
-from .server import main
+from .server import main, urls, fetch_url, parse_page, from_pydantic
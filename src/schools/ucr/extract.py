@@ -4,6 +4,9 @@ from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field, PrivateAttr
 from typing import Optional
 from src.settings import settings
+from src.ratelimit import acquire_prompt_tokens
+from src.http_client import get_client
+import asyncio
 
 
 class Course(BaseModel):
@@ -50,6 +53,8 @@ class Data(BaseModel):
     )
 
 
+model = "gpt-4o"
+
 prompt_template = ChatPromptTemplate.from_messages(
     [
         (
@@ -80,13 +85,20 @@ async def extract(segs: List[str], url: str) -> List[Course]:
             new_segs.append(seg)
     segs = new_segs
     llm = ChatOpenAI(
-        model="gpt-4o", max_retries=5, timeout=30, api_key=settings.openai_api_key)
+        model=model, max_retries=5, timeout=30, api_key=settings.openai_api_key,
+        http_async_client=get_client("https://api.openai.com"))
     structured_llm = llm.with_structured_output(schema=Data)
 
     prompt: List[Dict[str, Any]] = await prompt_template.abatch([{"text": text} for text in segs])
-    data_list: List[Data] = await structured_llm.abatch(prompt, {
-        'max_concurrency': 15,
-    })
+
+    # capped like abatch's max_concurrency, and throttled by the shared tokens-per-minute budget
+    semaphore = asyncio.Semaphore(settings.openai_chat_concurrency)
+
+    async def invoke(prompt_value) -> Data:
+        async with semaphore:
+            await acquire_prompt_tokens(model, prompt_value.to_string())
+            return await structured_llm.ainvoke(prompt_value)
+    data_list: List[Data] = await asyncio.gather(*[invoke(p) for p in prompt])
 
     # Flatten course data
 
@@ -1,12 +1,13 @@
 from .utils import handle_tba, retrieve_list_from_pickle, save_list_to_pickle
 from src.models import BaseDB, UCSCCourseDB
 import requests
-import aiohttp
 import asyncio
 from tqdm.asyncio import tqdm
 from typing import List
-from src.process import post_process
 import httpx
+from src.http_client import get_client
+from src import checkpoint
+from functools import partial
 
 
 class Course:
@@ -56,29 +57,21 @@ cached_course_numbers = retrieve_list_from_pickle(course_number_file_path)
 # Asynchronous wrapper for get_course_info
 
 
-async def get_course_info(course_number, semaphore=None):
-    if semaphore:
-        async with semaphore:
-            return await fetch_course(course_number)
-    else:
-        return await fetch_course(course_number)
+async def get_course_info(course_number):
+    return await fetch_course(course_number)
 
 
 # Helper function for fetching course data
 async def fetch_course(course_number):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{base_url}/{course_number}") as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                return await parse_course(data)
+    resp = await get_client(base_url).get(f"{base_url}/{course_number}")
+    if resp.status_code == 200:
+        return await parse_course(resp.json())
     return None
 
 
 # Parse the JSON data to create a Course instance
 async def parse_course(json_data) -> Course | None:
-    primary_section = json_data.get("primary_section", {})
     meetings = json_data.get("meetings", [])
-    first_meeting = meetings[0] if meetings else None
     secondary_sections = json_data.get("secondary_sections", [])
     notes = json_data.get("notes", [])
 
@@ -90,9 +83,8 @@ async def parse_course(json_data) -> Course | None:
             instructor_id = instructors[0].get("cruzid")
             for i in range(3):  # Retry up to 3 times
                 try:
-                    async with httpx.AsyncClient() as client:
-                        instructor_resp = await client.get(
-                            f"{instructor_base_url}/{instructor_id}")
+                    instructor_resp = await get_client(instructor_base_url).get(
+                        f"{instructor_base_url}/{instructor_id}")
                     if instructor_resp.status_code == 200:
                         data = instructor_resp.json()
                         instructor_name = data.get("givenname", [])[
@@ -111,6 +103,15 @@ async def parse_course(json_data) -> Course | None:
         else:
             instructor_name = None  # Null if no cruzid
 
+    return course_from_json(json_data, instructor_name)
+
+
+def course_from_json(json_data, instructor_name=None) -> Course:
+    """Course from a class API response, the instructor looked up separately."""
+    primary_section = json_data.get("primary_section", {})
+    meetings = json_data.get("meetings", [])
+    first_meeting = meetings[0] if meetings else None
+
     # Create the Course object
     course = Course(
         id=primary_section.get("class_nbr"),
@@ -143,7 +144,7 @@ async def parse_course(json_data) -> Course | None:
 
 
 def map_course_to_db(course: Course) -> UCSCCourseDB:
-    return UCSCCourseDB(id=course.id, source_url=f"https://literature.ucsc.edu/courses/?d={course.subject}&t=2250",
+    return UCSCCourseDB(id=course.id, class_number=str(course.id), source_url=f"https://literature.ucsc.edu/courses/?d={course.subject}&t=2250",
                         remark=course.description, instructor_name=course.instructor_name, subject=course.subject,
                         number=course.number, display_name=course.display_name, instruction_mode=course.instruction_mode,
                         academic_group=course.academic_group, start_date=course.start_date, end_date=course.end_date,
@@ -152,17 +153,18 @@ def map_course_to_db(course: Course) -> UCSCCourseDB:
                         term=course.term, days=course.days, start_time=course.start_time, end_time=course.end_time, units=course.units)
 
 
-# Asynchronous main function with tqdm and optional semaphore
+# Asynchronous main function with tqdm
 async def main() -> List[BaseDB]:
     ucsc_data = []
     tasks = []
     cached = not not cached_course_numbers
-    semaphore = asyncio.Semaphore(5)  # Limit concurrency to 5 requests
+    # requests are paced per host by src.politeness
 
     # Create tasks for cached or range of course numbers
     course_numbers = cached_course_numbers if cached else range(30000, 34000)
     for course_number in course_numbers:
-        tasks.append(get_course_info(course_number, semaphore))
+        # class numbers without a course are not checkpointed and are probed again on resume
+        tasks.append(checkpoint.unit(('class', course_number), partial(get_course_info, course_number)))
 
     new_cached_course_numbers = []
 
@@ -177,9 +179,9 @@ async def main() -> List[BaseDB]:
     if not cached:
         save_list_to_pickle(course_number_file_path, new_cached_course_numbers)
 
+    # embedded by process_school through Spider.embedding_text
     all_course_data = []
     for course in ucsc_data:
         all_course_data.append(map_course_to_db(course))
-    all_course_data = await post_process(all_course_data, [course.course_name for course in ucsc_data], [course.course_name for course in ucsc_data])
 
     return all_course_data
@@ -2,7 +2,8 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select
 import time
-from bs4 import BeautifulSoup
+from src.soup import make_soup
+from src import checkpoint
 from src.models import UCSDCourseDB
 from typing import List
 import asyncio
@@ -15,7 +16,7 @@ url = "https://act.ucsd.edu/scheduleOfClasses/scheduleOfClassesStudentResult.htm
 
 
 def extract_page_content(page_source) -> List[UCSDCourseDB]:
-    soup = BeautifulSoup(page_source, 'html.parser')
+    soup = make_soup(page_source)
     tables = soup.find_all('table', class_='tbrdr')
     courses = []  # 改为存储课程列表
 
@@ -153,6 +154,12 @@ def scrape_department_courses() -> List[UCSDCourseDB]:
     for department in departments:
         dept_start_time = time.time()
         # print(f"Processing department: {department}")
+        # 中断前已完成的部门直接使用检查点中的课程
+        saved = checkpoint.load(('department', department))
+        if saved is not None:
+            all_courses.extend(saved)
+            continue
+        department_courses = []
 
         driver = webdriver.Chrome(options=chrome_options)
         try:
@@ -193,6 +200,7 @@ def scrape_department_courses() -> List[UCSDCourseDB]:
                     page_content = driver.page_source
                     page_courses = extract_page_content(page_content)
                     all_courses.extend(page_courses)  # 将当前页面的课程添加到总列表中
+                    department_courses.extend(page_courses)
                     # print(f"Page {page_number}: {len(page_courses)} courses processed")
 
                     try:
@@ -209,6 +217,8 @@ def scrape_department_courses() -> List[UCSDCourseDB]:
                     except TimeoutException:
                         # print(f"Reached last page for department {department}")
                         break
+                # 所有页面都已读取，记录该部门
+                checkpoint.save(('department', department), department_courses)
 
             except TimeoutException:
                 # print(f"Timeout or no results for department {department}")
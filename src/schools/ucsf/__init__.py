@@ -1 +1 @@
-from .server import main
\ No newline at end of file
+from .server import main, units, fetch_page, parse_courses
\ No newline at end of file
@@ -1,11 +1,13 @@
-from bs4 import BeautifulSoup
+from src.soup import make_soup
 import requests
 from src.models import UCSFCourseDB, BaseDB
 from typing import List
-from src.process import post_process
 from tqdm.asyncio import tqdm
 import httpx
-import aiohttp
+from src.http_cache import Page, fetch, parse_once
+from src.parsers import parser_version
+from src import metrics, parse_service
+from src.sync import unit_failed
 import asyncio
 
 base_url = "https://catalog.ucsf.edu/course-catalog"
@@ -88,74 +90,96 @@ subjects = {
 }
 
 
+def units():
+    return [(f"{base_url}/{key}", value) for key, value in subjects.items()]
+
+
+async def fetch_page(unit) -> Page | None:
+    url, _ = unit
+    page = None
+    # Retry up to 3 times if request fail
+    for attempt in range(3):
+        if attempt:
+            metrics.inc('retries', 'fetch')
+        try:
+            page = await fetch(url)
+            if page.body:
+                break
+        except Exception as ex:
+            print(ex)
+            continue
+    return page
+
+
+async def parse_courses(unit, page: Page | None) -> List[UCSFCourseDB]:
+    url, subject = unit
+    if page is None or not page.body:
+        unit_failed(source_url=url)
+        return []
+
+    async def parse():
+        return await parse_service.parse('ucsf.courseblock', page.body, url,
+                                         encoding=page.encoding, subject=subject)
+    # unchanged catalog pages are not parsed again
+    return await parse_once(page, parse, parser_version('src.schools.ucsf.server'))
+
+
+def courses_from_html(url, subject, resp_text) -> List[UCSFCourseDB]:
+    soup = make_soup(resp_text)
+    courseblocks = soup.find_all('div', class_='courseblock')
+
+    courses = []
+    for block in courseblocks:
+        course_code = block.find('span', class_="detail-code").get_text(strip=True)
+        splitted_course_code = course_code.split(" ")
+        course_prefix = splitted_course_code[0]
+        course_number = splitted_course_code[-1]
+
+        course_title = block.find('span', class_="detail-title").get_text(strip=True)
+        course_unit = block.find('span', class_="detail-hours_html").get_text(strip=True).split(" ")[0][1:]
+        course_term = block.find('span', class_="detail-offering").get_text(strip=True)
+
+        instructor_blocks = block.select('div > p > span.skip-makebubbles > span > a')
+        course_instructor = instructor_blocks[0].get_text(strip=True) if instructor_blocks else None
+
+        activity_tag = block.find('p', class_="detail-activities")
+        if activity_tag:
+            course_activities = ''.join(str(item).strip() for item in activity_tag.contents if not hasattr(item, 'contents')).strip()
+            course_description = activity_tag.find_parent('div').next_sibling.find('p').get_text(strip=True)
+        else:
+            course_activities, course_description = None, None
+
+        course = UCSFCourseDB(
+            remark=course_description, term=course_term, units=course_unit,
+            activity=course_activities, prefix=course_prefix, number=course_number,
+            instructor_name=course_instructor, course_name=course_title, source_url=url,
+            subject=subject
+        )
+        courses.append(course)
+
+    return courses
+
+
 async def fetch_course_info(url, subject):
-    async with aiohttp.ClientSession() as session:
-        # Retry up to 3 times if request fail
-        for _ in range(3):
-            try:
-                async with session.get(url) as resp:
-                    resp_text = await resp.text()
-                    if resp_text:
-                        break
-            except Exception as ex:
-                print(ex)
-                continue
-        if not resp_text:
-            return []
-        soup = BeautifulSoup(resp_text, 'html.parser')
-        courseblocks = soup.find_all('div', class_='courseblock')
-
-        courses = []
-        for block in courseblocks:
-            course_code = block.find('span', class_="detail-code").get_text(strip=True)
-            splitted_course_code = course_code.split(" ")
-            course_prefix = splitted_course_code[0]
-            course_number = splitted_course_code[-1]
-
-            course_title = block.find('span', class_="detail-title").get_text(strip=True)
-            course_unit = block.find('span', class_="detail-hours_html").get_text(strip=True).split(" ")[0][1:]
-            course_term = block.find('span', class_="detail-offering").get_text(strip=True)
-
-            instructor_blocks = block.select('div > p > span.skip-makebubbles > span > a')
-            course_instructor = instructor_blocks[0].get_text(strip=True) if instructor_blocks else None
-
-            activity_tag = block.find('p', class_="detail-activities")
-            if activity_tag:
-                course_activities = ''.join(str(item).strip() for item in activity_tag.contents if not hasattr(item, 'contents')).strip()
-                course_description = activity_tag.find_parent('div').next_sibling.find('p').get_text(strip=True)
-            else:
-                course_activities, course_description = None, None
-
-            course = UCSFCourseDB(
-                remark=course_description, term=course_term, units=course_unit,
-                activity=course_activities, prefix=course_prefix, number=course_number,
-                instructor_name=course_instructor, course_name=course_title, source_url=url,
-                subject=subject
-            )
-            courses.append((course, course_title))
-
-        return courses
+    unit = (url, subject)
+    return await parse_courses(unit, await fetch_page(unit))
+
 
 async def main() -> List[UCSFCourseDB]:
-    course_titles = []
     courses_db = []
     tasks = []
 
-    async with aiohttp.ClientSession() as session:
-        for key, value in tqdm(subjects.items()):
-            url = f"{base_url}/{key}"
-            tasks.append(fetch_course_info(url, value))
+    for key, value in tqdm(subjects.items()):
+        url = f"{base_url}/{key}"
+        tasks.append(fetch_course_info(url, value))
 
-        results = await asyncio.gather(*tasks)
+    results = await asyncio.gather(*tasks)
 
-        for l in results:
-            if not l:
-                continue
-            for db, title in l:
-                course_titles.append(title)
-                courses_db.append(db)
+    for l in results:
+        if not l:
+            continue
+        courses_db.extend(l)
 
     print(len(courses_db))
-    # Assuming post_process is also async
-    courses_db = await post_process(courses_db, course_titles, course_titles)
+    # embedded by process_school through Spider.embedding_text
     return courses_db
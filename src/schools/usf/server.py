@@ -1,15 +1,20 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 import httpx
-from bs4 import BeautifulSoup
+from src.http_client import get_client
+from src import checkpoint, metrics, parse_service
+from src.sync import unit_failed
+from src import soup
+from src.soup import make_soup
 import bs4
 import asyncio
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from src.models import USFCourseDB, BaseDB
-from src.process import post_process
 from pydantic import BaseModel, Field
 from src.settings import settings
+from src.ratelimit import acquire_prompt_tokens
 import tqdm
+from functools import partial
 
 
 class CourseModel(BaseModel):
@@ -63,94 +68,153 @@ class CourseModel(BaseModel):
     )
 
 
-async def get_course_links() -> List[BaseDB]:
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://ssb-prod.ec.usfca.edu/PROD/bwckschd.p_get_crse_unsec",
-            headers={
-                "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-                "accept-language": "zh-CN,zh;q=0.9",
-                "cache-control": "no-cache",
-                "content-type": "application/x-www-form-urlencoded",
-                "pragma": "no-cache",
-                "priority": "u=0, i",
-                "sec-ch-ua": "\"Google Chrome\";v=\"131\", \"Chromium\";v=\"131\", \"Not_A Brand\";v=\"24\"",
-                "sec-ch-ua-mobile": "?0",
-                "sec-ch-ua-platform": "\"macOS\"",
-                "sec-fetch-dest": "document",
-                "sec-fetch-mode": "navigate",
-                "sec-fetch-site": "same-origin",
-                "sec-fetch-user": "?1",
-                "upgrade-insecure-requests": "1"
-            },
-            timeout=20,
-            data="term_in=202520&sel_subj=dummy&sel_day=dummy&sel_schd=dummy&sel_insm=dummy&sel_camp=dummy&sel_levl=dummy&sel_sess=dummy&sel_instr=dummy&sel_ptrm=dummy&sel_attr=dummy&sel_subj=%25&sel_crse=&sel_title=%25&sel_insm=%25&sel_camp=%25&sel_levl=%25&sel_instr=%25&sel_attr=%25&begin_hh=0&begin_mi=0&begin_ap=a&end_hh=0&end_mi=0&end_ap=a&begin_ap=x&end_ap=y"
+def course_pairs(html: str) -> list:
+    """(title row, info row) pairs of the sections table."""
+    tree = make_soup(html)
+    global_table = tree.find('table', class_='datadisplaytable',
+                             summary='This layout table is used to present the sections found')
+
+    table = list(filter(lambda x: x.name == 'tr', global_table.children))
+
+    return [(table[i], table[i + 1])
+            for i in range(0, len(table) - 1, 2)]
+
+
+def parse_sections(course) -> Tuple[str, List[USFCourseDB]]:
+    """Detail page link and one row per meeting time of a section pair."""
+    links = course[0].find_all('a', href=True)
+    link = list(filter(lambda x: x['href'].startswith(
+        '/PROD/bwckschd.p_disp_detail_sched'), links))[0]
+    link = link['href']
+    course_title_block: bs4.element.Tag = course[0]
+    course_title_a: bs4.element.Tag = course_title_block.find('a')
+    course_title = ' '.join(
+        course_title_a.text.replace('\n', '').split())
+    course_info_block: bs4.element.Tag = course[1]
+
+    schedule_table = course_info_block.find(
+        'table', class_='datadisplaytable')
+    if schedule_table is None:
+        return link, []
+    times = schedule_table.find_all('tr')[1:]  # skip header
+    courses: List[USFCourseDB] = []
+    for time in times:
+        infos = list(map(lambda x: x.text, list(
+            time.find_all("td"))))
+        course = USFCourseDB(
+            course_type=infos[0],
+            time=infos[1],
+            days=infos[2],
+            classroom=infos[3],
+            date_range=infos[4],
+            schedule_type=infos[5],
+            instructor_name=infos[6],
+            title=course_title,
+            source_url=link
         )
-        soup = BeautifulSoup(response.text, 'html.parser')
-        global_table = soup.find('table', class_='datadisplaytable',
-                                 summary='This layout table is used to present the sections found')
-
-        table = list(filter(lambda x: x.name == 'tr', global_table.children))
-
-        paired_rows = [(table[i], table[i + 1])
-                       for i in range(0, len(table) - 1, 2)]
-        # print(paired_rows[0][0])
-
-        final_courses: List[BaseDB] = []
-        semaphore = asyncio.Semaphore(50)
-
-        async def process_course(course):
-            async with semaphore:
-                links = course[0].find_all('a', href=True)
-                link = list(filter(lambda x: x['href'].startswith(
-                    '/PROD/bwckschd.p_disp_detail_sched'), links))[0]
-                link = link['href']
-                course_title_block: bs4.element.Tag = course[0]
-                course_title_a: bs4.element.Tag = course_title_block.find('a')
-                course_title = ' '.join(
-                    course_title_a.text.replace('\n', '').split())
-                course_info_block: bs4.element.Tag = course[1]
-
-                schedule_table = course_info_block.find(
-                    'table', class_='datadisplaytable')
-                if schedule_table is None:
-                    return []
-                times = schedule_table.find_all('tr')[1:]  # skip header
-                courses: List[USFCourseDB] = []
-                for time in times:
-                    infos = list(map(lambda x: x.text, list(
-                        time.find_all("td"))))
-                    course = USFCourseDB(
-                        course_type=infos[0],
-                        time=infos[1],
-                        days=infos[2],
-                        classroom=infos[3],
-                        date_range=infos[4],
-                        schedule_type=infos[5],
-                        instructor_name=infos[6],
-                        title=course_title,
-                        source_url=link
-                    )
-                    courses.append(course)
-                course_detect = await load_class(f"https://ssb-prod.ec.usfca.edu{link}")
-                if course_detect is None:
-                    return []
-                data = course_detect.model_dump()
-                for course in courses:
-                    # assign values according to data
-                    for field in data.keys():
-                        if hasattr(course, field):
-                            setattr(course, field, data[field])
-                courses = await post_process(courses, [course.title for course in courses], [course.title for course in courses], showBar=False)
-                return courses
-        tasks = [process_course(course) for course in paired_rows]
-        results = []
-        for task in tqdm.tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Extracting courses"):
-            result = await task
-            results.append(result)
-        for result in results:
-            final_courses.extend(result)
-        return final_courses
+        courses.append(course)
+    return link, courses
+
+
+SECTIONS_SUMMARY = 'This layout table is used to present the sections found'
+DETAIL_LINK = '/PROD/bwckschd.p_disp_detail_sched'
+
+
+def sections_from_tree(html: str) -> List[USFCourseDB]:
+    """sections_from_html on lxml's tree."""
+    global_table = soup.make_tree(html).xpath(
+        f"//table[{soup.has_class('datadisplaytable')} and @summary='{SECTIONS_SUMMARY}']")[0]
+    pairs = global_table.xpath('./tr')
+    rows = []
+    for title_row, info_row in zip(pairs[0:len(pairs) - 1:2], pairs[1::2]):
+        link = [a.get('href') for a in title_row.xpath('.//a[@href]') if a.get('href').startswith(DETAIL_LINK)][0]
+        course_title = ' '.join(soup.text(title_row.xpath('.//a')[0]).replace('\n', '').split())
+        schedule_tables = info_row.xpath(f".//table[{soup.has_class('datadisplaytable')}]")
+        if not schedule_tables:
+            continue
+        for time in schedule_tables[0].xpath('.//tr')[1:]:
+            infos = [soup.text(td) for td in time.xpath('.//td')]
+            rows.append(USFCourseDB(
+                course_type=infos[0],
+                time=infos[1],
+                days=infos[2],
+                classroom=infos[3],
+                date_range=infos[4],
+                schedule_type=infos[5],
+                instructor_name=infos[6],
+                title=course_title,
+                source_url=link
+            ))
+    return rows
+
+
+def sections_from_html(html: str) -> List[USFCourseDB]:
+    if soup.native():
+        return sections_from_tree(html)
+    rows = []
+    for course in course_pairs(html):
+        rows.extend(parse_sections(course)[1])
+    return rows
+
+
+async def get_course_links() -> List[BaseDB]:
+    client = get_client("https://ssb-prod.ec.usfca.edu")
+    response = await client.post(
+        "https://ssb-prod.ec.usfca.edu/PROD/bwckschd.p_get_crse_unsec",
+        headers={
+            "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+            "accept-language": "zh-CN,zh;q=0.9",
+            "cache-control": "no-cache",
+            "content-type": "application/x-www-form-urlencoded",
+            "pragma": "no-cache",
+            "priority": "u=0, i",
+            "sec-ch-ua": "\"Google Chrome\";v=\"131\", \"Chromium\";v=\"131\", \"Not_A Brand\";v=\"24\"",
+            "sec-ch-ua-mobile": "?0",
+            "sec-ch-ua-platform": "\"macOS\"",
+            "sec-fetch-dest": "document",
+            "sec-fetch-mode": "navigate",
+            "sec-fetch-site": "same-origin",
+            "sec-fetch-user": "?1",
+            "upgrade-insecure-requests": "1"
+        },
+        timeout=20,
+        data="term_in=202520&sel_subj=dummy&sel_day=dummy&sel_schd=dummy&sel_insm=dummy&sel_camp=dummy&sel_levl=dummy&sel_sess=dummy&sel_instr=dummy&sel_ptrm=dummy&sel_attr=dummy&sel_subj=%25&sel_crse=&sel_title=%25&sel_insm=%25&sel_camp=%25&sel_levl=%25&sel_instr=%25&sel_attr=%25&begin_hh=0&begin_mi=0&begin_ap=a&end_hh=0&end_mi=0&end_ap=a&begin_ap=x&end_ap=y"
+    )
+    sections = await parse_service.parse('usf.sections', response.content, str(response.url),
+                                         encoding=response.encoding)
+    # every meeting row of a section carries its detail page link
+    by_link: Dict[str, List[USFCourseDB]] = {}
+    for row in sections:
+        by_link.setdefault(row.source_url, []).append(row)
+
+    final_courses: List[BaseDB] = []
+
+    # detail pages and the OpenAI API are paced per host by src.politeness
+    async def process_course(link, courses):
+        # the LLM extraction of a detail page is checkpointed, the sections are parsed again
+        course_detect = await checkpoint.unit(('url', link),
+                                              partial(load_class, f"https://ssb-prod.ec.usfca.edu{link}"))
+        if course_detect is None:
+            unit_failed(source_url=link)
+            return []
+        data = course_detect.model_dump()
+        for course in courses:
+            # assign values according to data
+            for field in data.keys():
+                if hasattr(course, field):
+                    setattr(course, field, data[field])
+        # embedded by process_school through Spider.embedding_text
+        return courses
+    tasks = [process_course(link, courses) for link, courses in by_link.items()]
+    results = []
+    for task in tqdm.tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Extracting courses"):
+        result = await task
+        results.append(result)
+    for result in results:
+        final_courses.extend(result)
+    return final_courses
+
+model = "gpt-4o-mini"
 
 prompt_template = ChatPromptTemplate.from_messages(
     [
@@ -169,17 +233,21 @@ prompt_template = ChatPromptTemplate.from_messages(
 async def load_class(link: str) -> CourseModel | None:
     retries = 3
     for attempt in range(retries):
+        if attempt:
+            metrics.inc('retries', 'llm_extract')
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(link, timeout=15)
-                soup = BeautifulSoup(response.text, 'html.parser')
-                llm = ChatOpenAI(
-                    model="gpt-4o-mini", max_retries=5, timeout=30, api_key=settings.openai_api_key)
-                structured_llm = llm.with_structured_output(schema=CourseModel)
-
-                prompt: List[Dict[str, Any]] = await prompt_template.ainvoke({"text": soup.get_text()})
-                data: CourseModel = await structured_llm.ainvoke(prompt)
-                return data
+            client = get_client(link)
+            response = await client.get(link, timeout=15)
+            soup = make_soup(response.text)
+            llm = ChatOpenAI(
+                model=model, max_retries=5, timeout=30, api_key=settings.openai_api_key,
+                http_async_client=get_client("https://api.openai.com"))
+            structured_llm = llm.with_structured_output(schema=CourseModel)
+
+            prompt: List[Dict[str, Any]] = await prompt_template.ainvoke({"text": soup.get_text()})
+            await acquire_prompt_tokens(model, prompt.to_string())
+            data: CourseModel = await structured_llm.ainvoke(prompt)
+            return data
         except Exception as e:
             print(f"""Error when fetching {link}, attempt {
                   attempt + 1} of {retries}: {e}""")
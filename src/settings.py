@@ -1,9 +1,138 @@
+import re
+from typing import Dict, List, Optional
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     openai_api_key: str
     dataset_url: str
+    embedding_model: str = 'text-embedding-3-large'
+    # embedding size and 2-byte halfvec storage for name_vector, both can be
+    # overridden per Spider; HNSW indexes take up to 2000 vector or 4000 halfvec dimensions,
+    # a larger vector is indexed as halfvec. Changing either for an existing table
+    # takes python -m src.schema --migrate
+    embedding_dimensions: Optional[int] = 3072
+    embedding_halfvec: bool = False
+    # declare search_vector as a generated column over each table's text columns
+    search_vector_generated: bool = False
+    search_config: str = 'english'
+    # 'copy' bulk loads with binary COPY, 'orm' uses session.add_all
+    load_mode: str = 'copy'
+    load_chunk_rows: int = 2000
+    load_chunk_rows_min: int = 200
+    load_chunk_rows_max: int = 50_000
+    load_target_seconds: float = 2.0
+    # reconcile with existing rows by natural key instead of appending a full copy
+    load_sync: bool = False
+    # share of the live rows one sync may soft-delete, a run losing more is taken for an outage
+    load_sync_max_deleted: float = 0.2
+    # load a full copy into an unlogged staging table and swap it in, overrides load_sync
+    load_staging: bool = False
+    # session settings for index builds after a load
+    index_maintenance_work_mem: str = '1GB'
+    index_parallel_workers: int = 4
+    # process_school pipeline: queue bound and workers per stage
+    pipeline_queue_size: int = 64
+    pipeline_concurrency: Dict[str, int] = {'fetch': 8, 'parse': 4, 'map': 1, 'embed': 8}
+    # rows per embed stage call
+    pipeline_embed_rows: int = 256
+    # run each spider in its own worker process, rows are embedded and loaded here
+    execute_isolated: bool = False
+    # per-school checkpoints of completed crawl units ('' disables), reused instead of redone when resuming
+    checkpoint_path: str = '.cache/checkpoints'
+    resume: bool = False
+    # Prometheus /metrics endpoint during a run (port 0, the default, disables it) and JSON run summaries ('' disables)
+    metrics_host: str = '127.0.0.1'
+    metrics_port: int = 0
+    metrics_path: str = '.cache/metrics'
+    # python -m src.runs: past runs a school's latest one is compared with, allowed slowdown
+    runs_window: int = 7
+    runs_tolerance: float = 0.5
+    # shared spider HTTP clients, limits are per host
+    http_timeout: float = 30.0
+    http_connect_timeout: float = 10.0
+    http_max_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http_dns_ttl: float = 300.0
+    # conditional-GET cache of catalog pages and what was parsed from them, '' disables
+    http_cache_path: str = '.cache/http.sqlite3'
+    # content-addressed archive of every fetched body with a manifest per run, '' disables
+    archive_path: str = '.cache/archive'
+    # hosts that are API calls rather than pages
+    archive_skip_hosts: List[str] = ['api.openai.com']
+    # query parameters left out of the archive key, e.g. cache busters
+    archive_ignore_params: List[str] = ['_']
+    # parser benchmark fixtures and baselines, allowed slowdown before failing
+    bench_path: str = 'bench'
+    bench_tolerance: float = 0.5
+    # HTML parser of the spiders, 'auto' prefers lxml when installed; with lxml the
+    # hot extractors read lxml's tree directly, the others build bs4 trees on it
+    html_backend: str = 'auto'
+    # worker processes parsing pages off the event loop, 0 parses inline
+    parse_workers: int = 4
+    # per-host politeness, auto-tuned within the bounds, http_hosts overrides
+    # any of rps, rps_min, rps_max, concurrency, concurrency_min/max, latency_target
+    http_rps: float = 5.0
+    http_rps_min: float = 0.2
+    http_rps_max: float = 50.0
+    http_concurrency: int = 4
+    http_concurrency_min: int = 1
+    http_concurrency_max: int = 20
+    http_latency_target: float = 5.0
+    http_hosts: Dict[str, Dict[str, float]] = {
+        'www.reg.uci.edu': {'rps': 1.0, 'rps_max': 5.0, 'concurrency': 2, 'concurrency_max': 4},
+        'registrar-apps.ucdavis.edu': {'concurrency': 1, 'concurrency_max': 4},
+        'sa.ucla.edu': {'concurrency': 15},
+        'ssb-prod.ec.usfca.edu': {'concurrency': 20},
+        'api.openai.com': {'rps': 20.0, 'rps_max': 200.0, 'concurrency': 16, 'concurrency_max': 64,
+                           'latency_target': 30.0},
+    }
+    # async engine pool shared by every spider
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 60
+    db_pool_recycle: int = 1800
+    db_statement_cache_size: int = 500
+    # max inputs / tokens packed into one embeddings request
+    embedding_batch_size: int = 512
+    embedding_batch_tokens: int = 100_000
+    # longest input the embedding model accepts, longer texts are embedded from their start
+    embedding_input_tokens: int = 8191
+    # on-disk embedding cache, an empty path disables it
+    embedding_cache_path: str = '.cache/embeddings.sqlite3'
+    embedding_cache_max_mb: int = 2048
+    # AIMD bounds for concurrent embeddings requests
+    embedding_concurrency: int = 8
+    embedding_concurrency_min: int = 1
+    embedding_concurrency_max: int = 64
+    embedding_latency_target: float = 10.0
+    # tokens-per-minute budget per OpenAI model, shared by every spider
+    openai_tpm: Dict[str, int] = {
+        'text-embedding-3-large': 1_000_000,
+        'gpt-4o': 800_000,
+        'gpt-4o-mini': 2_000_000,
+    }
+    openai_tpm_default: int = 200_000
+    # completion tokens reserved for a chat request before it is sent
+    openai_completion_tokens: int = 512
+    # chat requests in flight per UCR page extraction, alongside the token budget
+    openai_chat_concurrency: int = 15
+
+    @field_validator('search_config')
+    @classmethod
+    def check_search_config(cls, value: str) -> str:
+        # spliced into the generated column's DDL, prepare_table checks it exists in pg_ts_config
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?', value):
+            raise ValueError(f"not a text search configuration name: {value!r}")
+        return value
+
+    @field_validator('index_maintenance_work_mem')
+    @classmethod
+    def check_memory_size(cls, value: str) -> str:
+        if not re.fullmatch(r'\d+\s*(B|kB|MB|GB|TB)?', value):
+            raise ValueError(f"not a Postgres memory size such as '1GB': {value!r}")
+        return value
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,81 @@
+from bs4 import BeautifulSoup
+from src.settings import settings
+import importlib.util
+
+# tree builders the spiders are checked against, fastest first; lxml parses
+# in C, html.parser is pure Python and always there
+BACKENDS = ('lxml', 'html.parser')
+# bs4's .text leaves out the strings of these elements
+HIDDEN_TEXT = ('script', 'style')
+
+
+def available(name: str) -> bool:
+    return name == 'html.parser' or importlib.util.find_spec(name) is not None
+
+
+def pick(name: str) -> str:
+    if name == 'auto':
+        return next(backend for backend in BACKENDS if available(backend))
+    if name not in BACKENDS:
+        raise ValueError(f"unknown html_backend {name!r}, expected 'auto' or one of {BACKENDS}")
+    if not available(name):
+        raise ImportError(f"html_backend {name!r} is not installed")
+    return name
+
+
+backend = pick(settings.html_backend)
+
+
+def make_soup(markup) -> BeautifulSoup:
+    """Parse ``markup`` with the configured backend.
+
+    Every spider extractor builds its tree here rather than naming a parser,
+    so switching backends (or checking them against each other with
+    ``python -m src.bench parity``) needs no spider changes. The markup is
+    passed through untouched, html.parser rows (and their content_hash)
+    stay as they were; lxml reads CRLF and CR in text as LF, as browsers do.
+    """
+    return BeautifulSoup(markup, backend)
+
+
+def native() -> bool:
+    """Whether extractors ported to lxml.html use their XPath version.
+
+    Building bs4's tree of Python objects costs more than lxml's C parse
+    under it, so the hot extractors (UCI WebSoc, USF sections, UCLA
+    details) read lxml's own tree when lxml is the backend and keep their
+    bs4 version for html.parser. ``python -m src.bench parity`` checks the
+    two give the same rows.
+    """
+    return backend == 'lxml'
+
+
+def make_tree(markup: str):
+    """Parse ``markup`` into an lxml.html document.
+
+    The text is encoded again so a charset declaration in the page cannot
+    disagree with it, an empty page gives an empty document as with bs4.
+    """
+    from lxml import etree, html
+    try:
+        return html.document_fromstring(markup.encode('utf-8'), parser=html.HTMLParser(encoding='utf-8'))
+    except etree.ParserError:
+        return html.Element('html')
+
+
+_text_nodes = None
+
+
+def text(element) -> str:
+    """``element``'s text the way bs4's ``.text`` reads it, without script and style."""
+    global _text_nodes
+    if _text_nodes is None:
+        from lxml import etree
+        hidden = ' or '.join(f"ancestor::{name}" for name in HIDDEN_TEXT)
+        _text_nodes = etree.XPath(f".//text()[not({hidden})]", smart_strings=False)
+    return ''.join(_text_nodes(element))
+
+
+def has_class(name: str) -> str:
+    """XPath test for ``name`` among an element's classes, as bs4's ``class_=`` matches."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
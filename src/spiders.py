@@ -1,30 +1,68 @@
-from typing import Callable, Awaitable, List
+from typing import Any, Callable, Awaitable, Dict, Iterable, List, Optional
 from .schools import ucr, usf, uci, ucsd, ucsc, ucla, ucsf
 from .models import BaseDB, DeclarativeBase
 from . import models
+from .settings import settings
 
 
 class Spider:
-    def __init__(self, school_name: str, func: Callable[[], Awaitable[List[BaseDB]]], scheme: DeclarativeBase, school_id: int):
+    def __init__(self, school_name: str, func: Callable[[], Awaitable[List[BaseDB]]], scheme: DeclarativeBase, school_id: int,
+                 dimensions: Optional[int] = None, halfvec: Optional[bool] = None,
+                 embedding_text: Optional[Callable[[BaseDB], Optional[str]]] = None,
+                 full_text: Optional[Callable[[BaseDB], Optional[str]]] = None,
+                 units: Optional[Callable[[], Iterable[Any]]] = None,
+                 fetch: Optional[Callable[[Any], Awaitable[Any]]] = None,
+                 parse: Optional[Callable[[Any, Any], Awaitable[List[Any]]]] = None,
+                 to_row: Optional[Callable[[Any], BaseDB]] = None,
+                 concurrency: Optional[Dict[str, int]] = None, replayable: bool = True):
         self.school_name = school_name
         self.func = func
         self.scheme = scheme
         self.school_id = school_id
+        # when set, func returns rows without post_process and process_school
+        # embeds them in batches in its embed stage while uploading
+        self.embedding_text = embedding_text
+        self.full_text = full_text or embedding_text
+        # when set, process_school runs units -> fetch(unit) -> parse(unit, page)
+        # -> to_row(item) as pipeline stages instead of awaiting func
+        self.units = units
+        self.fetch = fetch
+        self.parse = parse
+        self.to_row = to_row
+        # workers per pipeline stage, over settings.pipeline_concurrency
+        self.concurrency = {**settings.pipeline_concurrency, **(concurrency or {})}
+        # False when pages are not fetched through the shared HTTP clients
+        # (UCSD's Selenium), so the archive cannot replay them
+        self.replayable = replayable
+        # name_vector size / halfvec storage, None keeps the global setting
+        if dimensions is not None or halfvec is not None:
+            models.configure_vector(scheme, dimensions, halfvec)
+
+    @property
+    def staged(self) -> bool:
+        return self.fetch is not None
 
 
 spiders: List[Spider] = [
     Spider(school_name='ucr', func=ucr.main,
-           scheme=models.UCRCourseDB, school_id=1076),
+           scheme=models.UCRCourseDB, school_id=1076,
+           embedding_text=lambda course: course.offering_title,
+           units=lambda: ucr.urls, fetch=ucr.fetch_url, parse=ucr.parse_page, to_row=ucr.from_pydantic,
+           concurrency={'parse': 5}),
     # Spider(school_name='usf', func=usf.main,
-    #        scheme=models.USFCourseDB, school_id=1600),
+    #        scheme=models.USFCourseDB, school_id=1600,
+    #        embedding_text=lambda course: course.title),
     # Spider(school_name='ucsc', func=ucsc.main,
-    #        scheme=models.UCSCCourseDB, school_id=1078),
+    #        scheme=models.UCSCCourseDB, school_id=1078,
+    #        embedding_text=lambda course: course.course_name),
     # Spider(school_name='ucsd', func=ucsd.main,
-    #        scheme=models.UCSDCourseDB, school_id=1079),
+    #        scheme=models.UCSDCourseDB, school_id=1079, replayable=False),
     # Spider(school_name='uci', func=uci.main,
     #        scheme=models.UCICourseDB, school_id=13221),
     # Spider(school_name='ucla', func=ucla.main,
     #        scheme=models.UCLACourseDB, school_id=1075),
     # Spider(school_name='ucsf', func=ucsf.main,
-    #        scheme=models.UCSFCourseDB, school_id=1080),
+    #        scheme=models.UCSFCourseDB, school_id=1080,
+    #        embedding_text=lambda course: course.course_name,
+    #        units=ucsf.units, fetch=ucsf.fetch_page, parse=ucsf.parse_courses),
 ]
@@ -0,0 +1,114 @@
+from typing import List, Tuple, Type
+from sqlalchemy import Connection, text
+from src.models import BaseDB
+from src.schema import build_indexes, index_name, raise_maintenance_limits
+import re
+
+
+def staging_name(scheme: Type[BaseDB]) -> str:
+    return f"{scheme.__tablename__}__staging"
+
+
+def previous_name(scheme: Type[BaseDB]) -> str:
+    return f"{scheme.__tablename__}__previous"
+
+
+def table_indexes(conn: Connection, table: str) -> List[Tuple[str, str, str | None]]:
+    """(name, definition, constraint type) of every index on ``table``."""
+    return [tuple(row) for row in conn.execute(text(
+        "SELECT i.relname, pg_get_indexdef(i.oid), c.contype FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid "
+        "LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid AND c.conrelid = x.indrelid "
+        "WHERE x.indrelid = to_regclass(:table)"), {'table': table})]
+
+
+def create_staging(conn: Connection, scheme: Type[BaseDB]):
+    """Create an empty unlogged copy of the live table without indexes."""
+    table, staging = scheme.__tablename__, staging_name(scheme)
+    conn.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+    conn.execute(text(
+        f"CREATE UNLOGGED TABLE {staging} (LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED)"))
+
+
+def finish_staging(conn: Connection, scheme: Type[BaseDB]):
+    """Build the live table's indexes on the loaded staging table and make it durable.
+
+    Indexes get a ``_stg`` suffix until the swap gives them the live names.
+    Declared indexes are built from their current spec instead of copied.
+    """
+    table, staging = scheme.__tablename__, staging_name(scheme)
+    raise_maintenance_limits(conn)
+    declared = {index_name(scheme, spec) for spec in scheme.__indexes__}
+    for name, definition, contype in table_indexes(conn, table):
+        if name in declared:
+            continue
+        definition = re.sub(r'^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+',
+                            rf'\1 {name}_stg ON {staging}', definition)
+        conn.execute(text(definition))
+        if contype == 'p':
+            conn.execute(text(
+                f"ALTER TABLE {staging} ADD CONSTRAINT {name}_stg PRIMARY KEY USING INDEX {name}_stg"))
+        elif contype == 'u':
+            conn.execute(text(
+                f"ALTER TABLE {staging} ADD CONSTRAINT {name}_stg UNIQUE USING INDEX {name}_stg"))
+    build_indexes(conn, scheme, staging, '_stg')
+    conn.execute(text(f"ALTER TABLE {staging} SET LOGGED"))
+    conn.execute(text(f"ANALYZE {staging}"))
+
+
+def rename_generation(conn: Connection, source: str, target: str, from_suffix: str, to_suffix: str):
+    for name, _, _ in table_indexes(conn, source):
+        base = name[:-len(from_suffix)] if from_suffix and name.endswith(from_suffix) else name
+        conn.execute(text(f"ALTER INDEX {name} RENAME TO {base}{to_suffix}"))
+    conn.execute(text(f"ALTER TABLE {source} RENAME TO {target}"))
+
+
+def swap_staging(conn: Connection, scheme: Type[BaseDB]):
+    """Swap the staging table in, keeping the replaced one as ``__previous``.
+
+    Runs in the caller's transaction, so readers see either generation
+    whole. Views and foreign keys follow the renamed old table.
+    """
+    table, staging, previous = scheme.__tablename__, staging_name(scheme), previous_name(scheme)
+    conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    # the id sequence is owned by the live table and would go with it
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                            {'table': table}).scalar()
+    conn.execute(text(f"DROP TABLE IF EXISTS {previous}"))
+    rename_generation(conn, table, previous, '', '_prev')
+    rename_generation(conn, staging, table, '_stg', '')
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+
+
+def rollback_swap(conn: Connection, scheme: Type[BaseDB]):
+    """Put the previous generation back live, the replaced one becomes ``__previous``."""
+    table, previous = scheme.__tablename__, previous_name(scheme)
+    swap = f"{table}__swap"
+    conn.execute(text(f"LOCK TABLE {table}, {previous} IN ACCESS EXCLUSIVE MODE"))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                            {'table': table}).scalar()
+    rename_generation(conn, table, swap, '', '_swp')
+    rename_generation(conn, previous, table, '_prev', '')
+    rename_generation(conn, swap, previous, '_swp', '_prev')
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+
+
+if __name__ == '__main__':
+    import sys
+    from src.spiders import spiders
+    import asyncio
+    from src.dataset import async_engine
+
+    async def rollback(scheme):
+        async with async_engine.begin() as conn:
+            await conn.run_sync(rollback_swap, scheme)
+        await async_engine.dispose()
+    # python -m src.staging rollback <school_name>
+    if len(sys.argv) == 3 and sys.argv[1] == 'rollback':
+        spider = next(spider for spider in spiders if spider.school_name == sys.argv[2])
+        asyncio.run(rollback(spider.scheme))
+        print(f"Rolled back {spider.scheme.__tablename__}")
+    else:
+        print("usage: python -m src.staging rollback <school_name>")
@@ -0,0 +1,169 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+from contextvars import ContextVar
+from sqlalchemy import Row, select, update
+from sqlalchemy.sql import func
+from src.models import BaseDB, data_columns, vector_dimensions, search_vector_generated
+from src.process import embedd_texts
+from src.dataset import AsyncSessionLocal
+from src.settings import settings
+import hashlib
+import json
+
+
+def content_hash(row: BaseDB, columns: List[str]) -> str:
+    values = [getattr(row, column) for column in columns]
+    return hashlib.sha256(json.dumps(values, default=str).encode('utf-8')).hexdigest()
+
+
+def text_hash(text: Optional[str]) -> Optional[str]:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest() if text is not None else None
+
+
+# units of the running spider that failed after their retries, each as the
+# column values its rows carry; set per spider by execute.spider_rows
+failed_units: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar('failed_units', default=None)
+
+
+def unit_failed(**columns: Any):
+    """Record that a unit returned nothing because fetching or extracting it failed.
+
+    The sync keeps the existing rows whose ``columns`` match, e.g. every
+    section of a ``source_url`` whose page timed out.
+    """
+    failed = failed_units.get()
+    if failed is not None:
+        failed.append(columns)
+
+
+def natural_key(scheme: Type[BaseDB]) -> Callable[[BaseDB], Optional[Tuple]]:
+    """Key function of a table, rows missing part of their key get None."""
+    columns = scheme.__natural_key__
+
+    def key(row: BaseDB) -> Optional[Tuple]:
+        values = tuple(getattr(row, column) for column in columns)
+        return None if not columns or None in values else values
+    return key
+
+
+async def sync_rows(scheme: Type[BaseDB], datas: List[BaseDB],
+                    embedding_text: Optional[Callable[[BaseDB], Optional[str]]] = None,
+                    full_text: Optional[Callable[[BaseDB], Optional[str]]] = None,
+                    failed: Sequence[Dict[str, Any]] = ()) -> List[BaseDB]:
+    """Reconcile scraped rows with the table by natural key.
+
+    Unchanged rows are left alone, changed rows are updated in place,
+    re-embedded only when their embedding text changed and given a new
+    search_vector only when their full text did, and rows that vanished
+    (or duplicate a key) are soft-deleted through ``deleted``. Rows missing
+    part of their key (UCR rows without a section) are matched by their
+    content hash instead, one old copy per new one. Rows of the ``failed``
+    units (see ``unit_failed``) did not vanish and are kept, and no row is
+    deleted when the run returned nothing or would delete more than
+    LOAD_SYNC_MAX_DELETED of the live rows, which takes an outage for a
+    catalog change. Only the key, hashes, id and failed-unit columns of
+    existing rows are read, and embeddings are requested before the write
+    transaction opens.
+    Returns the rows that are new and still need embedding and loading.
+    """
+    columns = data_columns(scheme)
+    key = natural_key(scheme)
+    incoming: Dict[Tuple, BaseDB] = {}
+    unkeyed: Dict[str, List[BaseDB]] = {}
+    new_rows: List[BaseDB] = []
+    for row in datas:
+        row.content_hash = content_hash(row, columns)
+        row.embedding_hash = text_hash(embedding_text(row)) if embedding_text is not None else None
+        row.full_text_hash = text_hash(full_text(row)) if full_text is not None else None
+        row_key = key(row)
+        if row_key is None:
+            unkeyed.setdefault(row.content_hash, []).append(row)
+        else:
+            # later duplicates within a run win
+            incoming[row_key] = row
+
+    stats = {'new': 0, 'changed': 0, 're-embedded': 0, 'deleted': 0, 'unchanged': 0, 'kept': 0}
+    table = scheme.__table__
+    unit_columns = sorted({column for columns in failed for column in columns} - set(scheme.__natural_key__))
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(
+            table.c.id, table.c.deleted, table.c.content_hash, table.c.embedding_hash, table.c.full_text_hash,
+            *(getattr(scheme, column) for column in (*scheme.__natural_key__, *unit_columns))))
+        existing_rows = result.all()
+    existing: Dict[Tuple, Row] = {}
+    existing_unkeyed: Dict[Optional[str], List[Row]] = {}
+    deleted: List[int] = []
+    for old in existing_rows:
+        old_key = key(old)
+        if old_key is None:
+            existing_unkeyed.setdefault(old.content_hash, []).append(old)
+            continue
+        if old_key in existing:
+            # rows from earlier full reloads carry duplicate keys
+            if not old.deleted:
+                deleted.append(old.id)
+            continue
+        existing[old_key] = old
+
+    changed: List[Tuple[Row, BaseDB]] = []
+
+    def match(old: Optional[Row], row: BaseDB):
+        if old is None:
+            new_rows.append(row)
+            stats['new'] += 1
+        elif not old.deleted and (old.content_hash, old.embedding_hash, old.full_text_hash) == \
+                (row.content_hash, row.embedding_hash, row.full_text_hash):
+            stats['unchanged'] += 1
+        else:
+            changed.append((old, row))
+    for row_key, row in incoming.items():
+        match(existing.pop(row_key, None), row)
+    for row_hash, rows in unkeyed.items():
+        # live copies are kept before soft-deleted ones
+        olds = sorted(existing_unkeyed.pop(row_hash, []), key=lambda old: old.deleted)
+        for i, row in enumerate(rows):
+            match(olds[i] if i < len(olds) else None, row)
+        existing_unkeyed[row_hash] = olds[len(rows):]
+
+    def of_failed_unit(old: Row) -> bool:
+        return any(all(getattr(old, column) == value for column, value in columns.items()) for columns in failed)
+    gone = [old for old in existing.values() if not old.deleted]
+    gone.extend(old for olds in existing_unkeyed.values() for old in olds if not old.deleted)
+    vanished = [old.id for old in gone if not of_failed_unit(old)]
+    stats['kept'] = len(gone) - len(vanished)
+    live = sum(1 for old in existing_rows if not old.deleted)
+    if vanished and (not datas or len(vanished) > settings.load_sync_max_deleted * live):
+        print(f"Sync {scheme.__tablename__}: not deleting {len(vanished)} of {live} rows, "
+              f"the run returned {len(datas)} rows")
+        stats['kept'] += len(vanished)
+        vanished = []
+    deleted.extend(vanished)
+
+    reembed = [(old, row) for old, row in changed
+               if embedding_text is not None and old.embedding_hash != row.embedding_hash]
+    embeddings = await embedd_texts([embedding_text(row) for _, row in reembed],
+                                    showBar=False, dimensions=vector_dimensions(scheme)) if reembed else []
+    vectors = {old.id: embedding for (old, _), embedding in zip(reembed, embeddings)}
+    generated = search_vector_generated(scheme)
+
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            for old, row in changed:
+                values = {column: getattr(row, column) for column in columns}
+                values.update(content_hash=row.content_hash, embedding_hash=row.embedding_hash,
+                              full_text_hash=row.full_text_hash, deleted=0, update_time=func.now())
+                if old.id in vectors:
+                    values['name_vector'] = vectors[old.id]
+                elif embedding_text is None and row.name_vector is not None:
+                    # the spider embedded the row itself
+                    values['name_vector'] = row.name_vector
+                    if row.search_vector is not None:
+                        values['search_vector'] = row.search_vector
+                if full_text is not None and not generated and old.full_text_hash != row.full_text_hash:
+                    values['search_vector'] = func.to_tsvector(full_text(row))
+                await session.execute(update(table).where(table.c.id == old.id).values(values))
+            for i in range(0, len(deleted), 1000):
+                await session.execute(update(table).where(table.c.id.in_(deleted[i:i + 1000]))
+                                      .values(deleted=1, update_time=func.now()))
+    stats.update({'changed': len(changed), 're-embedded': len(vectors), 'deleted': len(deleted)})
+    print(f"Sync {scheme.__tablename__}: {stats}")
+    return new_rows
@@ -0,0 +1,38 @@
+import asyncio
+import os
+
+import pytest
+
+# src.settings requires these, nothing here connects to either
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+os.environ.setdefault('DATASET_URL', 'postgresql://spider@localhost/spider')
+# no on-disk caches, archive or checkpoints in the working tree
+for name in ('HTTP_CACHE_PATH', 'ARCHIVE_PATH', 'EMBEDDING_CACHE_PATH', 'CHECKPOINT_PATH', 'METRICS_PATH'):
+    os.environ.setdefault(name, '')
+
+
+class FakeClock:
+    """time.monotonic and asyncio.sleep of the rate limiters, sleeping only moves the clock."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+        self.yield_ = asyncio.sleep
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+        await self.yield_(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    from src import politeness, ratelimit
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    monkeypatch.setattr(politeness, 'time', clock)
+    monkeypatch.setattr(ratelimit.asyncio, 'sleep', clock.sleep)
+    return clock
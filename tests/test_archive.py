@@ -0,0 +1,36 @@
+import asyncio
+import gzip
+import os
+
+import httpx
+
+from src import archive as archive_module
+from src.archive import Archive, ArchiveTransport
+
+
+def test_bodies_are_recorded_decoded_as_they_stream(monkeypatch, tmp_path):
+    archive = Archive(str(tmp_path))
+    monkeypatch.setattr(archive_module, 'archive', archive)
+    body = b'<html>' + b'x' * 100000 + b'</html>'
+
+    async def fetch():
+        def reply(request):
+            return httpx.Response(200, headers={'content-encoding': 'gzip', 'content-type': 'text/html'},
+                                  stream=httpx.ByteStream(gzip.compress(body)))
+        client = httpx.AsyncClient(transport=ArchiveTransport(httpx.MockTransport(reply)))
+        try:
+            async with client.stream('GET', 'https://catalog.ucsf.edu/anatomy') as response:
+                # nothing is read or recorded before the caller asks for the body
+                assert archive.recorded == 0
+                assert b''.join([chunk async for chunk in response.aiter_bytes()]) == body
+        finally:
+            await client.aclose()
+    asyncio.run(fetch())
+    assert archive.recorded == 1
+    archive.close()
+    archive.go_offline()
+    replayed = archive.replay(httpx.Request('GET', 'https://catalog.ucsf.edu/anatomy'))
+    assert replayed.content == body
+    assert 'content-encoding' not in replayed.headers
+    # no temporary blob is left behind
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith('.tmp')]
@@ -0,0 +1,94 @@
+import importlib
+import json
+
+import httpx
+import pytest
+from bs4 import BeautifulSoup
+
+from src import archive as archive_module
+from src import bench, soup
+from src.archive import Archive
+from src.parsers import row_values
+from src.settings import settings
+
+
+def test_committed_fixtures_match_their_baselines():
+    with open('bench/baselines.json') as f:
+        baselines = json.load(f)
+    assert baselines
+    for parser_id, baseline in baselines.items():
+        pages = bench.load_fixtures(parser_id)
+        assert len(pages) == baseline['pages']
+        assert sum(len(bench.parsers[parser_id].parse(body, url)) for body, url in pages) == baseline['rows']
+
+
+def test_baseline_without_fixtures_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'bench_path', str(tmp_path))
+    (tmp_path / 'baselines.json').write_text(json.dumps(
+        {'ucsc.course': {'pages': 2, 'rows': 2, 'rows_per_s': 1.0, 'ms_per_page': 1.0, 'peak_kib': 1.0}}))
+    assert bench.run(['ucsc.course'], save=False, repeat=1) == 1
+    # parsers without a baseline are still skipped
+    assert bench.run(['ucsf.courseblock'], save=False, repeat=1) == 0
+
+
+def test_only_calibrated_timings_are_compared():
+    baseline = {'pages': 1, 'rows': 4, 'ms_per_page': 0.5, 'relative_per_page': 0.1, 'peak_kib': 40.0}
+    # a slower machine: more ms per page, the same multiple of the calibration parse
+    slower = {**baseline, 'ms_per_page': 1.5, 'relative_per_page': 0.11}
+    assert bench.regressions('ucla.course_titles', slower, baseline) == []
+    regressed = {**baseline, 'relative_per_page': 0.2}
+    assert bench.regressions('ucla.course_titles', regressed, baseline) == [
+        f"ucla.course_titles: relative_per_page 0.2 > 0.1 * {1 + settings.bench_tolerance:.2f}"]
+
+
+@pytest.mark.parametrize('parser_id', list(bench.parsers))
+def test_backends_parse_fixtures_alike(parser_id, monkeypatch):
+    pytest.importorskip('lxml')
+    pages = bench.load_fixtures(parser_id)
+    assert pages, f"no fixtures for {parser_id}"
+    rows = {}
+    for backend in soup.BACKENDS:
+        monkeypatch.setattr(soup, 'backend', backend)
+        rows[backend] = [[bench.newlines(row_values(row)) for row in bench.parsers[parser_id].parse(body, url)]
+                         for body, url in pages]
+    assert rows['lxml'] == rows['html.parser']
+
+
+PORTED = {'uci.websoc': 'src.schools.uci.server', 'usf.sections': 'src.schools.usf.server',
+          'ucla.course_details': 'src.schools.ucla.server'}
+
+
+@pytest.mark.parametrize('parser_id', list(PORTED))
+def test_ported_extractors_skip_bs4_on_lxml(parser_id, monkeypatch):
+    pytest.importorskip('lxml')
+    module = importlib.import_module(PORTED[parser_id])
+
+    def no_bs4(markup):
+        raise AssertionError('built a bs4 tree')
+    monkeypatch.setattr(module, 'make_soup', no_bs4)
+    monkeypatch.setattr(soup, 'backend', 'lxml')
+    assert sum(len(bench.parsers[parser_id].parse(body, url)) for body, url in bench.load_fixtures(parser_id))
+
+
+def test_text_reads_like_bs4():
+    pytest.importorskip('lxml')
+    markup = '<div class=" a  row-b ">x<script>var s;</script><!--c-->y&nbsp;<style>p{}</style><b>z</b></div>'
+    tree = soup.make_tree(markup)
+    div = tree.xpath(f"//div[{soup.has_class('row-b')}]")[0]
+    assert soup.text(div) == BeautifulSoup(markup, 'html.parser').div.text
+    assert not tree.xpath(f"//div[{soup.has_class('row')}]")
+    assert soup.make_tree('').xpath('//table') == []
+
+
+def test_parity_on_an_archived_run(monkeypatch, tmp_path):
+    pytest.importorskip('lxml')
+    archive = Archive(str(tmp_path))
+    monkeypatch.setattr(archive_module, 'archive', archive)
+    for parser_id in PORTED:
+        for i, (body, url) in enumerate(bench.load_fixtures(parser_id)):
+            # one request per page, as the spiders post a form or pass a query per page
+            archive.record(httpx.Request('POST', url, content=str(i).encode()), 200, httpx.Headers(), body)
+    archive.close()
+    assert bench.parity(list(PORTED), archived=True) == 0
+    # a run without pages of the parser compares nothing
+    assert bench.parity(['ucsd.page'], archived=True) == 1
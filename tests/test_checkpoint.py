@@ -0,0 +1,116 @@
+from functools import partial
+from types import SimpleNamespace
+from src import checkpoint, execute
+from src.models import UCLACourseDB
+from src.settings import settings
+from src.spiders import Spider
+import asyncio
+import pytest
+
+
+def use_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'checkpoint_path', str(tmp_path))
+
+
+def test_resumed_units_are_not_redone(monkeypatch, tmp_path):
+    use_directory(monkeypatch, tmp_path)
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        return value
+
+    async def run(resume):
+        points = checkpoint.open_checkpoint('ucd', resume, first_id=100)
+        checkpoint.current.set(points)
+        try:
+            return [await checkpoint.unit(('crn', crn), partial(work, value))
+                    for crn, value in [('1', ['a']), ('2', []), ('3', ['c'])]]
+        finally:
+            points.close()
+
+    assert asyncio.run(run(False)) == [['a'], [], ['c']]
+    assert asyncio.run(run(True)) == [['a'], [], ['c']]
+    # the empty unit is not recorded and runs again
+    assert calls == [['a'], [], ['c'], []]
+
+
+def test_first_id_is_kept_from_the_interrupted_run(monkeypatch, tmp_path):
+    use_directory(monkeypatch, tmp_path)
+    checkpoint.open_checkpoint('ucr', False, first_id=100).close()
+    checkpoint.open_checkpoint('ucr', True, first_id=200).close()
+    assert checkpoint.first_id('ucr') == 100
+    checkpoint.open_checkpoint('ucr', False, first_id=300).close()
+    assert checkpoint.first_id('ucr') == 300
+    checkpoint.remove('ucr')
+    assert checkpoint.first_id('ucr') is None
+
+
+class FakeTable:
+    """Stands in for the school table, the loader and the engine process_school uses."""
+
+    def __init__(self):
+        self.rows = []
+        self.fail_indexes = False
+
+    def begin(self):
+        table = self
+
+        class Connection:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                pass
+
+            async def run_sync(self, fn, scheme):
+                if fn is execute.build_indexes and table.fail_indexes:
+                    raise RuntimeError('interrupted')
+
+            async def execute(self, statement):
+                first_id, = statement.compile().params.values()
+                before = len(table.rows)
+                table.rows = [row for row in table.rows if row.id < first_id]
+                return SimpleNamespace(rowcount=before - len(table.rows))
+        return Connection()
+
+    def loader(self, scheme, table_name=None):
+        table = self
+
+        class Loader:
+            count = 0
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                pass
+
+            async def add(self, rows):
+                table.rows.extend(rows)
+        return Loader()
+
+
+def test_resumed_spider_without_embeddings_loads_each_row_once(monkeypatch, tmp_path):
+    use_directory(monkeypatch, tmp_path)
+    table = FakeTable()
+    monkeypatch.setattr(execute, 'async_engine', table)
+    monkeypatch.setattr(execute, 'Loader', table.loader)
+
+    async def department(name):
+        return [UCLACourseDB(subject_area_code=name, section=str(i)) for i in range(2)]
+
+    async def crawl():
+        # as UCLA's main does, per department through the checkpoint
+        return [row for name in ('COM SCI', 'MATH', 'PHYSICS')
+                for row in await checkpoint.unit(('department', name), partial(department, name))]
+    spider = Spider(school_name='ucla', func=crawl, scheme=UCLACourseDB, school_id=1075)
+
+    # loaded, then interrupted before the checkpoint is removed
+    table.fail_indexes = True
+    with pytest.raises(RuntimeError):
+        asyncio.run(execute.process_school(spider, resume=False))
+    assert len(table.rows) == 6
+    table.fail_indexes = False
+    asyncio.run(execute.process_school(spider, resume=True))
+    assert len(table.rows) == 6
@@ -0,0 +1,24 @@
+from src.http_cache import HttpCache, Page
+from src.models import UCSFCourseDB
+
+
+def make_page(body=b'<html>catalog</html>'):
+    return Page('https://catalog.ucsf.edu/course-catalog/anatomy', 'key', 200, body, 'utf-8', True)
+
+
+def test_parsed_rows_come_back_as_fresh_rows(tmp_path):
+    cache = HttpCache(str(tmp_path / 'http.sqlite3'))
+    page = make_page()
+    cache.save_parsed(page, 'v1', [UCSFCourseDB(course_name='Anatomy 100', units='3')])
+    rows = cache.load_parsed(page, 'v1')
+    assert [(row.course_name, row.units) for row in rows] == [('Anatomy 100', '3')]
+    # plain values are stored, not the instance and its SQLAlchemy state
+    assert rows[0].id is None
+
+
+def test_parser_change_or_new_body_misses(tmp_path):
+    cache = HttpCache(str(tmp_path / 'http.sqlite3'))
+    cache.save_parsed(make_page(), 'v1', [{'ClassNumber': '001'}])
+    assert cache.load_parsed(make_page(), 'v1') == [{'ClassNumber': '001'}]
+    assert cache.load_parsed(make_page(), 'v2') is None
+    assert cache.load_parsed(make_page(b'<html>changed</html>'), 'v1') is None
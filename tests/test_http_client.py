@@ -0,0 +1,76 @@
+import asyncio
+import gzip
+import socket
+
+import httpx
+
+from src import http_client
+
+
+def test_pooled_connections_resolve_through_the_cache(monkeypatch):
+    lookups = []
+
+    async def serve():
+        async def reply(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok')
+            await writer.drain()
+            writer.close()
+        server = await asyncio.start_server(reply, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        loop = asyncio.get_running_loop()
+
+        async def getaddrinfo(host, port, **kwargs):
+            lookups.append(host)
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port))]
+        monkeypatch.setattr(loop, 'getaddrinfo', getaddrinfo)
+        client = http_client.make_client()
+        try:
+            # each response closes its connection, so both requests connect
+            for _ in range(2):
+                response = await client.get(f'http://catalog.example.test:{port}/')
+                assert response.text == 'ok'
+        finally:
+            await client.aclose()
+            server.close()
+    asyncio.run(serve())
+    assert lookups == ['catalog.example.test']
+
+
+def test_bodies_are_counted_as_they_stream(monkeypatch):
+    counted = []
+    monkeypatch.setattr(http_client.metrics.registry, 'inc',
+                        lambda name, stage, value=1, school_name=None: counted.append((name, stage, value)))
+
+    async def serve():
+        async def reply(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 100000\r\nConnection: close\r\n\r\n')
+            writer.write(b'x' * 100000)
+            await writer.drain()
+            writer.close()
+        server = await asyncio.start_server(reply, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        client = http_client.make_client()
+        try:
+            async with client.stream('GET', f'http://127.0.0.1:{port}/') as response:
+                # nothing is read before the caller asks for the body
+                assert ('bytes', 'fetch', 100000) not in counted
+                size = sum([len(chunk) async for chunk in response.aiter_bytes()])
+        finally:
+            await client.aclose()
+            server.close()
+        return size
+    assert asyncio.run(serve()) == 100000
+    assert ('bytes', 'fetch', 100000) in counted
+
+
+def test_openai_usage_is_read_from_the_decoded_body(monkeypatch):
+    counted = []
+    monkeypatch.setattr(http_client.metrics.registry, 'inc',
+                        lambda name, stage, value=1, school_name=None: counted.append((name, stage, value)))
+    raw = gzip.compress(b'{"usage": {"total_tokens": 42}}')
+    response = httpx.Response(200, headers={'content-encoding': 'gzip'}, stream=httpx.ByteStream(raw))
+    response.stream = http_client.CountingStream(response.stream, response, 'llm_extract')
+    assert asyncio.run(response.aread()) == b'{"usage": {"total_tokens": 42}}'
+    assert counted == [('bytes', 'llm_extract', len(raw)), ('tokens', 'llm_extract', 42)]
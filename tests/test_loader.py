@@ -0,0 +1,74 @@
+from contextlib import nullcontext
+from datetime import datetime
+from sqlalchemy import func
+from src.loader import Loader
+from src.models import UCRCourseDB
+import asyncio
+
+
+def connected_loader():
+    loader = Loader(UCRCourseDB, mode='copy')
+    loader.conn = RecordingConnection()
+    # as Loader.connect sets it
+    loader.now = datetime(2025, 1, 1)
+    return loader
+
+
+class RecordingConnection:
+    """Stands in for the loader's asyncpg connection."""
+
+    def __init__(self):
+        self.copies = []
+        self.statements = []
+
+    async def copy_records_to_table(self, table_name, records, columns):
+        self.copies.append((table_name, columns, records))
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+
+    def transaction(self):
+        return nullcontext()
+
+
+def post_processed(count):
+    # what post_process leaves on rows when search_vector is not generated
+    rows = []
+    for i in range(count):
+        row = UCRCourseDB(id=i + 1, section=f"00{i}", offering_title=f"Course {i}", name_vector=[0.1, 0.2])
+        row.search_vector = func.to_tsvector(row.offering_title)
+        rows.append(row)
+    return rows
+
+
+def test_post_processed_chunk_is_copied():
+    loader = connected_loader()
+    assert asyncio.run(loader.copy(post_processed(3)))
+    (table_name, columns, records), = loader.conn.copies
+    assert table_name == f"{UCRCourseDB.__tablename__}__copy"
+    assert 'search_vector' in columns
+    texts = [record[columns.index('search_vector')] for record in records]
+    assert texts == ['Course 0', 'Course 1', 'Course 2']
+    insert = loader.conn.statements[-1]
+    assert insert.startswith(f'INSERT INTO "{UCRCourseDB.__tablename__}"')
+    assert 'to_tsvector("search_vector")' in insert
+
+
+def test_plain_chunk_is_copied_into_the_table():
+    loader = connected_loader()
+    rows = post_processed(2)
+    for row in rows:
+        row.search_vector = None
+    assert asyncio.run(loader.copy(rows))
+    (table_name, columns, _), = loader.conn.copies
+    assert table_name == UCRCourseDB.__tablename__
+    assert 'search_vector' not in columns
+    assert loader.conn.statements == []
+
+
+def test_other_expressions_use_the_orm():
+    loader = connected_loader()
+    rows = post_processed(1)
+    rows[0].deleted = func.abs(0)
+    assert not asyncio.run(loader.copy(rows))
+    assert loader.conn.copies == []
@@ -0,0 +1,62 @@
+import json
+import os
+
+import pytest
+
+from src import metrics
+from src.metrics import Registry
+
+
+def filled(school_name='ucr'):
+    registry = Registry()
+    registry.inc('requests', 'fetch', 2, school_name)
+    registry.inc('bytes', 'fetch', 1500, school_name)
+    for seconds in (0.02, 3.0):
+        registry.observe('request_seconds', 'fetch', seconds, school_name)
+    return registry
+
+
+def test_render_is_prometheus_text():
+    lines = filled().render().splitlines()
+    assert '# TYPE spider_requests_total counter' in lines
+    assert 'spider_requests_total{school="ucr",stage="fetch"} 2' in lines
+    assert 'spider_bytes_total{school="ucr",stage="fetch"} 1500' in lines
+    assert '# TYPE spider_request_seconds histogram' in lines
+    buckets = [line for line in lines if line.startswith('spider_request_seconds_bucket')]
+    # cumulative, one line per bound and +Inf
+    assert len(buckets) == len(metrics.BUCKETS) + 1
+    assert 'spider_request_seconds_bucket{school="ucr",stage="fetch",le="0.01"} 0' in buckets
+    assert 'spider_request_seconds_bucket{school="ucr",stage="fetch",le="0.025"} 1' in buckets
+    assert 'spider_request_seconds_bucket{school="ucr",stage="fetch",le="2.5"} 1' in buckets
+    assert buckets[-1] == 'spider_request_seconds_bucket{school="ucr",stage="fetch",le="+Inf"} 2'
+    assert 'spider_request_seconds_sum{school="ucr",stage="fetch"} 3.020000' in lines
+    assert 'spider_request_seconds_count{school="ucr",stage="fetch"} 2' in lines
+    # every metric is declared even before it is recorded
+    assert '# TYPE spider_stage_seconds histogram' in lines
+
+
+def test_merge_adds_a_worker_snapshot():
+    parent = filled()
+    parent.inc('rows', 'parse', 10, 'uci')
+    # snapshots cross the process boundary as plain data
+    parent.merge(json.loads(json.dumps(filled().snapshot())))
+    parent.merge(filled('usf').snapshot())
+    assert parent.counters[('requests', 'ucr', 'fetch')] == 4
+    assert parent.counters[('requests', 'usf', 'fetch')] == 2
+    assert parent.counters[('rows', 'uci', 'parse')] == 10
+    histogram = parent.histograms[('request_seconds', 'ucr', 'fetch')]
+    assert (histogram.count, histogram.sum, histogram.max) == (4, pytest.approx(6.04), 3.0)
+    assert sum(histogram.counts) == 4
+
+
+def test_summary_is_written_per_school_and_stage(monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics, 'registry', filled())
+    path = metrics.write_summary(str(tmp_path / 'metrics'), 'run-1', seconds=12.5)
+    assert path == str(tmp_path / 'metrics' / 'run-1.json')
+    assert os.listdir(tmp_path / 'metrics') == ['run-1.json']
+    with open(path) as f:
+        summary = json.load(f)
+    assert summary['run_id'] == 'run-1' and summary['seconds'] == 12.5
+    fetch = summary['schools']['ucr']['fetch']
+    assert fetch['requests'] == 2 and fetch['bytes'] == 1500
+    assert fetch['request_seconds'] == {'count': 2, 'sum': 3.02, 'max': 3.0, 'p50': 0.025, 'p95': 3.0}
@@ -0,0 +1,51 @@
+import asyncio
+import pickle
+
+from bs4 import NavigableString
+
+from src import bench, parse_service
+from src.models import UCICourseDB
+from src.parse_service import compact, expand
+from src.settings import settings
+
+
+def parse_fixtures(parser_id):
+    async def run():
+        try:
+            return [await parse_service.parse(parser_id, body, url) for body, url in bench.load_fixtures(parser_id)]
+        finally:
+            parse_service.close_pool()
+    return asyncio.run(run())
+
+
+def test_rows_survive_the_round_trip():
+    rows = bench.parsers['uci.websoc'].parse(*bench.load_fixtures('uci.websoc')[0])
+    assert rows
+    kind, values = pickle.loads(pickle.dumps(compact(rows)))
+    assert kind is type(rows[0])
+    assert compact(expand(kind, values)) == compact(rows)
+
+
+def test_compact_drops_soup_and_keeps_defaults():
+    row = UCICourseDB(section=NavigableString('A1'))
+    kind, values = compact([row])
+    assert type(dict(zip(parse_service.row_columns(kind), values[0]))['section']) is str
+    # an unset column stays unset instead of becoming an explicit None
+    restored = expand(kind, values)[0]
+    assert restored.section == 'A1'
+    assert set(vars(restored)) & set(parse_service.row_columns(kind)) == {'section'}
+
+
+def test_mixed_rows_pass_as_is():
+    rows = [UCICourseDB(section='A1'), {'section': 'B1'}]
+    assert compact(rows) == (None, rows)
+    assert expand(None, rows) is rows
+
+
+def test_pool_parses_like_inline(monkeypatch):
+    monkeypatch.setattr(settings, 'parse_workers', 0)
+    inline = parse_fixtures('uci.websoc')
+    monkeypatch.setattr(settings, 'parse_workers', 1)
+    pooled = parse_fixtures('uci.websoc')
+    assert sum(map(len, inline)) > 0
+    assert [compact(rows) for rows in pooled] == [compact(rows) for rows in inline]
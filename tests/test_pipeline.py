@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from src.pipeline import Pipeline, Stage
+
+
+def run(coroutine, timeout=5):
+    # a pipeline that never drains fails the test instead of hanging it
+    return asyncio.run(asyncio.wait_for(coroutine, timeout))
+
+
+def collect(seen):
+    async def func(item):
+        seen.append(item)
+        return [item]
+    return func
+
+
+def test_slow_consumer_holds_the_producer_back():
+    produced = []
+    gate = asyncio.Event()
+
+    async def scenario():
+        async def source():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        async def slow(item):
+            await gate.wait()
+            return None
+        running = asyncio.ensure_future(Pipeline([Stage('load', slow)], maxsize=4).run(source()))
+        for _ in range(20):
+            await asyncio.sleep(0)
+        # one item in the worker, four in the queue and one waiting in feed
+        assert len(produced) == 4 + 2
+        gate.set()
+        await running
+    run(scenario())
+    assert len(produced) == 100
+
+
+def test_end_reaches_every_worker():
+    seen, loaded = [], []
+
+    async def parse(item):
+        await asyncio.sleep(0.01)
+        seen.append(item)
+        return [item]
+    # the run only returns once all three parse workers saw END and the
+    # batch stage flushed its partial batch after the last of them
+    pipeline = Pipeline([Stage('parse', parse, concurrency=3),
+                         Stage('load', collect(loaded), batch=4)], maxsize=2)
+    run(pipeline.run(range(10)))
+    assert sorted(seen) == list(range(10))
+    assert sorted(item for batch in loaded for item in batch) == list(range(10))
+    assert pipeline.stats()['load']['in'] == 10
+
+
+def test_items_are_batched():
+    batches = []
+
+    async def load(batch):
+        batches.append(list(batch))
+        return None
+    run(Pipeline([Stage('load', load, batch=3)]).run(range(7)))
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_a_failing_stage_cancels_the_others():
+    cancelled = []
+
+    async def source():
+        i = 0
+        while True:
+            yield i
+            i += 1
+
+    async def parse(item):
+        if item == 3:
+            raise RuntimeError('bad page')
+        return [item]
+
+    async def load(item):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+    with pytest.raises(RuntimeError, match='bad page'):
+        run(Pipeline([Stage('parse', parse), Stage('load', load, concurrency=2)], maxsize=2).run(source()))
+    # both load workers were stuck on an item and got cancelled
+    assert sorted(cancelled) == [0, 1]
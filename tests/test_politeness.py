@@ -0,0 +1,66 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src import politeness
+from src.http_client import PoliteTransport
+from src.politeness import HostScheduler
+
+HOST = 'catalog.example.test'
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = HostScheduler(HOST, rps=4, rps_min=0.5, rps_max=16, concurrency=4,
+                              concurrency_min=1, concurrency_max=16, latency_target=10)
+    monkeypatch.setitem(politeness.schedulers, HOST, scheduler)
+    return scheduler
+
+
+def client(clock, replies):
+    """A client whose requests get the next of ``replies``: a status, a timeout, or (status, latency)."""
+    async def handle(request):
+        reply = replies.pop(0)
+        if reply == 'timeout':
+            raise httpx.ReadTimeout('timed out', request=request)
+        status, latency = reply if isinstance(reply, tuple) else (reply, 1)
+        clock.now += latency
+        return httpx.Response(status, request=request)
+    return httpx.AsyncClient(transport=PoliteTransport(httpx.MockTransport(handle)))
+
+
+def test_overloads_halve_rps_once_per_window(clock, scheduler):
+    async def scenario():
+        async with client(clock, [429, 503, 502, 'timeout', 504]) as http:
+            # two overloads within one window are one cut
+            for _ in range(2):
+                assert (await http.get(f'http://{HOST}/')).status_code in (429, 503)
+            assert scheduler.rps == 2
+            clock.now += 10
+            await http.get(f'http://{HOST}/')
+            assert scheduler.rps == 1
+            clock.now += 10
+            with pytest.raises(httpx.ReadTimeout):
+                await http.get(f'http://{HOST}/')
+            assert scheduler.rps == 0.5
+            clock.now += 10
+            await http.get(f'http://{HOST}/')
+            assert scheduler.rps == 0.5
+    asyncio.run(scenario())
+    assert scheduler.overloads == 5
+
+
+def test_responses_grow_rps_by_its_inverse(clock, scheduler):
+    async def scenario():
+        async with client(clock, [200, 404, (200, 11)]) as http:
+            await http.get(f'http://{HOST}/')
+            assert scheduler.rps == 4.25
+            # an error that is not an overload still counts as a response
+            await http.get(f'http://{HOST}/')
+            assert scheduler.rps == pytest.approx(4.25 + 1 / 4.25)
+            # a response slower than the target halves it
+            await http.get(f'http://{HOST}/')
+            assert scheduler.rps == pytest.approx((4.25 + 1 / 4.25) / 2)
+    asyncio.run(scenario())
+    assert scheduler.overloads == 0
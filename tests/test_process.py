@@ -0,0 +1,98 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIConnectionError, BadRequestError
+
+from src import process, ratelimit
+from src.models import UCRCourseDB
+
+
+def fake_create(errors, calls):
+    async def create(**kwargs):
+        calls.append(kwargs)
+        raise errors[min(len(calls), len(errors)) - 1]
+    return create
+
+
+@pytest.fixture
+def no_waiting(monkeypatch):
+    async def acquire_tokens(model, tokens):
+        pass
+
+    async def sleep(delay):
+        pass
+    monkeypatch.setattr(process, 'acquire_tokens', acquire_tokens)
+    monkeypatch.setattr(process.asyncio, 'sleep', sleep)
+
+
+def bad_request():
+    request = httpx.Request('POST', 'https://api.openai.com/v1/embeddings')
+    return BadRequestError('too long', response=httpx.Response(400, request=request), body=None)
+
+
+def test_bad_input_is_left_unembedded(monkeypatch, no_waiting):
+    calls = []
+    monkeypatch.setattr(process.client.embeddings, 'create', fake_create([bad_request()], calls))
+    assert asyncio.run(process.embedd_batch(['text'], 1)) == [None]
+    # not retried
+    assert len(calls) == 1
+
+
+def test_bad_input_does_not_fail_its_batch(monkeypatch, no_waiting):
+    async def create(input, **kwargs):
+        if 'bad' in input:
+            raise bad_request()
+        return SimpleNamespace(usage=None, data=[SimpleNamespace(index=i, embedding=[float(len(text))])
+                                                 for i, text in enumerate(input)])
+    monkeypatch.setattr(process.client.embeddings, 'create', create)
+    monkeypatch.setattr(process, 'count_tokens', lambda model, text: 1)
+    assert asyncio.run(process.embedd_batch(['a', 'bad', 'ccc'], 3)) == [[1.0], None, [3.0]]
+
+
+def test_long_inputs_are_truncated(monkeypatch):
+    # one token per character
+    monkeypatch.setattr(ratelimit, 'get_encoding', lambda model: SimpleNamespace(encode=list, decode=''.join))
+    assert ratelimit.truncate_tokens('text-embedding-3-large', 'abcdef', 4) == 'abcd'
+    assert ratelimit.truncate_tokens('text-embedding-3-large', 'abc', 4) == 'abc'
+
+
+def test_connection_errors_are_retried(monkeypatch, no_waiting):
+    request = httpx.Request('POST', 'https://api.openai.com/v1/embeddings')
+    calls = []
+    monkeypatch.setattr(process.client.embeddings, 'create',
+                        fake_create([APIConnectionError(request=request)], calls))
+    assert asyncio.run(process.embedd_batch(['text'], 1, max_retries=3)) == [None]
+    assert len(calls) == 3
+
+
+def test_concurrent_batches_embed_a_shared_text_once(monkeypatch):
+    async def acquire_tokens(model, tokens):
+        pass
+    inputs = []
+
+    async def create(input, **kwargs):
+        inputs.extend(input)
+        # both batches are in flight before either request returns
+        for _ in range(3):
+            await asyncio.sleep(0)
+        return SimpleNamespace(usage=None, data=[SimpleNamespace(index=i, embedding=[float(len(text))])
+                                                 for i, text in enumerate(input)])
+    monkeypatch.setattr(process, 'acquire_tokens', acquire_tokens)
+    monkeypatch.setattr(process, 'count_tokens', lambda model, text: 1)
+    monkeypatch.setattr(process, 'cache', None)
+    monkeypatch.setattr(process.client.embeddings, 'create', create)
+
+    async def embed_run():
+        shared = {}
+        batches = [[UCRCourseDB(offering_title='Intro to Programming'), UCRCourseDB(offering_title='Calculus I')],
+                   [UCRCourseDB(offering_title='Intro to Programming'), UCRCourseDB(offering_title='Ethics')]]
+        await asyncio.gather(*(process.post_process(rows, [row.offering_title for row in rows],
+                                                    [row.offering_title for row in rows], showBar=False, shared=shared)
+                               for rows in batches))
+        return batches
+    first, second = asyncio.run(embed_run())
+    assert sorted(inputs) == ['Calculus I', 'Ethics', 'Intro to Programming']
+    assert first[0].name_vector == [20.0]
+    assert first[0].name_vector is second[0].name_vector
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from src.ratelimit import AdaptiveLimiter, Overloaded, TokenBucket
+
+
+def limiter(initial=8):
+    return AdaptiveLimiter(initial, minimum=1, maximum=64, latency_target=10)
+
+
+async def overload(limiter, retry_after=None):
+    with pytest.raises(Overloaded):
+        async with limiter.slot():
+            raise Overloaded(RuntimeError('429'), retry_after)
+
+
+async def succeed(limiter, clock, latency=1.0):
+    async with limiter.slot():
+        clock.now += latency
+
+
+def test_limit_is_cut_once_per_latency_window(clock):
+    async def scenario():
+        aimd = limiter()
+        # requests in flight together fail together, that is one overload
+        for offset in (0, 1, 9):
+            clock.now = 1000 + offset
+            await overload(aimd)
+        assert aimd.limit == 4
+        clock.now = 1010
+        await overload(aimd)
+        assert aimd.limit == 2
+        # a request slower than the target counts as an overload
+        clock.now = 1020
+        await succeed(aimd, clock, latency=11)
+        assert aimd.limit == 1
+        assert aimd.errors == 4
+    asyncio.run(scenario())
+
+
+def test_retry_after_blocks_new_requests(clock):
+    async def scenario():
+        aimd = limiter()
+        await overload(aimd, retry_after=30)
+        assert aimd.blocked_until == 1030
+        clock.now = 1010
+        async with aimd.slot():
+            assert clock.now == 1030
+        assert clock.sleeps == [20]
+        # once it expired nothing waits
+        await succeed(aimd, clock)
+        assert clock.sleeps == [20]
+    asyncio.run(scenario())
+
+
+def test_limit_grows_by_one_per_window_of_successes(clock):
+    async def scenario():
+        aimd = limiter(initial=4)
+        for _ in range(4):
+            await succeed(aimd, clock)
+        assert 4.9 < aimd.limit < 5
+        aimd.limit = 63.99
+        await succeed(aimd, clock)
+        assert aimd.limit == 64
+    asyncio.run(scenario())
+
+
+def test_bucket_serves_waiters_in_arrival_order(clock):
+    served = []
+
+    async def take(name, tokens):
+        await bucket.acquire(tokens)
+        served.append((name, clock.now))
+
+    async def scenario():
+        await bucket.acquire(60)
+        # the small requests would fit sooner, they still wait behind the large one
+        await asyncio.gather(take('large', 30), take('small', 1), take('tiny', 1))
+    bucket = TokenBucket(60)
+    asyncio.run(scenario())
+    assert served == [('large', 1030), ('small', 1031), ('tiny', 1032)]
+    assert bucket.consumed == 92
+
+
+def test_bucket_refills_up_to_its_capacity(clock):
+    async def scenario():
+        await bucket.acquire(60)
+        clock.now += 30
+        await bucket.acquire(30)
+        assert clock.sleeps == []
+        clock.now += 3600
+        # a request over the capacity takes the whole bucket instead of waiting forever
+        await bucket.acquire(1000)
+        assert clock.sleeps == []
+        await bucket.acquire(15)
+        assert clock.sleeps == [15]
+    bucket = TokenBucket(60)
+    asyncio.run(scenario())
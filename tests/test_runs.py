@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+from src import execute, metrics, runs
+import asyncio
+
+
+def test_each_run_records_only_its_own_counts(monkeypatch):
+    recorded = []
+
+    async def process_school(spider, resume=False):
+        metrics.school.set(spider.school_name)
+        metrics.inc('rows', 'load', 3)
+        metrics.inc('bytes', 'fetch', 100)
+        return 1.0
+
+    async def record(run):
+        recorded.append(run)
+
+    async def dispose():
+        pass
+    spider = SimpleNamespace(school_name='ucsf')
+    monkeypatch.setattr(execute, 'spiders', [spider])
+    monkeypatch.setattr(execute, 'process_school', process_school)
+    monkeypatch.setattr(execute, 'async_engine', SimpleNamespace(dispose=dispose))
+    monkeypatch.setattr(runs, 'record', record)
+    # as main.py does every night, in the same process
+    for _ in range(2):
+        asyncio.run(execute.execute(isolated=False, resume=False))
+    assert [(run.rows_inserted, run.bytes_downloaded) for run in recorded] == [(3, 100), (3, 100)]
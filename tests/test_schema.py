@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+from pgvector.sqlalchemy import HALFVEC, Vector
+from sqlalchemy import BigInteger, Column, MetaData, Table
+
+from src import schema
+from src.models import IndexSpec, UCRCourseDB
+from src.schema import check_search_config, check_name_vector, index_key, migrate_name_vector, prepare_table
+from src.settings import Settings, settings
+
+hnsw = IndexSpec('name_vector', 'hnsw', m=16, ef_construction=64)
+
+
+def scheme(column_type):
+    table = Table('t', MetaData(), Column('id', BigInteger, primary_key=True), Column('name_vector', column_type))
+    return SimpleNamespace(__tablename__='t', __table__=table)
+
+
+def test_default_name_vector_is_indexable():
+    # stored as a full precision vector, indexed through a halfvec cast
+    assert index_key(UCRCourseDB, hnsw) == '(name_vector::halfvec(3072)) halfvec_cosine_ops'
+
+
+def test_unindexable_name_vector_fails():
+    assert index_key(scheme(Vector(1536)), hnsw) == 'name_vector vector_cosine_ops'
+    assert index_key(scheme(HALFVEC(3072)), hnsw) == 'name_vector halfvec_cosine_ops'
+    for column_type in (Vector(4096), Vector(), HALFVEC(4096)):
+        with pytest.raises(ValueError):
+            index_key(scheme(column_type), hnsw)
+
+
+class RecordingConnection:
+    """Stands in for the DDL connection, answering the catalog queries."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        self.statements.append(sql)
+        for fragment, rows in self.answers.items():
+            if fragment in sql:
+                return SimpleNamespace(scalar=lambda: rows[0], scalars=lambda: SimpleNamespace(all=lambda: rows))
+        return None
+
+
+def test_name_vector_indexes_are_dropped_before_the_type_changes():
+    conn = RecordingConnection({'format_type': ['vector(1536)'],
+                                'relname': [f'{UCRCourseDB.__tablename__}_name_vector_hnsw']})
+    migrate_name_vector(conn, UCRCourseDB)
+    drop = next(i for i, sql in enumerate(conn.statements) if sql.startswith('DROP INDEX'))
+    alter = next(i for i, sql in enumerate(conn.statements) if sql.startswith('ALTER TABLE'))
+    assert drop < alter
+    assert 'TYPE vector(3072)' in conn.statements[alter]
+
+
+@pytest.mark.parametrize('current', ['vector(3072)', 'vector', None])
+def test_matching_name_vector_passes(current):
+    check_name_vector(RecordingConnection({'format_type': [current]}), UCRCourseDB)
+
+
+def test_prepare_table_leaves_a_mismatched_name_vector_alone(monkeypatch):
+    # a crawl fails before touching the column, only --migrate alters it
+    monkeypatch.setattr(UCRCourseDB.__table__, 'create', lambda conn, checkfirst: None)
+    monkeypatch.setattr(schema, 'migrate_columns', lambda conn, scheme: None)
+    monkeypatch.setattr(schema, 'migrate_search_vector', lambda conn, scheme: None)
+    answers = {'format_type': ['halfvec(3072)'], 'relname': []}
+    conn = RecordingConnection(answers)
+    with pytest.raises(ValueError, match='--migrate'):
+        prepare_table(conn, UCRCourseDB)
+    assert not any(sql.startswith(('ALTER', 'DROP')) for sql in conn.statements)
+    conn = RecordingConnection(answers)
+    prepare_table(conn, UCRCourseDB, migrate=True)
+    assert any('ALTER COLUMN name_vector TYPE vector(3072)' in sql for sql in conn.statements)
+
+
+@pytest.mark.parametrize('field, value', [
+    ('search_config', "english', x)) STORED; DROP TABLE t; --"),
+    ('search_config', 'pg_catalog.'),
+    ('index_maintenance_work_mem', "1GB'; RESET ALL; --"),
+    ('index_maintenance_work_mem', 'lots'),
+])
+def test_ddl_settings_are_validated(field, value):
+    with pytest.raises(ValidationError):
+        Settings(**{field: value})
+
+
+def test_ddl_settings_accept_postgres_values():
+    configured = Settings(search_config='pg_catalog.simple', index_maintenance_work_mem='512 MB')
+    assert configured.search_config == 'pg_catalog.simple'
+
+
+def test_unknown_search_config_fails(monkeypatch):
+    monkeypatch.setattr(settings, 'search_config', 'klingon')
+    with pytest.raises(ValueError):
+        check_search_config(RecordingConnection({'pg_ts_config': [None]}))
+    check_search_config(RecordingConnection({'pg_ts_config': ['english']}))
@@ -0,0 +1,109 @@
+import re
+from types import SimpleNamespace
+
+from src.models import UCRCourseDB
+from src.staging import create_staging, finish_staging, rollback_swap, swap_staging
+
+T = UCRCourseDB.__tablename__
+SEQUENCE = f'public.{T}_id_seq'
+
+
+class Catalog:
+    """Stands in for the DDL connection, keeping the tables' indexes up to date with the renames."""
+
+    def __init__(self, tables):
+        # table -> {index name: (definition, constraint type)}
+        self.tables = tables
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        self.statements.append(sql)
+        table = (params or {}).get('table')
+        if 'obj_description' in sql:
+            return SimpleNamespace(all=lambda: [])
+        if 'pg_get_indexdef' in sql:
+            return [(name, *index) for name, index in self.tables.get(table, {}).items()]
+        if 'pg_get_serial_sequence' in sql:
+            return SimpleNamespace(scalar=lambda: SEQUENCE if table in self.tables else None)
+        if match := re.fullmatch(r'ALTER INDEX (\S+) RENAME TO (\S+)', sql):
+            indexes = next(indexes for indexes in self.tables.values() if match[1] in indexes)
+            indexes[match[2]] = indexes.pop(match[1])
+        elif match := re.fullmatch(r'ALTER TABLE (\S+) RENAME TO (\S+)', sql):
+            self.tables[match[2]] = self.tables.pop(match[1])
+        elif match := re.fullmatch(r'DROP TABLE IF EXISTS (\S+)', sql):
+            self.tables.pop(match[1], None)
+        return None
+
+    def ddl(self):
+        """The statements that change something, without the catalog reads and settings."""
+        return [sql for sql in self.statements if not sql.startswith(('SELECT', 'SET'))]
+
+
+def generation(suffix=''):
+    return {f'{T}_pkey{suffix}': (f'CREATE UNIQUE INDEX {T}_pkey{suffix} ON public.{T} USING btree (id)', 'p'),
+            f'{T}_name_vector_hnsw{suffix}': ('CREATE INDEX ...', None)}
+
+
+def test_staging_is_an_unlogged_copy():
+    conn = Catalog({T: generation()})
+    create_staging(conn, UCRCourseDB)
+    assert conn.ddl() == [
+        f'DROP TABLE IF EXISTS {T}__staging',
+        f'CREATE UNLOGGED TABLE {T}__staging (LIKE {T} INCLUDING DEFAULTS INCLUDING GENERATED)']
+
+
+def test_finished_staging_has_the_live_indexes_under_stg_names():
+    conn = Catalog({T: {**generation(), f'{T}_code': (f'CREATE INDEX {T}_code ON ONLY public.{T} (code)', None)},
+                    f'{T}__staging': {}})
+    finish_staging(conn, UCRCourseDB)
+    ddl = conn.ddl()
+    assert ddl[:3] == [
+        f'CREATE UNIQUE INDEX {T}_pkey_stg ON {T}__staging USING btree (id)',
+        f'ALTER TABLE {T}__staging ADD CONSTRAINT {T}_pkey_stg PRIMARY KEY USING INDEX {T}_pkey_stg',
+        f'CREATE INDEX {T}_code_stg ON {T}__staging (code)']
+    # declared indexes are built from their spec, not copied from the live table
+    assert f'CREATE INDEX {T}_name_vector_hnsw_stg ON {T}__staging USING hnsw' \
+           f' ((name_vector::halfvec(3072)) halfvec_cosine_ops) WITH (ef_construction = 64, m = 16)' in ddl
+    assert f'CREATE INDEX {T}_search_vector_gin_stg ON {T}__staging USING gin (search_vector)' in ddl
+    assert ddl[-2:] == [f'ALTER TABLE {T}__staging SET LOGGED', f'ANALYZE {T}__staging']
+
+
+def test_swap_renames_indexes_and_moves_the_sequence():
+    conn = Catalog({T: generation(), f'{T}__staging': generation('_stg'), f'{T}__previous': generation('_prev')})
+    swap_staging(conn, UCRCourseDB)
+    assert conn.ddl() == [
+        f'LOCK TABLE {T} IN ACCESS EXCLUSIVE MODE',
+        f'DROP TABLE IF EXISTS {T}__previous',
+        f'ALTER INDEX {T}_pkey RENAME TO {T}_pkey_prev',
+        f'ALTER INDEX {T}_name_vector_hnsw RENAME TO {T}_name_vector_hnsw_prev',
+        f'ALTER TABLE {T} RENAME TO {T}__previous',
+        f'ALTER INDEX {T}_pkey_stg RENAME TO {T}_pkey',
+        f'ALTER INDEX {T}_name_vector_hnsw_stg RENAME TO {T}_name_vector_hnsw',
+        f'ALTER TABLE {T}__staging RENAME TO {T}',
+        # the sequence went along with the old table, the new live one takes it over
+        f'ALTER SEQUENCE {SEQUENCE} OWNED BY {T}.id']
+    assert set(conn.tables) == {T, f'{T}__previous'}
+    assert set(conn.tables[T]) == set(generation())
+    assert set(conn.tables[f'{T}__previous']) == set(generation('_prev'))
+
+
+def test_rollback_swaps_the_generations_back():
+    live, previous = generation(), generation('_prev')
+    conn = Catalog({T: live, f'{T}__previous': previous})
+    rollback_swap(conn, UCRCourseDB)
+    assert conn.ddl() == [
+        f'LOCK TABLE {T}, {T}__previous IN ACCESS EXCLUSIVE MODE',
+        f'ALTER INDEX {T}_pkey RENAME TO {T}_pkey_swp',
+        f'ALTER INDEX {T}_name_vector_hnsw RENAME TO {T}_name_vector_hnsw_swp',
+        f'ALTER TABLE {T} RENAME TO {T}__swap',
+        f'ALTER INDEX {T}_pkey_prev RENAME TO {T}_pkey',
+        f'ALTER INDEX {T}_name_vector_hnsw_prev RENAME TO {T}_name_vector_hnsw',
+        f'ALTER TABLE {T}__previous RENAME TO {T}',
+        f'ALTER INDEX {T}_pkey_swp RENAME TO {T}_pkey_prev',
+        f'ALTER INDEX {T}_name_vector_hnsw_swp RENAME TO {T}_name_vector_hnsw_prev',
+        f'ALTER TABLE {T}__swap RENAME TO {T}__previous',
+        f'ALTER SEQUENCE {SEQUENCE} OWNED BY {T}.id']
+    # the same index objects, live and previous traded places
+    assert conn.tables[T] is previous and conn.tables[f'{T}__previous'] is live
+    assert set(previous) == set(generation()) and set(live) == set(generation('_prev'))
@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+from src import sync
+from src.models import UCRCourseDB, data_columns
+from src.settings import settings
+import asyncio
+
+
+class FakeSession:
+    """Stands in for both sessions of sync_rows, reading ``existing`` and recording updates."""
+
+    def __init__(self, existing, updates):
+        self.existing = existing
+        self.updates = updates
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def begin(self):
+        return self
+
+    async def execute(self, statement):
+        if statement.is_select:
+            return SimpleNamespace(all=lambda: self.existing)
+        self.updates.append(statement.compile().params)
+
+
+def scraped():
+    # LLM-extracted UCR rows often come without a section
+    return [UCRCourseDB(source_url='https://classes.usc.edu/term-20251/classes/drns/', section=None,
+                        offering_title='Dornsife Seminar'),
+            UCRCourseDB(source_url='https://classes.usc.edu/term-20251/classes/drns/', section='10001',
+                        offering_title='Dornsife Lab')]
+
+
+def stored(rows):
+    columns = data_columns(UCRCourseDB)
+    return [SimpleNamespace(id=i + 1, deleted=0, content_hash=sync.content_hash(row, columns),
+                            embedding_hash=None, full_text_hash=None, source_url=row.source_url, section=row.section)
+            for i, row in enumerate(rows)]
+
+
+def catalog(pages, sections):
+    return [UCRCourseDB(source_url=f'https://classes.usc.edu/term-20251/classes/{page}/', section=f'{page}-{i}',
+                        offering_title=f'{page} {i}') for page in pages for i in range(sections)]
+
+
+def run_sync(monkeypatch, existing, rows, failed=()):
+    updates = []
+    monkeypatch.setattr(sync, 'AsyncSessionLocal', lambda: FakeSession(existing, updates))
+    return asyncio.run(sync.sync_rows(UCRCourseDB, rows, failed=failed)), updates
+
+
+def deleted_ids(updates):
+    return sorted(i for params in updates if params.get('deleted') == 1 for i in params['id_1'])
+
+
+def test_rows_without_a_whole_key_are_matched_by_hash(monkeypatch):
+    new_rows, updates = run_sync(monkeypatch, stored(scraped()), scraped())
+    assert new_rows == []
+    assert updates == []
+
+
+def test_changed_row_without_a_key_replaces_its_old_copy(monkeypatch):
+    # one of the two rows is replaced, more than the default share a sync may delete
+    monkeypatch.setattr(settings, 'load_sync_max_deleted', 0.5)
+    rows = scraped()
+    rows[0].offering_title = 'Dornsife Seminar II'
+    new_rows, updates = run_sync(monkeypatch, stored(scraped()), rows)
+    assert new_rows == [rows[0]]
+    # only the old keyless copy is soft-deleted
+    assert [(params['id_1'], params['deleted']) for params in updates] == [([1], 1)]
+
+
+def test_rows_of_a_failed_unit_are_kept(monkeypatch):
+    pages = ['drns', 'ali', 'amst', 'anth', 'arcg', 'arab', 'ahis', 'astr', 'bisc', 'cgsc']
+    existing = stored(catalog(pages, 3))
+
+    async def crawl():
+        # what the spider does when a page's fetch or extraction fails after its retries
+        failed = []
+        sync.failed_units.set(failed)
+        sync.unit_failed(source_url='https://classes.usc.edu/term-20251/classes/ali/')
+        return catalog(pages[:1] + pages[2:], 3), failed
+    rows, failed = asyncio.run(crawl())
+    # a section that really vanished from a page that loaded
+    rows = [row for row in rows if row.section != 'anth-2']
+    new_rows, updates = run_sync(monkeypatch, existing, rows, failed)
+    assert new_rows == []
+    assert deleted_ids(updates) == [old.id for old in existing if old.section == 'anth-2']
+
+
+def test_outage_deletes_nothing(monkeypatch):
+    existing = stored(catalog(['drns', 'ali'], 3))
+    _, updates = run_sync(monkeypatch, existing, [])
+    assert deleted_ids(updates) == []
+    # most of the pages came back empty without reporting a failure
+    _, updates = run_sync(monkeypatch, existing, catalog(['drns'], 1))
+    assert deleted_ids(updates) == []